@@ -8,6 +8,17 @@ SERVER_URL = config["cgi_server_url"]
 SILO_SERVER_URL = config["silo_server_url"]
 PORT = config["silo_server_port"]
 SILO_SERVER_URL = f"{SILO_SERVER_URL}:{PORT}"
+REPO_URL = config.get("student_repos", {}).get("url", "git@github.iu.edu:csci-b351-sp19/%s-submission.git")
+STARTER_REPO_URL = config.get("student_repos", {}).get("starter_url")
 
 from .utils.canvas import Canvas
-canvas = Canvas(config["canvas"]["token"], config["canvas"]["course_id"], config["canvas"]["URL"])
\ No newline at end of file
+canvas = Canvas(config["canvas"]["token"], config["canvas"]["course_id"], config["canvas"]["URL"])
+
+from .utils.roster import Roster
+roster = Roster(canvas, config["roster"]["location"], config["roster"].get("ttl", 3600))
+
+from .utils.github import GitHub
+github = GitHub(config.get("token_cache", {}))
+
+from .utils.sessions import Sessions
+sessions = Sessions(config.get("sessions", {}), github)
\ No newline at end of file
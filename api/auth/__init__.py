@@ -5,5 +5,5 @@ from ..utils import load_config
 
 config = load_config(CONF_FILE)
 
-from .. import SERVER_URL
+from .. import SERVER_URL, sessions
 SERVER_URL += "/auth"
\ No newline at end of file
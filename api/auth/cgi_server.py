@@ -1,11 +1,24 @@
-from . import SERVER_URL, config
-from flask import Blueprint, request, redirect
+from . import SERVER_URL, config, sessions
+from flask import Blueprint, request, redirect, jsonify
 from flask_cors import CORS
-import requests
+from urllib.parse import urlencode
+
+from ..utils import lazy_import
+requests = lazy_import('requests')
 
 app =  Blueprint('auth', __name__)
 CORS(app, resources=r'/*', allow_headers='Content-Type')
 
+def _is_admin(app_name, login):
+    if app_name == 'battles':
+        from ..battles import INSTRUCTORS
+    else:
+        from ..grading_tool import INSTRUCTORS
+    for instructor in INSTRUCTORS:
+        if instructor["login_id"] == login.lower():
+            return True
+    return False
+
 ## GET /login
 # Redirects user to GitHub.IU OAuth authorize page for the b351 OAuth App
 @app.route('/login')
@@ -19,7 +32,8 @@ def login():
 
 ## GET /verify
 # Verifies the user using the access code. This is the redirect URI for the GitHub
-# OAuth process after authorization. Returns user to main site.
+# OAuth process after authorization. Returns user to main site along with a signed
+# session token, which the other blueprints can check without calling GitHub.
 @app.route('/verify/<app_name>')
 def verify(app_name):
     app_config = config[app_name]
@@ -31,7 +45,38 @@ def verify(app_name):
         r = requests.post('https://github.iu.edu/login/oauth/access_token', data = {'client_id':github['client_id'], 'client_secret': github['client_secret'], 'code': code})
         response = r.text
         access_token = response.split('&')[0].split('=')[1]
-        
-        return redirect(app_config['SUCCESS'] + "?access_token=%s" % access_token)
+
+        params = {'access_token': access_token}
+        user, status = sessions.github.getUser(access_token)
+        if user:
+            session_token = sessions.issue(user, app_name, _is_admin(app_name, user['login']))
+            if session_token:
+                params['session_token'] = session_token
+
+        return redirect(app_config['SUCCESS'] + "?" + urlencode(params))
     except:
-        return redirect(app_config['ERROR'])
\ No newline at end of file
+        return redirect(app_config['ERROR'])
+
+## GET /refresh?session_token=[token]
+# Exchanges a (possibly expired) session token for a fresh one, as long as the
+# session hasn't been revoked or outlived its refresh window.
+@app.route('/refresh', methods=['GET', 'POST'])
+def refresh():
+    token = request.values.get('session_token')
+    if not token:
+        return "No session token given", 400
+    session_token = sessions.refresh(token)
+    if not session_token:
+        return "Session can no longer be refreshed, please log in again", 401
+    return jsonify(session_token)
+
+## GET /logout?session_token=[token]
+# Revokes the session the given token belongs to.
+@app.route('/logout', methods=['GET', 'POST'])
+def logout():
+    token = request.values.get('session_token')
+    if not token:
+        return "No session token given", 400
+    if not sessions.revoke(token):
+        return "Invalid session token", 400
+    return jsonify(True)
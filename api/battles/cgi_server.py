@@ -2,17 +2,16 @@ from flask import Blueprint, jsonify, request, redirect, send_from_directory, se
 from datetime import date, datetime
 from functools import reduce
 from flask_cors import CORS
-import requests
-import shutil
-import json
-import git
 import os
 
+from ..utils.silo import SiloClient, SiloUnavailable
+
 from . import SITE_URL, SERVER_URL, SILO_SERVER_URL, REPOS_DIR, INSTRUCTORS, SECRET_KEY
 from . import db
-from . import canvas
+from . import roster, sessions
 
 silo_headers = {"secret_key": SECRET_KEY}
+silo = SiloClient(SILO_SERVER_URL, silo_headers)
 
 app =  Blueprint('battles', __name__)
 CORS(app, resources=r'/*', allow_headers='Content-Type')
@@ -25,13 +24,9 @@ CORS(app, resources=r'/*', allow_headers='Content-Type')
 # Gets details about student using the supplied GitHub access token
 @app.route('/student')
 def student():
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     return jsonify({
         'login': user['login'],
@@ -45,13 +40,9 @@ def get_standings():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     ##
     # Get a database connection
@@ -64,7 +55,7 @@ def get_standings():
         ##
         login = user['login'].lower()
 
-        if login not in [student['login_id'] for student in canvas.getStudents()]:
+        if not roster.isMember(login):
             if login not in [instructor['login_id'] for instructor in INSTRUCTORS]:
                 return "Sorry, you don't seem to be an authorized user!", 401
 
@@ -91,13 +82,9 @@ def get_player():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     ##
     # Get a database connection
@@ -115,7 +102,7 @@ def get_player():
         # check if that player exists
         ##
         if not player:
-            if login not in [student['login_id'] for student in canvas.getStudents()]:
+            if not roster.isMember(login):
                 if login not in [instructor['login_id'] for instructor in INSTRUCTORS]:
                     ## Return a big fat not authorized ERROR!!
                     return "Sorry, you don't seem to be an authorized user!", 401
@@ -144,13 +131,9 @@ def get_screenname():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     conn, c = db.getConnection()
     with conn:
@@ -184,13 +167,9 @@ def set_screenname():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     conn, c = db.getConnection()
     with conn:
@@ -232,13 +211,9 @@ def get_matchups():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     conn, c = db.getConnection()
     with conn:
@@ -275,13 +250,9 @@ def get_all_matchups():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     conn, c = db.getConnection()
     with conn:
@@ -319,13 +290,9 @@ def enroll_current_comment():
     ##
     # Authenticate user
     ##
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'battles')
+    if error:
+        return error
 
     #return  "The deadline to enroll has passed.", 300
 
@@ -350,11 +317,15 @@ def enroll_current_comment():
     ##
     # Call silo server to deal with git stuff
     ##
-    a = requests.get(f"{SILO_SERVER_URL}/{login}/enroll", headers=silo_headers)
+    a = silo.get(f"/{login}/enroll", idempotent=False, timeout=120)
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
 
+@app.errorhandler(SiloUnavailable)
+def silo_unavailable(e):
+    return 'Battles server unreachable - email Kyle for support.', 503
+
 #########################
 ### Utility Functions ###
 #########################
@@ -1,13 +1,13 @@
 import os
 import datetime
-import shutil
 
 from flask import jsonify, request, send_from_directory, Blueprint
 import json
-import git
 
-from . import REPOS_DIR, SECRET_KEY
+from . import REPOS_DIR, SECRET_KEY, repos
 from . import db
+from ..utils import lazy_import
+git = lazy_import('git')
 
 app =  Blueprint('battles', __name__)
 app.secret_key = SECRET_KEY
@@ -21,43 +21,20 @@ def authenticate():
 
 def _clone_repo_reset(login):
     ''' Not as dangerous as it looks, but still pretty dangerous. '''
-    user_dir = "%s/%s" % (REPOS_DIR, login)
-    repo_dir = "%s/battles" % user_dir
-    try:
-        if os.path.isdir(repo_dir):
-            shutil.rmtree(repo_dir)
-    except Exception:
-        # we no longer have control over this user's repository
-        return None
-    os.mkdir(repo_dir)
-    try:
-        repo = git.Repo.clone_from("git@github.iu.edu:csci-b351-sp19/%s-submission.git" % login, repo_dir)
-        return repo
-    except:
-        return None
+    return repos.reset(login, "battles")
 
 @app.route('/update_repo/<login>')
 def update_repo(login):
     user_dir = "%s/%s" % (REPOS_DIR, login)
-    repo_dir = "%s/battles" % user_dir
     
     if not os.path.isdir(user_dir):
         os.mkdir(user_dir)
 
-    if os.path.isdir(repo_dir): # pull the repo if it exists
-        try:
-            repo = git.Repo(repo_dir, search_parent_directories=True)
-            repo.git.reset('--hard')
-            repo.git.clean('-fxd')
-            repo.remotes.origin.pull()
-        except:
-            repo = _clone_repo_reset(login)
-            if not repo:
-                return 'Could not find repository.', 404
-    else: # clone it using SSH if not (b351@silo ssh key is in my github account)
-        repo = _clone_repo_reset(login)
-        if not repo:
-            return 'Could not find repository.', 404
+    # a worktree of the same mirror as the grading tool's checkout (see utils/repos.py)
+    sync = repos.update(login, "battles")
+    if not sync:
+        return 'Could not find repository.', 404
+    repo = sync.repo
     
     # get latest commit number
     try:
@@ -88,7 +65,7 @@ def _get_last_commit(login, retry=True):
     try:
         ## a4 since this is the battles version ayooo
         assignment_id = "a4"
-        commit = max(repo.iter_commits(paths=assignment_id), key=lambda c: c.authored_datetime)
+        commit = repo.commit(repos.getLastCommit(login, assignment_id, head_commit))
     except:
         # we expect to have commits since we have the directory.
         # if we don't, something is up.
@@ -170,8 +147,11 @@ def get_next_matchup():
     p1_folder = f"{REPOS_DIR}/{p1_username}/battles/a4"
     p2_folder = f"{REPOS_DIR}/{p2_username}/battles/a4"
     
-    player_1_files = (open(p1_folder + "/player.py").read(), open(p1_folder + "/board.py").read())
-    player_2_files = (open(p2_folder + "/player.py").read(), open(p2_folder + "/board.py").read())
+    # not while a sync resets their worktrees (see utils/repos.py)
+    with repos.lockedPath(p1_folder):
+        player_1_files = (open(p1_folder + "/player.py").read(), open(p1_folder + "/board.py").read())
+    with repos.lockedPath(p2_folder):
+        player_2_files = (open(p2_folder + "/player.py").read(), open(p2_folder + "/board.py").read())
     return jsonify((matchupid, player_1_files, player_2_files))
 
 @app.route('/matchups/<matchup_id>/matches/next')
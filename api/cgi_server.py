@@ -0,0 +1,14 @@
+from flask import Flask
+from flask_cors import CORS
+from .grading_tool.cgi_server import app as grading_tool
+from .battles.cgi_server import app as battles
+from .auth.cgi_server import app as auth
+
+## The combined app served to the front-end. `api.cgi` runs it once per request
+## through CGI, and `run_app_server.py` keeps it loaded in long-lived workers.
+app = Flask(__name__)
+CORS(app, resources=r'/*', allow_headers='Content-Type')
+
+app.register_blueprint(grading_tool, url_prefix="/grading-tool")
+app.register_blueprint(battles, url_prefix="/battles")
+app.register_blueprint(auth, url_prefix="/auth")
@@ -1,11 +1,7 @@
 import os
 CONF_FILE = os.path.join(os.path.dirname(__file__), 'confs/server.conf')
 
-import json
-def load_config(file_path):
-    with open(file_path) as json_data_file:
-        data = json.load(json_data_file)
-    return data
+from ..utils import load_config
 
 config = load_config(CONF_FILE)
 
@@ -15,8 +11,14 @@ SITE_URL = config["site_url"]
 ASSIGNMENTS = config["assignments"]
 GRADING_TOOLS_DIR = config["grading_tools_dir"]
 DB_FILE = config["database_location"]
+DB_JOURNAL_MODE = config.get("database_journal_mode", "WAL")
 SECRET_KEY = config["secret_key"]
+FAIR_SHARE = config.get("fair_share", {})
+WEBHOOK_SECRET = config.get("webhook_secret", "")
 
-from .. import SERVER_URL, SILO_SERVER_URL, canvas
+from .. import SERVER_URL, SILO_SERVER_URL, REPO_URL, STARTER_REPO_URL, canvas, roster, github, sessions
 SILO_SERVER_URL += "/grading-tool"
-SERVER_URL += "/grading-tool"
\ No newline at end of file
+SERVER_URL += "/grading-tool"
+
+from ..utils.repos import StudentRepos
+repos = StudentRepos(REPOS_DIR, REPO_URL, STARTER_REPO_URL)
\ No newline at end of file
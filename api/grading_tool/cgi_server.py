@@ -1,31 +1,70 @@
 from . import SITE_URL, SERVER_URL, SILO_SERVER_URL, REPOS_DIR, INSTRUCTORS, ASSIGNMENTS, SECRET_KEY
 from . import database as db
-from . import canvas
+from . import roster, github, sessions
 
 from flask import Blueprint, jsonify, request, redirect, send_from_directory, send_file, Response
 from datetime import date, datetime
 from flask_cors import CORS
-import requests
-import shutil
-import json
-import git
 import os
 
+from ..utils.silo import SiloClient, SiloUnavailable
+from ..utils import lazy_import
+requests = lazy_import('requests')
+
 app =  Blueprint('grading-tool', __name__)
 CORS(app, resources=r'/*', allow_headers='Content-Type')
 
 silo_headers = {"secret_key": SECRET_KEY}
+silo = SiloClient(SILO_SERVER_URL, silo_headers)
+
+# test and submit routes pull the student's repo on the silo server before answering
+SLOW_TIMEOUT = 120
+EVENTS_READ_TIMEOUT = 60
 
 def checkJob(job_id):
+    """
+    Returns the job's status from the silo server in one call:
+    a dict with `finished`, `failed` and `position` (see silo_server.status).
+    """
     if not job_id:
-        return False
-    r = requests.get("%s/check/%s" % (SILO_SERVER_URL, job_id), headers=silo_headers)
-    result = r.json()
-    if r.status_code == 200:
-        job_is_finished = bool(result)
-    else:
-        job_is_finished = True # (?)
-    return job_is_finished
+        return {'finished': False, 'failed': False, 'position': 0}
+    r = silo.get("/check/%s/status" % job_id)
+    if r.status_code != 200:
+        return {'finished': True, 'failed': False, 'position': 0} # (?)
+    return r.json()
+
+# headers passed through between the browser and the silo server for report downloads
+FORWARDED_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since')
+FORWARDED_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding', 'ETag', 'Last-Modified', 'Vary')
+CHUNK_SIZE = 64 * 1024
+
+def _proxyFile(path):
+    """
+    Streams a report from the silo server to the browser in chunks instead of reading
+    it into memory, forwarding the conditional-request headers both ways so repeat
+    downloads of an unchanged report are answered with a 304. Gzipped reports are
+    passed through still compressed when the browser accepts gzip.
+    """
+    headers = {h: request.headers[h] for h in FORWARDED_REQUEST_HEADERS if h in request.headers}
+    headers['Accept-Encoding'] = 'gzip' if 'gzip' in request.headers.get('Accept-Encoding', '') else 'identity'
+    a = silo.get(path, headers=headers, stream=True)
+    if a.status_code == 500:
+        a.close()
+        return 'Internal server error - email Kyle for support.', 500
+
+    def generate():
+        try:
+            for chunk in a.raw.stream(CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            a.close()
+
+    response_headers = {h: a.headers[h] for h in FORWARDED_RESPONSE_HEADERS if h in a.headers}
+    return Response(generate(), status=a.status_code, headers=response_headers)
+
+@app.errorhandler(SiloUnavailable)
+def silo_unavailable(e):
+    return 'Grading server unreachable - email Kyle for support.', 503
 
 def is_admin(login):
     for instructor in INSTRUCTORS:
@@ -53,13 +92,9 @@ def hello():
 # Gets details about student using the supplied GitHub access token
 @app.route('/student')
 def student():
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
     # TODO: Move to silo server
     student_id = db.getStudentID(user['login'].lower())
@@ -83,35 +118,65 @@ def _parseStudent(student):
 
 @app.route('/students')
 def students():
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
     if not is_admin(user['login'].lower()):
         return "Not authorized", 400
 
-    students = canvas.getStudents()
+    students = roster.getStudents()
     students[:] = [s for s in students if s.get('name') != "Test Student"]
     students = list(map(_parseStudent, students))
     students.extend(map(_parseStudent, INSTRUCTORS))
 
     return jsonify(students)
 
+# special one for admins :)
+@app.route('/admin/token-cache')
+def token_cache_stats():
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
+
+    if not is_admin(user['login'].lower()):
+        return "Not authorized", 400
+
+    return jsonify(github.cacheStats())
+
+# special one for admins :)
+@app.route('/admin/queues')
+def queue_stats():
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
+
+    if not is_admin(user['login'].lower()):
+        return "Not authorized", 400
+
+    a = silo.get("/admin/queues/students" if request.args.get('students') else "/admin/queues")
+    return a.content, a.status_code, {'Content-Type': 'application/json'}
+
+# special one for admins :)
+@app.route('/admin/tools')
+def tool_versions():
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
+
+    if not is_admin(user['login'].lower()):
+        return "Not authorized", 400
+
+    a = silo.get("/admin/tools")
+    return a.content, a.status_code, {'Content-Type': 'application/json'}
+
 @app.route('/assignments/<assignment_id>')
 def getAssignment(assignment_id):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
-    a = requests.get(f"{SILO_SERVER_URL}/assignments/{assignment_id}/{user['login']}/info", headers=silo_headers)
+    a = silo.get(f"/assignments/{assignment_id}/{user['login']}/info")
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
@@ -119,18 +184,14 @@ def getAssignment(assignment_id):
 # special one for admins :)
 @app.route('/assignments/<assignment_id>/<login>')
 def getStudentAssignment(assignment_id, login):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
     if not is_admin(user['login'].lower()):
         return "Not authorized", 400
 
-    a = requests.get(f"{SILO_SERVER_URL}/assignments/{assignment_id}/{login}/info", headers=silo_headers)
+    a = silo.get(f"/assignments/{assignment_id}/{login}/info")
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
@@ -159,126 +220,118 @@ def getAssignments():
 # starts the tests for the student to the given assignment
 @app.route('/test/<assignment_id>/start')
 def test_assignment(assignment_id):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
-    a = requests.get(f"{SILO_SERVER_URL}/assignments/{assignment_id}/{user['login']}/test", headers=silo_headers)
+    a = silo.get(f"/assignments/{assignment_id}/{user['login']}/test", idempotent=False, timeout=SLOW_TIMEOUT)
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
 
 @app.route("/test/<assignment_id>/check/<job_key>")
 def check_job(assignment_id, job_key):
-    job_is_finished = checkJob(job_key)
+    status = checkJob(job_key)
 
-    if job_is_finished:
+    if status['finished']:
         return jsonify(True)
+    elif status['failed']:
+        return jsonify("Job failed"), 202
     else:
-        return jsonify(requests.get("%s/check/%s/position" % (SILO_SERVER_URL, job_key), headers=silo_headers).text), 202
+        # the front-end expects the position route's raw response body, as a JSON string
+        return jsonify("%s\n" % status['position']), 202
+
+## GET /test/<assignment_id>/events/<job_key>
+# Server-Sent Events stream of the job's status (see silo_server.events), relayed
+# from the silo server as it arrives. One of these replaces polling check_job; the
+# front-end should close its EventSource once a status is finished or failed.
+@app.route("/test/<assignment_id>/events/<job_key>")
+def job_events(assignment_id, job_key):
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
+
+    # the silo server sends a keep-alive at least every 15 seconds
+    a = silo.get("/check/%s/events" % job_key, stream=True, timeout=EVENTS_READ_TIMEOUT)
+    if a.status_code != 200:
+        body = a.content
+        a.close()
+        return body, a.status_code
+
+    def generate():
+        try:
+            for chunk in a.iter_content(chunk_size=None):
+                yield chunk
+        except requests.RequestException:
+            pass # the browser reconnects
+        finally:
+            a.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route("/test/<assignment_id>/download")
 def download_html_file(assignment_id):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
-
-    a = requests.get("%s/assignments/%s/%s/download_test" % (SILO_SERVER_URL, ASSIGNMENTS[assignment_id]["folder_name"], user['login']), headers=silo_headers)
-    if a.status_code == 500:
-        return 'Internal server error - email Kyle for support.', 500
-    return a.content, a.status_code
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
+
+    return _proxyFile("/assignments/%s/%s/download_test" % (ASSIGNMENTS[assignment_id]["folder_name"], user['login']))
 
 # special one for admins :)
 @app.route("/test/<assignment_id>/<login>/download")
 def download_students_test_html_file(assignment_id, login):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
 
     if not is_admin(user['login'].lower()):
         return "Not authorized", 400
 
-    a = requests.get("%s/assignments/%s/%s/download_test" % (SILO_SERVER_URL, ASSIGNMENTS[assignment_id]["folder_name"], login), headers=silo_headers)
-    if a.status_code == 500:
-        return 'Internal server error - email Kyle for support.', 500
-    return a.content, a.status_code
+    return _proxyFile("/assignments/%s/%s/download_test" % (ASSIGNMENTS[assignment_id]["folder_name"], login))
 
 # special one for admins :)
 @app.route("/initial/<assignment_id>/<login>/download")
 def download_students_initial_html_file(assignment_id, login):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
 
     if not is_admin(user['login'].lower()):
         return "Not authorized", 400
 
-    a = requests.get("%s/admin/%s/%s/initial-feedback" % (SILO_SERVER_URL, login, ASSIGNMENTS[assignment_id]["folder_name"]), headers=silo_headers)
-    if a.status_code == 500:
-        return 'Internal server error - email Kyle for support.', 500
-    return a.content, a.status_code
+    return _proxyFile("/admin/%s/%s/initial-feedback" % (login, ASSIGNMENTS[assignment_id]["folder_name"]))
 
 # special one for admins :)
 @app.route("/revision/<assignment_id>/<login>/download")
 def download_students_revision_html_file(assignment_id, login):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
 
     if not is_admin(user['login'].lower()):
         return "Not authorized", 400
 
-    a = requests.get("%s/admin/%s/%s/revision-feedback" % (SILO_SERVER_URL, login, ASSIGNMENTS[assignment_id]["folder_name"]), headers=silo_headers)
-    if a.status_code == 500:
-        return 'Internal server error - email Kyle for support.', 500
-    return a.content, a.status_code
+    return _proxyFile("/admin/%s/%s/revision-feedback" % (login, ASSIGNMENTS[assignment_id]["folder_name"]))
 
 @app.route('/submit/<assignment_id>/initial')
 def submit_initial(assignment_id):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
-    a = requests.get(f"{SILO_SERVER_URL}/assignments/{assignment_id}/{user['login']}/submit_initial", headers=silo_headers)
+    a = silo.get(f"/assignments/{assignment_id}/{user['login']}/submit_initial", idempotent=False, timeout=SLOW_TIMEOUT)
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
 
 @app.route('/submit/<assignment_id>/revision')
 def submit_revision(assignment_id):
-    code = request.args.get('access_token')
-    if not code:
-        return "No access code given", 400
-    r = requests.get("https://github.iu.edu/api/v3/user?access_token=%s" % code)
-    if r.status_code != requests.codes.ok:
-        return "Issue retrieving user based on given access code", r.status_code
-    user = r.json()
+    user, error = sessions.authenticate(request.args, 'grading_tool')
+    if error:
+        return error
     
-    a = requests.get(f"{SILO_SERVER_URL}/assignments/{assignment_id}/{user['login']}/submit_revision", headers=silo_headers)
+    a = silo.get(f"/assignments/{assignment_id}/{user['login']}/submit_revision", idempotent=False, timeout=SLOW_TIMEOUT)
     if a.status_code == 500:
         return 'Internal server error - email Kyle for support.', 500
     return a.content, a.status_code
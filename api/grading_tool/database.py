@@ -1,17 +1,20 @@
 from . import INSTRUCTORS
 
+from contextlib import contextmanager
 from datetime import datetime, date
+import threading
 import sqlite3
 import string
 import random
 import json
+import os
 
 """  gradingtool.db
  ---------------   ---------------    ------------------
 | students      | | assignments   |  | submissions      |
 |---------------| |---------------|  |------------------|
-| PK id         | | PK id         |  | FK student_id    |
-| username      | | unlock_date   |  | FK assignment_id |
+| PK id         | | PK id         |  | PK student_id    |
+| username      | | unlock_date   |  | PK assignment_id |
 | student_group | | initial_date  |  | test_commit      |
  ---------------  | revision_date |  | job_id           |
                    ---------------   | initial_date     |
@@ -19,24 +22,92 @@ import json
                                      | initial_commit   |
                                      | revision_commit  |
                                       ------------------
+ ---------------   ---------------
+| results       | | reports       |   results: cached grading reports, keyed by what was
+|---------------| |---------------|   graded (see results.py). reports: the version of the
+| PK key        | | PK path       |   grading tools (see tools.py) behind every report
+| html          | | assignment    |   written to a student's folder.
+| result        | | tool_version  |
+| created       | | graded        |
+| last_used     |  ---------------
+| assignment    |
+| tool_version  |
+ ---------------
+ students.username, results.last_used and the (assignment, tool_version) of results and
+ reports are indexed. Schema changes go through migrations.py.
 """
 
-from . import DB_FILE
+from . import DB_FILE, DB_JOURNAL_MODE
+from . import migrations
 
 TOOL_BASED = 0
 TOOL_ASSISSTED = 1
 UNKNOWN = 2
 
+# Each thread keeps one connection open for as long as the process lives (re-opened after
+# a fork, since RQ forks a work horse per job). The CGI process and the silo server both
+# write to this database, so it is put in WAL mode (readers don't block the writer) and
+# waits up to BUSY_TIMEOUT ms for a lock instead of failing with `database is locked`.
+BUSY_TIMEOUT = 30000
+_local = threading.local()
+
+def _connect():
+    """
+    Returns this thread's connection to DB_FILE, opening it if needed.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT / 1000, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA busy_timeout=%d" % BUSY_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=%s" % DB_JOURNAL_MODE)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        migrations.migrate(conn)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return _local.conn
+
+@contextmanager
+def transaction(immediate=False):
+    """
+    Unit of work: every db function called inside the block runs in one transaction,
+    committed when the block ends (or rolled back if it raises). Blocks can be nested,
+    only the outermost one commits. Example:
+
+        with db.transaction(immediate=True):
+            student_id = db.getStudentID(login)
+            db.setCommit(student_id, assignment_id, commit)
+            db.setJob(student_id, assignment_id, job_id)
+
+    Args:
+        immediate (bool): Take the write lock when the transaction starts. Use it for
+                          blocks that read and then write, so they can't deadlock with
+                          another writer.
+    """
+    conn = _connect()
+    if _local.depth == 0:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.execute("ROLLBACK")
+        raise
+    else:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.execute("COMMIT")
+
 def _getConnection():
     """
-    This function creates a db connection and returns that and the cursor.
+    This function returns a transaction on this thread's db connection, and a cursor.
     Returns:
-        conn: the connection to the db DB_FILE
+        conn: a unit of work (see transaction) to use as `with conn:`
         c:    the cursor
     """
-    conn = sqlite3.connect(DB_FILE) # connect to our db
-    c = conn.cursor()
-    return conn, c
+    c = _connect().cursor()
+    return transaction(), c
 
 def _initDatabase():
     """
@@ -48,6 +119,7 @@ def _initDatabase():
     with conn:
         c.execute("DROP TABLE IF EXISTS students")
         c.execute("CREATE TABLE students (id integer PRIMARY KEY, username text, student_group integer)")
+        c.execute("CREATE INDEX students_username ON students (username)")
         c.execute("DROP TABLE IF EXISTS assignments")
         c.execute("CREATE TABLE assignments (id integer PRIMARY KEY, unlock_date DATE, initial_date DATE, revision_date DATE)")
         c.execute("DROP TABLE IF EXISTS submissions")
@@ -56,8 +128,19 @@ def _initDatabase():
                 test_commit text, job_id text,
                 initial_date date, revision_date date,
                 initial_commit text, revision_commit text,
+                PRIMARY KEY (student_id, assignment_id),
                 FOREIGN KEY (student_id) REFERENCES students (id),
                 FOREIGN KEY (assignment_id) REFERENCES assignments (id) ) ''')
+        c.execute("DROP TABLE IF EXISTS results")
+        c.execute(''' CREATE TABLE results
+                (key text PRIMARY KEY, html blob, result blob, created text, last_used text,
+                assignment text, tool_version text) ''')
+        c.execute("CREATE INDEX results_last_used ON results (last_used)")
+        c.execute("CREATE INDEX results_tool_version ON results (assignment, tool_version)")
+        c.execute("DROP TABLE IF EXISTS reports")
+        c.execute("CREATE TABLE reports (path text PRIMARY KEY, assignment text, tool_version text, graded text)")
+        c.execute("CREATE INDEX reports_tool_version ON reports (assignment, tool_version)")
+        c.execute("PRAGMA user_version=%d" % migrations.LATEST)
 
 def _addAssignments():
     assignments = [(9046890, date(2019, 1, 8), date(2019, 1, 15), date(2019, 1, 22)),
@@ -125,8 +208,7 @@ def getStudentID(login):
 def getJob(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT job_id FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("SELECT job_id FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         try:
             job_id = c.fetchone()[0]
         except Exception:
@@ -136,80 +218,144 @@ def getJob(student_id, assignment_id):
 def setJob(student_id, assignment_id, job_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "UPDATE submissions SET job_id=\"%s\" WHERE student_id=%s AND assignment_id=%s" % (job_id, student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("UPDATE submissions SET job_id=? WHERE student_id=? AND assignment_id=?", (job_id, student_id, assignment_id))
     return job_id
 
 def getCommit(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT test_commit FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("SELECT test_commit FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         commit = c.fetchone()[0]
     return commit
 
 def setCommit(student_id, assignment_id, commit):
     conn, c = _getConnection()
     with conn:
-        cmd = "UPDATE submissions SET test_commit=\"%s\" WHERE student_id=%s AND assignment_id=%s" % (commit, student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("UPDATE submissions SET test_commit=? WHERE student_id=? AND assignment_id=?", (commit, student_id, assignment_id))
     return commit
 
 def getInitialCommit(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT initial_commit FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("SELECT initial_commit FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         commit = c.fetchone()[0]
     return commit
 
 def getRevisionCommit(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT revision_commit FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("SELECT revision_commit FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         commit = c.fetchone()[0]
     return commit
 
 def submitInitial(student_id, assignment_id, commit, now):
     conn, c = _getConnection()
     with conn:
-        cmd = "UPDATE submissions SET initial_commit=\"%s\" WHERE student_id=%s AND assignment_id=%s" % (commit, student_id, assignment_id)
-        c.execute(cmd)
-        cmd = f"UPDATE submissions SET initial_date={now} WHERE student_id={student_id} AND assignment_id={assignment_id}"
-        c.execute(cmd)
+        c.execute("UPDATE submissions SET initial_commit=?, initial_date=? WHERE student_id=? AND assignment_id=?",
+            (commit, str(now), student_id, assignment_id))
     return commit
 
 def submitRevision(student_id, assignment_id, commit, now):
     conn, c = _getConnection()
     with conn:
-        cmd = "UPDATE submissions SET revision_commit=\"%s\" WHERE student_id=%s AND assignment_id=%s" % (commit, student_id, assignment_id)
-        c.execute(cmd)
-        cmd = f"UPDATE submissions SET revision_date={now} WHERE student_id={student_id} AND assignment_id={assignment_id}"
-        c.execute(cmd)
+        c.execute("UPDATE submissions SET revision_commit=?, revision_date=? WHERE student_id=? AND assignment_id=?",
+            (commit, str(now), student_id, assignment_id))
     return commit
 
 def getSubmission(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT * FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute("SELECT * FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         submission = c.fetchone()
     return submission
 
 def addSubmission(student_id, assignment_id):
     conn, c = _getConnection()
     with conn:
-        cmd = "SELECT * FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-        c.execute(cmd)
+        c.execute(''' INSERT INTO submissions(student_id, assignment_id) VALUES(?, ?)
+                ON CONFLICT(student_id, assignment_id) DO NOTHING ''', (student_id, assignment_id))
+        c.execute("SELECT * FROM submissions WHERE student_id=? AND assignment_id=?", (student_id, assignment_id))
         submission = c.fetchone()
-        if submission is None:
-            c.execute("INSERT INTO submissions(student_id, assignment_id) VALUES(?, ?)", (student_id, assignment_id))
-            cmd = "SELECT * FROM submissions WHERE student_id=%s AND assignment_id=%s" % (student_id, assignment_id)
-            c.execute(cmd)
-            submission = c.fetchone()
     return submission
 
+def getResult(key):
+    """
+    Returns:
+        tuple: (html, result, assignment, tool_version) stored under the given key, or
+               None. Marks the entry as used.
+    """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("SELECT html, result, assignment, tool_version FROM results WHERE key=?", (key,))
+        row = c.fetchone()
+        if row:
+            c.execute("UPDATE results SET last_used=? WHERE key=?", (str(datetime.now()), key))
+    return row
+
+def setResult(key, html, result, assignment=None, tool_version=None):
+    conn, c = _getConnection()
+    with conn:
+        now = str(datetime.now())
+        c.execute(''' INSERT OR REPLACE INTO results(key, html, result, created, last_used, assignment, tool_version)
+                VALUES(?, ?, ?, ?, ?, ?, ?) ''', (key, html, result, now, now, assignment, tool_version))
+    return key
+
+def pruneResults(before):
+    """
+    Deletes the results not used since `before` (a datetime).
+    Returns:
+        int: The number of results deleted.
+    """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("DELETE FROM results WHERE last_used < ?", (str(before),))
+        deleted = c.rowcount
+    return deleted
+
+def deleteStaleResults(assignment, tool_version):
+    """
+    Deletes the results of the given assignment made by other versions of its tools.
+    Returns:
+        int: The number of results deleted.
+    """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("DELETE FROM results WHERE assignment=? AND tool_version IS NOT ?", (assignment, tool_version))
+        deleted = c.rowcount
+    return deleted
+
+def setReport(path, assignment, tool_version):
+    """ Records that the report at `path` was just written by the given version of the tools. """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("INSERT OR REPLACE INTO reports(path, assignment, tool_version, graded) VALUES(?, ?, ?, ?)",
+            (path, assignment, tool_version, str(datetime.now())))
+    return path
+
+def getReport(path):
+    """
+    Returns:
+        tuple: (assignment, tool_version, graded) of the report at `path`, or None if it
+               was never recorded (e.g. written before reports were).
+    """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("SELECT assignment, tool_version, graded FROM reports WHERE path=?", (path,))
+        row = c.fetchone()
+    return row
+
+def getStaleReports(assignment, tool_version):
+    """
+    Returns:
+        list: The paths of the recorded reports of the given assignment made by other
+              versions of its tools.
+    """
+    conn, c = _getConnection()
+    with conn:
+        c.execute("SELECT path FROM reports WHERE assignment=? AND tool_version IS NOT ?", (assignment, tool_version))
+        paths = [row[0] for row in c.fetchall()]
+    return paths
+
 def _printTable(table): 
     """
     This function is used to print a given table out row by row. Useful when testing.
@@ -0,0 +1,282 @@
+"""
+ Fair share of the practice test queues between students.
+
+ Each student has at most one job waiting in a test queue at a time. Further tests are
+ held back in a per-student list and only join the back of the queue once the student's
+ previous job starts, so the queue serves students round-robin: someone re-testing in a
+ loop gets one turn per round like everyone else instead of filling the queue.
+
+ On top of that, a student can only have `max_jobs` tests queued, held back or running
+ at once, and the /test route can be rate limited with a token bucket (`test_bucket`).
+ Both are set in the `fair_share` section of the config:
+
+     "fair_share": {
+         "max_jobs": 3,
+         "test_bucket": {"capacity": 6, "per_minute": 1}
+     }
+
+ Per-student wait times are recorded so /admin/queues/students can show the spread.
+
+ A test that hasn't started yet can be superseded by a newer one (new arguments, same
+ place in line) or cancelled; once a worker has taken it, it is left alone.
+"""
+
+import time
+
+from . import FAIR_SHARE
+from .worker import getConnection
+from . import jobs
+
+MAX_JOBS = FAIR_SHARE.get("max_jobs", 3)
+TEST_BUCKET = FAIR_SHARE.get("test_bucket")
+STALE = 2 * 60 * 60 # a job still counted against its student after this long is assumed lost
+
+HELD_KEY = 'grading-tool:fair:%s:held:%s'     # queue, login: job ids held back, oldest first
+QUEUED_KEY = 'grading-tool:fair:%s:queued'    # queue: hash login -> id of the student's job in the queue
+ACTIVE_KEY = 'grading-tool:fair:active:%s'    # login: zset of queued/held/running job ids by enqueue time
+BUCKET_KEY = 'grading-tool:fair:bucket:%s'    # login
+WAITS_KEY = 'grading-tool:fair:%s:waits'      # queue: hash login -> "jobs total_wait max_wait"
+
+# Either put the job in the queue (1), hold it back behind the student's queued job (0) or
+# refuse it if the student has `max_jobs` jobs already (-1), in one step so that concurrent
+# requests can't both get the last place. A job that has gone stale (see STALE) no longer
+# counts nor holds anything back.
+_ADMIT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[3], 0, ARGV[4])
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[5]) then
+    return -1
+end
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[2])
+local queued = redis.call('HGET', KEYS[1], ARGV[1])
+if queued and redis.call('ZSCORE', KEYS[3], queued) then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+# The student's queued job started: returns their next held job (now the queued one), if any.
+_ADVANCE = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return false
+end
+local next = redis.call('LPOP', KEYS[2])
+if next then
+    redis.call('HSET', KEYS[1], ARGV[1], next)
+else
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return next
+"""
+# Token bucket: returns 0 if a token was (or, without ARGV[4], could be) taken, otherwise the
+# seconds until there is one.
+_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - at) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+elseif ARGV[4] == '1' then
+    tokens = tokens - 1
+else
+    return '0'
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+# Replaces the job's call if it is still waiting, in the queue or held back.
+_SUPERSEDE = """
+for _, key in ipairs({KEYS[2], KEYS[3]}) do
+    for _, id in ipairs(redis.call('LRANGE', key, 0, -1)) do
+        if id == ARGV[1] then
+            redis.call('HSET', KEYS[1], 'data', ARGV[2], 'description', ARGV[3])
+            return 1
+        end
+    end
+end
+return 0
+"""
+# Takes the job out of line if it is still waiting: returns 0 if it wasn't, 1 if it was,
+# or the id of the student's next held job if that now takes its place in the queue.
+_CANCEL = """
+if redis.call('LREM', KEYS[2], 0, ARGV[2]) > 0 then
+    return 1
+end
+if redis.call('LREM', KEYS[1], 0, ARGV[2]) == 0 then
+    return 0
+end
+if redis.call('HGET', KEYS[3], ARGV[1]) == ARGV[2] then
+    local next = redis.call('LPOP', KEYS[2])
+    if next then
+        redis.call('HSET', KEYS[3], ARGV[1], next)
+        return next
+    end
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+return 1
+"""
+# Adds a wait to the student's "jobs total_wait max_wait".
+_RECORD = """
+local count, total, longest = 0, 0, 0
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old then
+    local a, b, c = string.match(old, '(%S+) (%S+) (%S+)')
+    count, total, longest = tonumber(a), tonumber(b), tonumber(c)
+end
+local wait = tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], string.format('%d %f %f', count + 1, total + wait, math.max(longest, wait)))
+"""
+_scripts = {}
+
+def _script(source):
+    if source not in _scripts:
+        _scripts[source] = getConnection().register_script(source)
+    return _scripts[source]
+
+def takeToken(login, take=True):
+    """
+    Takes a token from the student's /test bucket, or with `take` False only checks
+    there is one (e.g. before the work of deciding whether to test at all).
+
+    Returns:
+        float: 0 if the test may go ahead, otherwise the seconds until it may.
+    """
+    if not TEST_BUCKET:
+        return 0
+    rate = TEST_BUCKET["per_minute"] / 60.0
+    return float(_script(_TAKE)(keys=[BUCKET_KEY % login],
+        args=[TEST_BUCKET["capacity"], rate, time.time(), 1 if take else 0]))
+
+def activeJobs(login):
+    """ Returns the number of the student's jobs that are queued, held back or running. """
+    conn = getConnection()
+    conn.zremrangebyscore(ACTIVE_KEY % login, 0, time.time() - STALE)
+    return conn.zcard(ACTIVE_KEY % login)
+
+def enqueue(queue, login, func, args, **kwargs):
+    """
+    Enqueues `func(*args)` for the given student, like jobs.enqueue, but holds it back
+    if the student already has a job waiting in the queue.
+
+    Returns:
+        Job: The job, or None if the student already has MAX_JOBS jobs.
+    """
+    meta = {'login': login}
+    job = queue.create_job(func, args=args, meta=meta, **kwargs)
+    job.save()
+    now = time.time()
+    keys = [QUEUED_KEY % queue.name, HELD_KEY % (queue.name, login), ACTIVE_KEY % login]
+    admitted = _script(_ADMIT)(keys=keys, args=[login, job.id, now, now - STALE, MAX_JOBS])
+    if admitted < 0:
+        job.delete()
+        return None
+    if admitted:
+        jobs.enqueueJob(queue, job)
+    return job
+
+def markStarted(job):
+    """ Called by the worker when it starts a job: lets the student's next held job into the queue. """
+    login = job.meta.get('login') if job else None
+    if not login:
+        return
+    from .queues import getQueue
+    next_id = _script(_ADVANCE)(keys=[QUEUED_KEY % job.origin, HELD_KEY % (job.origin, login)], args=[login, job.id])
+    if next_id:
+        queue = getQueue(job.origin)
+        next_job = queue.fetch_job(next_id.decode())
+        if next_job:
+            jobs.enqueueJob(queue, next_job)
+    _recordWait(job, login)
+
+def markDone(job):
+    """ Called by the worker when a job finished or failed. """
+    login = job.meta.get('login') if job else None
+    if login:
+        getConnection().zrem(ACTIVE_KEY % login, job.id)
+
+def supersede(job, args):
+    """
+    Replaces the arguments of a job that hasn't started yet, keeping its place in line.
+
+    Returns:
+        bool: Whether the job was replaced (False if a worker already took it).
+    """
+    from .queues import getQueue
+    job.args = args
+    data = job.to_dict()['data']
+    keys = [job.key, getQueue(job.origin).key, HELD_KEY % (job.origin, job.meta.get('login', ''))]
+    return bool(_script(_SUPERSEDE)(keys=keys, args=[job.id, data, job.get_call_string()]))
+
+def cancel(job):
+    """
+    Takes a job that hasn't started yet out of line and deletes it.
+
+    Returns:
+        bool: Whether the job was cancelled (False if a worker already took it).
+    """
+    from .queues import getQueue
+    login = job.meta.get('login', '')
+    queue = getQueue(job.origin)
+    keys = [queue.key, HELD_KEY % (job.origin, login), QUEUED_KEY % job.origin]
+    removed = _script(_CANCEL)(keys=keys, args=[login, job.id])
+    if not removed:
+        return False
+    if isinstance(removed, bytes):
+        next_job = queue.fetch_job(removed.decode())
+        if next_job:
+            jobs.enqueueJob(queue, next_job)
+    markDone(job)
+    jobs.publish(job, jobs.FINISHED)
+    job.delete(remove_from_queue=False)
+    return True
+
+def heldPosition(job):
+    """
+    Returns:
+        int: How many jobs of the student are held back ahead of this one and including
+             it (0 if the job isn't held back).
+    """
+    login = job.meta.get('login')
+    if not login or job.meta.get('ticket') is not None:
+        return 0
+    held = [i.decode() for i in getConnection().lrange(HELD_KEY % (job.origin, login), 0, MAX_JOBS)]
+    return held.index(job.id) + 1 if job.id in held else 0
+
+def _recordWait(job, login):
+    from .queues import _age
+    wait = _age(job.created_at)
+    if wait is not None:
+        _script(_RECORD)(keys=[WAITS_KEY % job.origin], args=[login, wait])
+
+def getStats(queue_name):
+    """
+    Returns:
+        dict: Per-student wait times in the given queue: each student's `jobs`, `mean`
+              and `max` wait (since the test was requested, including time held back),
+              and across students the p50/p90/max of their mean waits and Jain's
+              fairness index of the mean waits (1 when everyone waits equally long).
+    """
+    rows = getConnection().hgetall(WAITS_KEY % queue_name)
+    students = {}
+    for login, value in rows.items():
+        count, total, longest = map(float, value.split())
+        students[login.decode()] = {'jobs': int(count), 'mean': total / count, 'max': longest}
+    means = sorted(s['mean'] for s in students.values())
+    fairness = None
+    if means and sum(means):
+        fairness = sum(means) ** 2 / (len(means) * sum(m * m for m in means))
+    return {
+        'students': students,
+        'mean_wait': {
+            'p50': means[len(means) // 2] if means else None,
+            'p90': means[int(len(means) * 0.9)] if means else None,
+            'max': means[-1] if means else None,
+        },
+        'fairness': fairness
+    }
@@ -0,0 +1,178 @@
+"""
+ Constant-time queue positions for grading jobs.
+
+ Every job takes a ticket from a counter in redis when it is enqueued, and the worker
+ records the highest ticket it has started serving. A queued job's position is then
+ `ticket - serving`, which costs the same whether 3 or 3,000 jobs are waiting; finding
+ it used to mean deserialising the whole queue (q.get_jobs()) on every poll.
+
+ Jobs are started in ticket order because each queue is FIFO. Two enqueues racing each
+ other can swap places, which at worst makes one of them report a position one too
+ high until the worker reaches it. Every queue has its own counters; a job's position
+ also counts the jobs waiting in higher-priority queues (see queues.py), which run
+ first with a strict worker and usually do with a weighted one.
+
+ The worker also publishes on redis pub/sub when it starts and finishes a job, which
+ `watch` turns into a stream of status changes for the silo server's event route.
+"""
+
+import time
+
+from .worker import getConnection
+from . import queues
+
+ENQUEUED_KEY = 'grading-tool:tickets:enqueued'
+SERVING_KEY = 'grading-tool:tickets:serving'
+SERVING_CHANNEL = 'grading-tool:tickets:serving' # a key and a channel may share a name
+JOB_CHANNEL = 'grading-tool:jobs:%s'
+
+# SET serving = max(serving, ticket), so a worker picking up a stale job can't move it back
+_SERVE = """
+local serving = tonumber(redis.call('GET', KEYS[1]) or '0')
+local ticket = tonumber(ARGV[1])
+if ticket > serving then
+    redis.call('SET', KEYS[1], ticket)
+    return ticket
+end
+return serving
+"""
+_serve = None
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+def ticketKeys(queue_name):
+    """
+    Returns:
+        tuple: The (enqueued, serving) counter keys of the given queue.
+    """
+    if queue_name == queues.DEFAULT: # the keys from before there were several queues
+        return ENQUEUED_KEY, SERVING_KEY
+    return '%s:%s' % (ENQUEUED_KEY, queue_name), '%s:%s' % (SERVING_KEY, queue_name)
+
+def enqueue(queue, func, args, student=None, **kwargs):
+    """
+    Enqueues `func(*args)` on the given queue with a ticket in the job's meta, and the
+    login of the `student` it is for, if any. Takes the same keyword arguments as
+    Queue.enqueue_call.
+    """
+    meta = {'ticket': getConnection().incr(ticketKeys(queue.name)[0])}
+    if student:
+        meta['student'] = student
+    return queue.enqueue_call(func=func, args=args, meta=meta, **kwargs)
+
+def enqueueJob(queue, job):
+    """ Puts a job created earlier (see fair.py) on the queue, with a ticket. """
+    job.meta['ticket'] = getConnection().incr(ticketKeys(queue.name)[0])
+    return queue.enqueue_job(job)
+
+def getLogin(job):
+    """
+    Returns:
+        str: The login of the student the job is for, or None. Practice tests carry
+             it as `login` (which fair.py acts on), other jobs as `student`.
+    """
+    if job is None:
+        return None
+    return job.meta.get('login') or job.meta.get('student')
+
+def markStarted(job):
+    """ Called by the worker when it starts a job, advancing the serving counter. """
+    global _serve
+    if job is None:
+        return
+    ticket = job.meta.get('ticket')
+    if ticket is not None:
+        if _serve is None:
+            _serve = getConnection().register_script(_SERVE)
+        _serve(keys=[ticketKeys(job.origin)[1]], args=[ticket])
+        getConnection().publish(SERVING_CHANNEL, job.origin)
+    queues.recordWait(job)
+    publish(job, RUNNING)
+
+def publish(job, state):
+    """ Tells anyone watching the job that it changed state. """
+    if job is not None:
+        getConnection().publish(JOB_CHANNEL % job.id, state)
+
+def getState(job):
+    """
+    Returns:
+        str: QUEUED, RUNNING, FINISHED or FAILED.
+    """
+    status = job.get_status()
+    status = getattr(status, 'value', status) # JobStatus is an enum in newer rq
+    if status == 'finished':
+        return FINISHED
+    if status in ('failed', 'stopped', 'canceled'):
+        return FAILED
+    if status == 'started':
+        return RUNNING
+    return QUEUED
+
+def getPosition(job, state=None):
+    """
+    Returns the job's position in the queues: 1 if it is next, 0 if it is no longer
+    waiting (running, finished or failed).
+
+    Jobs without a ticket (held back by fair.py, or enqueued before tickets were
+    introduced) report the queue's length, an upper bound that is still constant-time.
+    """
+    if (state or getState(job)) != QUEUED:
+        return 0
+    ticket = job.meta.get('ticket')
+    if ticket is None:
+        from . import fair
+        position = max(queues.getQueue(job.origin).count, 1) + fair.heldPosition(job)
+    else:
+        serving = int(getConnection().get(ticketKeys(job.origin)[1]) or 0)
+        position = max(ticket - serving, 1)
+    return position + queues.ahead(job.origin)
+
+def getStatus(job, state=None):
+    """
+    Returns:
+        dict: The job's `state`, `finished`, `failed` and `running` flags and `position`.
+    """
+    state = state or getState(job)
+    return {
+        'state': state,
+        'finished': state == FINISHED,
+        'failed': state == FAILED,
+        'running': state == RUNNING,
+        'position': getPosition(job, state)
+    }
+
+def watch(job, timeout=600, heartbeat=15):
+    """
+    Yields the job's status (see getStatus) right away and then every time it changes,
+    until the job is finished or failed or `timeout` seconds have passed. Yields None
+    when nothing changed for `heartbeat` seconds, so callers can keep the connection
+    alive.
+
+    Changes are picked up from the worker's pub/sub messages rather than by polling:
+    a job's position mostly changes when a worker starts another job. Jobs added to
+    higher-priority queues are picked up at the next heartbeat.
+    """
+    pubsub = getConnection().pubsub(ignore_subscribe_messages=True)
+    # subscribe before the first look, so nothing published in between is missed
+    pubsub.subscribe(JOB_CHANNEL % job.id, SERVING_CHANNEL)
+    try:
+        deadline = time.time() + timeout
+        status = getStatus(job)
+        last = None
+        while True:
+            yield status if status != last else None
+            last = status
+            if status['state'] in (FINISHED, FAILED) or time.time() >= deadline:
+                return
+            message = pubsub.get_message(timeout=min(heartbeat, max(deadline - time.time(), 0)))
+            state = None
+            if message and message['channel'].decode() == JOB_CHANNEL % job.id:
+                # rq only records the result after the job function returns
+                state = message['data'].decode()
+            status = getStatus(job, state)
+    finally:
+        pubsub.close()
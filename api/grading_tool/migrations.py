@@ -0,0 +1,90 @@
+"""
+ Schema migrations for gradingtool.db.
+
+ The schema version is kept in SQLite's `user_version` pragma. Every migration is a
+ function taking the connection; `migrate` applies the ones newer than the database's
+ version, in order, all in one transaction along with the version bumps: if one fails,
+ none of them is kept and the database stays at its old version. To change the schema,
+ add a function at the end of MIGRATIONS (never edit one that has already been run).
+"""
+
+def _indexes_and_unique_submissions(c):
+    """
+    1: index students.username, and give submissions a (student_id, assignment_id)
+       primary key. Duplicate submissions (from the old SELECT-then-INSERT race)
+       are collapsed to the most recently inserted one.
+    """
+    c.execute("CREATE INDEX IF NOT EXISTS students_username ON students (username)")
+    c.execute(''' CREATE TABLE submissions_new
+            (student_id integer, assignment_id integer,
+            test_commit text, job_id text,
+            initial_date date, revision_date date,
+            initial_commit text, revision_commit text,
+            PRIMARY KEY (student_id, assignment_id),
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (assignment_id) REFERENCES assignments (id) ) ''')
+    c.execute(''' INSERT INTO submissions_new
+            SELECT student_id, assignment_id, test_commit, job_id, initial_date, revision_date,
+                initial_commit, revision_commit
+            FROM submissions WHERE rowid IN
+                (SELECT MAX(rowid) FROM submissions GROUP BY student_id, assignment_id) ''')
+    c.execute("DROP TABLE submissions")
+    c.execute("ALTER TABLE submissions_new RENAME TO submissions")
+
+def _results(c):
+    """
+    2: results, the content-addressed cache of grading reports (see results.py).
+    """
+    c.execute(''' CREATE TABLE IF NOT EXISTS results
+            (key text PRIMARY KEY, html blob, result blob, created text, last_used text) ''')
+    c.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+def _tool_versions(c):
+    """
+    3: record the version of the grading tools (see tools.py) that made each cached
+       result, and reports, the version behind every report in the students' folders.
+    """
+    c.execute("ALTER TABLE results ADD COLUMN assignment text")
+    c.execute("ALTER TABLE results ADD COLUMN tool_version text")
+    c.execute("CREATE INDEX IF NOT EXISTS results_tool_version ON results (assignment, tool_version)")
+    c.execute(''' CREATE TABLE IF NOT EXISTS reports
+            (path text PRIMARY KEY, assignment text, tool_version text, graded text) ''')
+    c.execute("CREATE INDEX IF NOT EXISTS reports_tool_version ON reports (assignment, tool_version)")
+
+MIGRATIONS = [
+    _indexes_and_unique_submissions,
+    _results,
+    _tool_versions,
+]
+
+LATEST = len(MIGRATIONS)
+
+def getVersion(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """
+    Brings the database up to the latest schema version. Safe to call from several
+    processes at once: the version is re-checked once the write lock is held.
+
+    Args:
+        conn: A connection in autocommit mode (isolation_level=None).
+
+    Returns:
+        int: The schema version of the database.
+    """
+    if getVersion(conn) >= LATEST:
+        return LATEST
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='submissions'").fetchone():
+        return getVersion(conn) # blank database, see database._initDatabase
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = getVersion(conn)
+        for i, migration in enumerate(MIGRATIONS[version:], start=version+1):
+            migration(conn)
+            conn.execute("PRAGMA user_version=%d" % i)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return LATEST
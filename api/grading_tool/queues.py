@@ -0,0 +1,156 @@
+"""
+ The grading queues, one per class of work, highest priority first:
+
+     syncs            fetching a student's repository after they pushed (see webhooks.py)
+     grading          submit_initial / submit_revision
+     tests-deadline   practice tests for an assignment due within DEADLINE_WINDOW
+     tests            other practice tests
+     battles          battles jobs
+     regrades         batch regrades (batch_regrade.py)
+     default          where everything went before; drained last
+
+ Workers (run_worker.py) either always take the highest non-empty queue (strict), or
+ pick among the non-empty queues in proportion to WEIGHTS (weighted), so lower queues
+ keep moving while the higher ones are busy.
+"""
+
+from datetime import datetime, timedelta, time as dtime, timezone
+import random
+
+from .worker import getConnection
+from ..utils import lazy_import
+rq = lazy_import('rq')
+
+SYNCS = 'syncs'
+GRADING = 'grading'
+TESTS_DEADLINE = 'tests-deadline'
+TESTS = 'tests'
+BATTLES = 'battles'
+REGRADES = 'regrades'
+DEFAULT = 'default'
+
+PRIORITY = [SYNCS, GRADING, TESTS_DEADLINE, TESTS, BATTLES, REGRADES, DEFAULT]
+WEIGHTS = {SYNCS: 16, GRADING: 8, TESTS_DEADLINE: 4, TESTS: 2, BATTLES: 1, REGRADES: 1, DEFAULT: 1}
+
+DEADLINE_WINDOW = timedelta(hours=24)
+DEFAULT_TIMEOUT = 600
+
+WAITS_KEY = 'grading-tool:waits:%s'
+WAITS_KEPT = 200 # how many recent waits are kept per queue for the stats
+
+_queues = {}
+
+def getQueue(name=DEFAULT):
+    """ Returns the queue with the given name, creating it (and the redis connection) on first use. """
+    if name not in _queues:
+        _queues[name] = rq.Queue(name, connection=getConnection(), default_timeout=DEFAULT_TIMEOUT)
+    return _queues[name]
+
+def getQueues():
+    """ Returns every queue, highest priority first. """
+    return [getQueue(name) for name in PRIORITY]
+
+def _dueDates(*dates):
+    for d in dates:
+        if d:
+            yield datetime.combine(datetime.strptime(d, "%Y-%m-%d").date(), dtime.max)
+
+def testQueue(initial_due_date, revision_due_date, now=None):
+    """
+    Returns:
+        str: The queue a practice test goes on: TESTS_DEADLINE when one of the
+             assignment's due dates ("%Y-%m-%d", due by the end of the day) is
+             within DEADLINE_WINDOW, TESTS otherwise.
+    """
+    now = now or datetime.now()
+    for due in _dueDates(initial_due_date, revision_due_date):
+        if timedelta(0) <= due - now <= DEADLINE_WINDOW:
+            return TESTS_DEADLINE
+    return TESTS
+
+def ahead(queue_name):
+    """ Returns the number of jobs waiting in queues with a higher priority than the given one. """
+    if queue_name not in PRIORITY:
+        return 0
+    higher = PRIORITY[:PRIORITY.index(queue_name)]
+    if not higher:
+        return 0
+    pipe = getConnection().pipeline()
+    for name in higher:
+        pipe.llen(getQueue(name).key)
+    return sum(pipe.execute())
+
+def backlog(qs):
+    """
+    Returns:
+        tuple: (jobs waiting, seconds the oldest of them has been waiting) across the
+               given rq queues.
+    """
+    if not qs:
+        return 0, 0
+    pipe = qs[0].connection.pipeline()
+    for q in qs:
+        pipe.llen(q.key)
+        pipe.lindex(q.key, 0)
+    replies = pipe.execute()
+    depth, oldest = sum(replies[0::2]), 0
+    for q, first in zip(qs, replies[1::2]):
+        job = q.fetch_job(first.decode()) if first else None
+        oldest = max(oldest, (_age(job.enqueued_at) if job else None) or 0)
+    return depth, oldest
+
+def weightedOrder(names, weights=WEIGHTS):
+    """
+    Returns the queue names in a random order in which each name comes first with a
+    probability proportional to its weight (weighted sampling without replacement).
+    """
+    return sorted(names, key=lambda name: random.random() ** (1.0 / weights.get(name, 1)), reverse=True)
+
+def _age(enqueued_at):
+    if enqueued_at is None:
+        return None
+    if enqueued_at.tzinfo is not None: # newer rq uses aware datetimes
+        return (datetime.now(timezone.utc) - enqueued_at).total_seconds()
+    return (datetime.utcnow() - enqueued_at).total_seconds()
+
+def recordWait(job):
+    """ Called by the worker when it starts a job: remembers how long the job waited. """
+    wait = _age(job.enqueued_at)
+    if wait is None or not job.origin:
+        return
+    key = WAITS_KEY % job.origin
+    pipe = getConnection().pipeline()
+    pipe.lpush(key, round(wait, 3))
+    pipe.ltrim(key, 0, WAITS_KEPT - 1)
+    pipe.execute()
+
+def getStats():
+    """
+    Returns:
+        list: One dict per queue, highest priority first, with its `name`, `weight`,
+              `depth` (jobs waiting), `running` jobs, `oldest_wait` (seconds the job
+              at the front has been waiting) and the `wait` (mean, p50, p90, max in
+              seconds) of the last WAITS_KEPT jobs started from it.
+    """
+    from rq.registry import StartedJobRegistry
+    conn = getConnection()
+    stats = []
+    for q in getQueues():
+        first = q.get_job_ids(0, 1)
+        oldest = q.fetch_job(first[0]) if first else None
+        waits = sorted(float(w) for w in conn.lrange(WAITS_KEY % q.name, 0, -1))
+        stats.append({
+            'name': q.name,
+            'weight': WEIGHTS.get(q.name, 1),
+            'depth': q.count,
+            'running': StartedJobRegistry(queue=q).count,
+            'oldest_wait': _age(oldest.enqueued_at) if oldest else 0,
+            'wait': {
+                'samples': len(waits),
+                'mean': sum(waits) / len(waits) if waits else None,
+                'p50': waits[len(waits) // 2] if waits else None,
+                'p90': waits[int(len(waits) * 0.9)] if waits else None,
+                'max': waits[-1] if waits else None,
+            }
+        })
+    return stats
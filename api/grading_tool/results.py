@@ -0,0 +1,116 @@
+"""
+ Content-addressed cache of grading reports.
+
+ A report only depends on what was graded and how, so it is keyed by the assignment,
+ the version of its grading tools (see tools.py), the git tree hash of the submission
+ folder and the redact/include_subjective flags. A commit that leaves the folder byte-identical (a
+ README change, a revert, a force push of the same content) then gets the stored report
+ straight away instead of a trip through the queue.
+
+ The worker stores every report it produces; the silo server looks one up before
+ enqueueing. The student's GitHub link is the only part of a report that differs
+ between identical trees, so it is stored as a placeholder and filled back in.
+
+ Every report written to a student's folder, graded or restored, is also recorded with
+ the tools version that made it (db.setReport), so regrades can pick out the stale ones.
+ Cached results of older versions of an assignment's tools are dropped when a result of
+ the current version is stored.
+"""
+
+from datetime import datetime, timedelta
+import hashlib
+import tempfile
+import pickle
+import zlib
+import os
+
+from . import database as db
+from ..utils import lazy_import
+git = lazy_import('git')
+
+LINK_PLACEHOLDER = '@@GITHUB_LINK@@'
+MAX_AGE = timedelta(days=30) # results unused for this long are pruned when new ones are stored
+
+def _treeHash(directory):
+    """
+    Returns the git tree hash of `directory` at HEAD of the repository containing it,
+    or None if it isn't in a repository or has uncommitted changes.
+    """
+    try:
+        repo = git.Repo(directory, search_parent_directories=True)
+        path = os.path.relpath(os.path.realpath(directory), os.path.realpath(repo.working_tree_dir))
+        tree = repo.head.commit.tree
+        if path != '.':
+            tree = tree / path
+            if repo.is_dirty(untracked_files=True, path=path):
+                return None
+        elif repo.is_dirty(untracked_files=True):
+            return None
+        return tree.hexsha
+    except Exception:
+        return None
+
+def getKey(assignment_id, submission_dir, tool_version, redact, include_subjective=None):
+    """
+    Returns:
+        str: The cache key of grading `submission_dir` as it is checked out now with the
+             given version of the assignment's tools, or None if it can't be cached (not
+             a git checkout, uncommitted changes, or unversioned tools).
+    """
+    tree = _treeHash(submission_dir)
+    if not tree or not tool_version:
+        return None
+    parts = (assignment_id, tool_version, tree, redact, include_subjective)
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+def store(key, html_file, github_link, result, assignment_id, tool_version):
+    """
+    Records the report the worker just wrote to `html_file` as made by `tool_version`,
+    and stores it and its result under `key`.
+    """
+    db.setReport(html_file, assignment_id, tool_version)
+    if not key:
+        return
+    with open(html_file, 'r') as f:
+        html = f.read()
+    if github_link:
+        html = html.replace(github_link, LINK_PLACEHOLDER)
+    db.setResult(key, zlib.compress(html.encode(), 9), pickle.dumps(result), assignment_id, tool_version)
+    db.pruneResults(datetime.now() - MAX_AGE)
+    db.deleteStaleResults(assignment_id, tool_version)
+
+def restore(key, html_file, github_link):
+    """
+    Writes the report stored under `key` to `html_file` (with its backup and gzipped
+    copy, like the worker does), filling in the student's GitHub link.
+
+    Returns:
+        tuple: (True, result) if there was a stored report, (False, None) otherwise.
+    """
+    from .worker import backup, compress
+    if not key:
+        return False, None
+    try:
+        row = db.getResult(key)
+    except Exception:
+        return False, None
+    if not row:
+        return False, None
+    html, result, assignment_id, tool_version = row
+    html = zlib.decompress(html).decode()
+    if github_link:
+        html = html.replace(LINK_PLACEHOLDER, github_link)
+    # a name of its own: the silo server's threads may restore the same report at once
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(html_file), prefix='.restore-')
+    try:
+        os.chmod(tmp_file, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            f.write(html)
+        os.replace(tmp_file, html_file)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+    db.setReport(html_file, assignment_id, tool_version)
+    backup(html_file)
+    compress(html_file)
+    return True, pickle.loads(result)
@@ -1,48 +1,106 @@
 import os
 import datetime
-import shutil
 
-from flask import jsonify, request, send_from_directory, Blueprint
-from rq import Queue, Connection
-from rq.job import Job
+from flask import jsonify, request, send_from_directory, Blueprint, Response
 import json
-import git
 
-from . import REPOS_DIR, INSTRUCTORS, ASSIGNMENTS, GRADING_TOOLS_DIR, SECRET_KEY
-from .worker import conn, runTest, runGrade
+from . import REPOS_DIR, INSTRUCTORS, ASSIGNMENTS, GRADING_TOOLS_DIR, SECRET_KEY, repos
+from .worker import getConnection, runTest, runGrade, compress
 from . import database as db
+from . import fair
+from . import jobs
+from . import queues
+from . import results
+from . import tools
+from . import timings
+from . import webhooks
+from ..utils import lazy_import
+git = lazy_import('git')
+rq = lazy_import('rq')
 
 app =  Blueprint('grading-tool', __name__)
 app.secret_key = SECRET_KEY
-q = Queue(connection=conn, default_timeout=600)
 
 @app.before_request
 def authenticate():
+    if request.endpoint == app.name + '.push_webhook':
+        return None # signed by GitHub instead
     if request.headers['secret-key'] != app.secret_key:
         response = jsonify("Not authorized.")
         response.status_code = 401
         return response
 
+## POST /webhooks/push
+# GitHub push events of the students' repositories (see webhooks.py). Puts a sync of the
+# pushed repository in the queue so it is up to date before the student tests or submits.
+# Authenticated by the X-Hub-Signature-256 of the payload instead of the secret-key header.
+@app.route('/webhooks/push', methods=['POST'])
+def push_webhook():
+    if not webhooks.verify(request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        return jsonify("Not authorized."), 401
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return jsonify("pong")
+    payload = request.get_json(silent=True) or {}
+    if event != 'push' or not str(payload.get('ref', '')).startswith('refs/heads/'):
+        return jsonify("Ignored."), 202
+    login = webhooks.getLogin(payload)
+    if not login:
+        return jsonify("Not a student repository."), 202
+    job = webhooks.schedule(login)
+    return jsonify({'login': login, 'job_id': job.id if job else None}), 202
+
 @app.route('/check/<job_id>/position')
 def position(job_id):
     try:
-        job = Job.fetch(job_id, connection=conn)
+        job = rq.job.Job.fetch(job_id, connection=getConnection())
     except:
         job = None
     if not job: return ("No job", 404)
     if job.is_failed: return ("Job failed", 500)
-    jobs = q.get_jobs() # seems not to include currently running job.
-    if not jobs:
-        return jsonify(0)
+    return jsonify(jobs.getPosition(job))
+
+## GET /check/<job_id>/status
+# Everything the front-end polls for in one round trip: the job's state
+# (queued, running, finished or failed) and its position in the queue.
+@app.route('/check/<job_id>/status')
+def status(job_id):
+    try:
+        job = rq.job.Job.fetch(job_id, connection=getConnection())
+    except:
+        return "No job", 404
+    return jsonify(jobs.getStatus(job))
+
+## GET /check/<job_id>/events
+# Server-Sent Events stream of the same status, pushed whenever it changes
+# (see jobs.watch), so the front-end can hold one connection instead of polling.
+# The stream ends once the job is done, or after EVENTS_TIMEOUT seconds, after
+# which EventSource reconnects on its own.
+EVENTS_TIMEOUT = 600
+EVENTS_HEARTBEAT = 15
+
+@app.route('/check/<job_id>/events')
+def events(job_id):
     try:
-        return jsonify(jobs.index(job)+1)
-    except ValueError:
-        return jsonify(0)
+        job = rq.job.Job.fetch(job_id, connection=getConnection())
+    except:
+        return "No job", 404
+
+    def generate():
+        yield "retry: 3000\n\n"
+        for status in jobs.watch(job, EVENTS_TIMEOUT, EVENTS_HEARTBEAT):
+            if status is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield "event: status\ndata: %s\n\n" % json.dumps(status)
+
+    return Response(generate(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/check/<job_id>')
 def fetch(job_id):
     try:
-        job = Job.fetch(job_id, connection=conn)
+        job = rq.job.Job.fetch(job_id, connection=getConnection())
     except:
         return "No job", 404
     return jsonify(job.is_finished)
@@ -50,32 +108,84 @@ def fetch(job_id):
 @app.route('/enqueue_test', methods=['POST'])
 def enqueue_test():
     data = request.get_json()
-    job = q.enqueue_call(
-        func=runTest, args=(request.values.get('assignment_id'), request.values.get('submission_dir'), request.values.get('output_file'),), result_ttl=86400
+    job = jobs.enqueue(queues.getQueue(queues.TESTS),
+        runTest, (request.values.get('assignment_id'), request.values.get('submission_dir'), request.values.get('output_file'),), result_ttl=86400
     )
     return jsonify(job.get_id()) if job else ("Error", 500)
 
 @app.route('/qcount')
 def q_count():
-    return jsonify(q.count)
+    return jsonify(sum(q.count for q in queues.getQueues()))
+
+## GET /admin/queues
+# Depth, running jobs and recent wait times of every queue (see queues.getStats).
+@app.route('/admin/queues')
+def queue_stats():
+    return jsonify(queues.getStats())
+
+## GET /admin/queues/students
+# Per-student wait times in the practice test queues (see fair.getStats).
+@app.route('/admin/queues/students')
+def student_queue_stats():
+    return jsonify({name: fair.getStats(name) for name in (queues.TESTS_DEADLINE, queues.TESTS)})
+
+## GET /metrics
+# Histograms of how long each phase of requests and grading jobs takes (see timings.py),
+# in Prometheus' text format, or as JSON with `?format=json`. `?period=2019-spring` for
+# an older semester.
+@app.route('/metrics')
+def metrics():
+    period = request.args.get('period')
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'period': period or timings.getPeriod(),
+            'periods': timings.getPeriods(),
+            'buckets': timings.BUCKETS,
+            'phases': timings.getHistograms(period),
+            'counters': timings.getCounters(period)
+        })
+    return timings.prometheus(period), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+## GET /admin/timings/<login>
+# A student's most recent timings, newest first.
+@app.route('/admin/timings/<login>')
+def student_timings(login):
+    return jsonify(timings.getSamples(login.lower(), int(request.args.get('limit', 100))))
+
+## GET /admin/tools
+# Current version of every assignment's grading tools and how many recorded reports
+# were made by another one (see tools.py).
+@app.route('/admin/tools')
+def tool_versions():
+    versions = {}
+    for assignment_id in ASSIGNMENTS:
+        version = tools.getVersion(GRADING_TOOLS_DIR, assignment_id)
+        versions[assignment_id] = {
+            'version': version,
+            'stale_reports': len(db.getStaleReports(assignment_id, version))
+        }
+    return jsonify(versions)
 
 @app.route('/assignments/<assignment_id>/<login>/info')
 def assignment_info(assignment_id, login):
-    student_id = db.getStudentID(login.lower())
-    
-    try: assignment = db.getAssignment(ASSIGNMENTS[assignment_id]["canvas_id"])
-    except: return "Assignment not found!", 404
+    # polled by the front end: only take the write lock when there is something to write
+    with db.transaction():
+        student_id = db.getStudentID(login.lower())
+        
+        try: assignment = db.getAssignment(ASSIGNMENTS[assignment_id]["canvas_id"])
+        except: return "Assignment not found!", 404
 
-    # subject to change
-    canvas_assignment_id, unlock_date, initial_due_date, revision_due_date = assignment
-    
-    if not datetime.date.today() >= datetime.datetime.strptime(unlock_date, "%Y-%m-%d").date():
-        return "assignment not unlocked yet", 400
+        # subject to change
+        canvas_assignment_id, unlock_date, initial_due_date, revision_due_date = assignment
+        
+        if not datetime.date.today() >= datetime.datetime.strptime(unlock_date, "%Y-%m-%d").date():
+            return "assignment not unlocked yet", 400
+
+        submission = db.getSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
 
-    submission = db.getSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
-    
     if submission is None:
-        submission = db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
+        with db.transaction(immediate=True):
+            submission = db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
 
     # subject to change
     _, _, test_commit, job_id, initial_date, revision_date, initial_commit, revision_commit = submission
@@ -86,18 +196,15 @@ def assignment_info(assignment_id, login):
 
     if job_id:
         try:
-            job = Job.fetch(job_id, connection=conn)
+            job = rq.job.Job.fetch(job_id, connection=getConnection())
         except: job = None
         if job:
-            if job.is_finished: job_id = None
-            else: 
-                jobs = q.get_jobs()
-                if not job in jobs:
-                    job_id = None
-                else:
-                    try:
-                        job_position = jobs.index(job)
-                    except ValueError: job_position = 0    
+            state = jobs.getState(job)
+            if state == jobs.QUEUED:
+                job_position = jobs.getPosition(job, state) - 1 # jobs ahead of this one
+            elif state == jobs.RUNNING:
+                job_position = 0
+            else: job_id = None
         else: job_id = None
 
     user_dir = "%s/%s" % (REPOS_DIR, login)
@@ -148,57 +255,59 @@ def delete_test(assignment_id, login):
         return jsonify(True)
     return jsonify(False)
 
+def _send_report(directory, filename):
+    """
+    Sends an HTML report with ETag/Last-Modified headers (so unchanged reports are
+    answered with a 304), gzipped when the client accepts it. The gzipped copy is
+    written by the worker after grading, or here if it's missing or stale.
+    """
+    html_file = os.path.join(directory, filename)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        gz_file = f'{html_file}.gz'
+        try:
+            if not os.path.exists(gz_file) or os.path.getmtime(gz_file) < os.path.getmtime(html_file):
+                compress(html_file)
+        except OSError:
+            pass
+        else:
+            response = send_from_directory(directory, f'{filename}.gz', mimetype='text/html', conditional=True)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+    response = send_from_directory(directory, filename, mimetype='text/html', conditional=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/assignments/<assignment_id>/<login>/download_test')
 def download_test(assignment_id, login):
     tests_dir = "%s/%s/student-tests" % (REPOS_DIR, login)
     if os.path.exists("%s/%s.html" % (tests_dir, assignment_id)):
-        return send_from_directory(tests_dir, "%s.html" % assignment_id)
+        return _send_report(tests_dir, "%s.html" % assignment_id)
     return "no file present", 404
 
 def _clone_repo_reset(login):
     ''' Not as dangerous as it looks, but still pretty dangerous. '''
-    user_dir = "%s/%s" % (REPOS_DIR, login)
-    repo_dir = "%s/submission" % user_dir
-    try:
-        if os.path.isdir(repo_dir):
-            shutil.rmtree(repo_dir)
-    except Exception:
-        # we no longer have control over this user's repository
-        return None
-    os.mkdir(repo_dir)
-    try:
-        repo = git.Repo.clone_from("git@github.iu.edu:csci-b351-sp19/%s-submission.git" % login, repo_dir)
-        return repo
-    except:
-        return None
+    return repos.reset(login, "submission")
 
 @app.route('/update_repo/<login>')
 def update_repo(login):
     #return "Server down for maintainence.", 500
     user_dir = "%s/%s" % (REPOS_DIR, login)
-    repo_dir = "%s/submission" % user_dir
     tests_dir = "%s/student-tests" % user_dir
     results_dir = "%s/tool-results" % user_dir
     
-    if not os.path.isdir(user_dir):
-        os.mkdir(user_dir)
-        os.mkdir(tests_dir)
-        os.mkdir(results_dir)
-
-    if os.path.isdir(repo_dir): # pull the repo if it exists
-        try:
-            repo = git.Repo(repo_dir, search_parent_directories=True)
-            repo.git.reset('--hard')
-            repo.git.clean('-fxd')
-            repo.remotes.origin.pull()
-        except:
-            repo = _clone_repo_reset(login)
-            if not repo:
-                return 'Could not find repository.', 404
-    else: # clone it using SSH if not (b351@silo ssh key is in my github account)
-        repo = _clone_repo_reset(login)
-        if not repo:
-            return 'Could not find repository.', 404
+    # each of them: the student's folder may have been made by a webhook sync (see webhooks.py)
+    for folder in (user_dir, tests_dir, results_dir):
+        os.makedirs(folder, exist_ok=True)
+
+    # fetch into the student's mirror and reset the worktree if it changed (see utils/repos.py),
+    # cloning it using SSH the first time (b351@silo ssh key is in my github account)
+    with timings.timed(timings.GIT_SYNC, login=login.lower()):
+        sync = repos.update(login, "submission")
+    if not sync:
+        return 'Could not find repository.', 404
+    timings.recordSync(sync, login.lower())
+    repo = sync.repo
     
     # get latest commit number
     try:
@@ -228,7 +337,9 @@ def _get_last_commit(assignment_id, login, retry=True):
                 'commit_comment': None,
                 'head_commit': head_commit}
     try:
-        commit = max(repo.iter_commits(paths=assignment_id), key=lambda c: c.authored_datetime)
+        with timings.timed(timings.COMMIT_LOOKUP, assignment_id, login.lower()):
+            # kept up to date in the mirror by commit instead of walking the history (see utils/repos.py)
+            commit = repo.commit(repos.getLastCommit(login, assignment_id, head_commit))
     except:
         # we expect to have commits since we have the directory.
         # if we don't, something is up.
@@ -257,19 +368,35 @@ def get_last_commit(assignment_id, login):
 def test_assignment(assignment_id, login):
     # return "Server down for maintainence.", 500
     previous_failed = False
+    superseded = None
+
+    # checked before pulling the repo, which is the expensive part, but only taken once
+    # there is a test to run
+    wait = fair.takeToken(login.lower(), take=False)
+    if wait:
+        return f"You're testing too often, please try again in {int(wait) + 1} seconds.", 300
 
-    student_id = db.getStudentID(login.lower())
+    with db.transaction(immediate=True):
+        student_id = db.getStudentID(login.lower())
 
-    db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
-    job_id = db.getJob(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
+        db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
+        job_id = db.getJob(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
+        last_commit = db.getCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
+        _, _, initial_due_date, revision_due_date = db.getAssignment(ASSIGNMENTS[assignment_id]["canvas_id"])
     if job_id:
-        try: job = Job.fetch(job_id, connection=conn)
+        try: job = rq.job.Job.fetch(job_id, connection=getConnection())
         except: job = None
         if job:
-            if job.is_failed:
+            state = jobs.getState(job)
+            if state == jobs.FAILED:
                 previous_failed = True
-            elif not job.is_finished:
+            elif state == jobs.QUEUED:
+                # still waiting: the newer commit takes its place, see below
+                superseded = job
+            elif state == jobs.RUNNING:
                 return "Test already running.", 300
+    if not superseded and fair.activeJobs(login.lower()) >= fair.MAX_JOBS:
+        return f"You already have {fair.MAX_JOBS} tests waiting or running.", 300
 
     user_dir = "%s/%s" % (REPOS_DIR, login)
     repo_dir = "%s/submission" % user_dir
@@ -280,7 +407,6 @@ def test_assignment(assignment_id, login):
     commit = _commit['commit_id']
     commit_comment = _commit['commit_comment']
     head_commit = _commit['head_commit']
-    last_commit = db.getCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
     
     if not head_commit:
         return f"You haven't made any commits to your repository.", 404
@@ -291,20 +417,61 @@ def test_assignment(assignment_id, login):
         return "You haven't pushed any commits since your last test.", 300
     elif not previous_failed and str(last_commit) == str(commit):
         return f"None of your commits since your last test have affected {assignment_name}.", 300
-    db.setCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit)
 
     github_link = f'https://github.iu.edu/csci-b351-sp19/{login}-submission/tree/{commit}/{assignment_name}'
-    job = q.enqueue_call(
-        func=runTest, args=(assignment_id, f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code', f'{tests_dir}/{assignment_name}.html', github_link, GRADING_TOOLS_DIR), result_ttl=86400, timeout=600
-    )
-    if job:
-        job_id = job.get_id()
-        if not job.is_finished: job_position = q.count
-        else: job_position = None
-    else:
-        return 'Error starting test.', 500
-
-    db.setJob(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], job_id)
+    submission_dir = f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code'
+    html_file = f'{tests_dir}/{assignment_name}.html'
+
+    # this exact folder has been tested before, no need to queue it again
+    cached, _ = results.restore(results.getKey(assignment_id, submission_dir, tools.getVersion(GRADING_TOOLS_DIR, assignment_id), True), html_file, github_link)
+    if cached:
+        # a test of the older commit that already started would overwrite the restored report
+        if superseded and not fair.cancel(superseded):
+            return "Test already running.", 300
+        with db.transaction(immediate=True):
+            db.setCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit)
+            db.setJob(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], None)
+        return jsonify({
+            'file_exists': True,
+            'job_id': None,
+            'job_position': None,
+            'test_commit': commit,
+            'test_comment': commit_comment
+        }), 200
+
+    wait = fair.takeToken(login.lower())
+    if wait:
+        return f"You're testing too often, please try again in {int(wait) + 1} seconds.", 300
+
+    if superseded:
+        # test the new commit in the queued job's place instead of queueing another one
+        if not fair.supersede(superseded, (assignment_id, submission_dir, html_file, github_link, GRADING_TOOLS_DIR, head_commit)):
+            return "Test already running.", 300
+        with db.transaction(immediate=True):
+            db.setCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit)
+        return jsonify({
+            'file_exists': False,
+            'job_id': superseded.get_id(),
+            'job_position': jobs.getPosition(superseded),
+            'test_commit': commit,
+            'test_comment': commit_comment
+        }), 200
+
+    # practice tests for an assignment that's almost due go ahead of the others
+    queue = queues.getQueue(queues.testQueue(initial_due_date, revision_due_date))
+    # students take turns in the queue, see fair.py
+    with timings.timed(timings.ENQUEUE, assignment_id, login.lower()):
+        job = fair.enqueue(queue, login.lower(),
+            runTest, (assignment_id, submission_dir, html_file, github_link, GRADING_TOOLS_DIR, head_commit), result_ttl=86400, timeout=600
+        )
+    if not job:
+        return f"You already have {fair.MAX_JOBS} tests waiting or running.", 300
+    job_id = job.get_id()
+    job_position = jobs.getPosition(job)
+
+    with db.transaction(immediate=True):
+        db.setCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit)
+        db.setJob(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], job_id)
 
     return jsonify({
         'file_exists': False,
@@ -324,15 +491,16 @@ def submit_initial(assignment_id, login):
     if basically_today > datetime.datetime.strptime(initial_due_date, "%Y-%m-%d").date():
         return "Submission date past.", 400
     
-    student_id = db.getStudentID(login.lower())
-    student_group = db.getStudent(student_id)[2]
+    with db.transaction(immediate=True):
+        student_id = db.getStudentID(login.lower())
+        student_group = db.getStudent(student_id)[2]
+        db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
+        last_commit = db.getInitialCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
     if student_group == db.TOOL_BASED:
         include_subjective = False
     else:
         include_subjective = True
 
-    db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
-
     user_dir = "%s/%s" % (REPOS_DIR, login)
     repo_dir = "%s/submission" % user_dir
     results_dir = "%s/tool-results" % user_dir
@@ -342,7 +510,6 @@ def submit_initial(assignment_id, login):
     commit = _commit['commit_id']
     commit_comment = _commit['commit_comment']
     head_commit = _commit['head_commit']
-    last_commit = db.getInitialCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
     
     if not head_commit:
         return f"You haven't made any commits to your repository.", 404
@@ -359,14 +526,18 @@ def submit_initial(assignment_id, login):
     db.submitInitial(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit, now)
 
     github_link = f'https://github.iu.edu/csci-b351-sp19/{login}-submission/tree/{commit}/{assignment_name}'
-    job = q.enqueue_call(
-        func=runGrade, args=(assignment_id, f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code', f'{results_dir}/{assignment_name}-initial.html',
-            include_subjective, github_link, GRADING_TOOLS_DIR), result_ttl=86400, timeout=600
-    )
-    if job:
-        job_id = job.get_id()
-    else:
-        return 'Error starting grading tool process.', 500
+    submission_dir = f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code'
+    html_file = f'{results_dir}/{assignment_name}-initial.html'
+
+    cached, _ = results.restore(results.getKey(assignment_id, submission_dir, tools.getVersion(GRADING_TOOLS_DIR, assignment_id), False, include_subjective), html_file, github_link)
+    if not cached:
+        with timings.timed(timings.ENQUEUE, assignment_id, login.lower()):
+            job = jobs.enqueue(queues.getQueue(queues.GRADING),
+                runGrade, (assignment_id, submission_dir, html_file, include_subjective, github_link, GRADING_TOOLS_DIR, head_commit),
+                student=login.lower(), result_ttl=86400, timeout=600
+            )
+        if not job:
+            return 'Error starting grading tool process.', 500
 
     return jsonify({
         'initial_date': now,
@@ -386,15 +557,16 @@ def submit_revision(assignment_id, login):
     if basically_today > datetime.datetime.strptime(revision_due_date, "%Y-%m-%d").date():
         return "Revision submission deadline past.", 400
 
-    student_id = db.getStudentID(login.lower())
-    student_group = db.getStudent(student_id)[2]
+    with db.transaction(immediate=True):
+        student_id = db.getStudentID(login.lower())
+        student_group = db.getStudent(student_id)[2]
+        db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
+        last_commit = db.getRevisionCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
     if student_group == db.TOOL_BASED:
         include_subjective = False
     else:
         include_subjective = True
 
-    db.addSubmission(student_id, ASSIGNMENTS[assignment_id]["canvas_id"]) # just in case
-
     user_dir = "%s/%s" % (REPOS_DIR, login)
     repo_dir = "%s/submission" % user_dir
     results_dir = "%s/tool-results" % user_dir
@@ -404,7 +576,6 @@ def submit_revision(assignment_id, login):
     commit = _commit['commit_id']
     commit_comment = _commit['commit_comment']
     head_commit = _commit['head_commit']
-    last_commit = db.getRevisionCommit(student_id, ASSIGNMENTS[assignment_id]["canvas_id"])
     
     if not head_commit:
         return f"You haven't made any commits to your repository.", 404
@@ -421,14 +592,18 @@ def submit_revision(assignment_id, login):
     now = datetime.date.today()
     db.submitRevision(student_id, ASSIGNMENTS[assignment_id]["canvas_id"], commit, now)
 
-    job = q.enqueue_call(
-        func=runGrade, args=(assignment_id, f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code', f'{results_dir}/{assignment_name}-revision.html',
-            include_subjective, github_link, GRADING_TOOLS_DIR), result_ttl=86400
-    )
-    if job:
-        job_id = job.get_id()
-    else:
-        return 'Error starting grading tool process.', 500
+    submission_dir = f'{repo_dir}/{assignment_name}/' if assignment_name != "a2" else f'{repo_dir}/{assignment_name}/code'
+    html_file = f'{results_dir}/{assignment_name}-revision.html'
+
+    cached, _ = results.restore(results.getKey(assignment_id, submission_dir, tools.getVersion(GRADING_TOOLS_DIR, assignment_id), False, include_subjective), html_file, github_link)
+    if not cached:
+        with timings.timed(timings.ENQUEUE, assignment_id, login.lower()):
+            job = jobs.enqueue(queues.getQueue(queues.GRADING),
+                runGrade, (assignment_id, submission_dir, html_file, include_subjective, github_link, GRADING_TOOLS_DIR, head_commit),
+                student=login.lower(), result_ttl=86400
+            )
+        if not job:
+            return 'Error starting grading tool process.', 500
 
     return jsonify({
         'revision_date': now,
@@ -440,12 +615,12 @@ def submit_revision(assignment_id, login):
 def download_initial_feedback(login, assignment_id):
     results_dir = "%s/%s/tool-results" % (REPOS_DIR, login)
     if os.path.exists("%s/%s-initial.html" % (results_dir, assignment_id)):
-        return send_from_directory(results_dir, "%s-initial.html" % assignment_id)
+        return _send_report(results_dir, "%s-initial.html" % assignment_id)
     return "no file present", 404
 
 @app.route('/admin/<login>/<assignment_id>/revision-feedback')
 def download_revision_feedback(login, assignment_id):
     results_dir = "%s/%s/tool-results" % (REPOS_DIR, login)
     if os.path.exists("%s/%s-revision.html" % (results_dir, assignment_id)):
-        return send_from_directory(results_dir, "%s-revision.html" % assignment_id)
+        return _send_report(results_dir, "%s-revision.html" % assignment_id)
     return "no file present", 404
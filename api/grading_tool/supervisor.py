@@ -0,0 +1,274 @@
+"""
+ Runs a pool of RQ worker processes on the grading queues (see run_supervisor.py), so
+ grading uses every core instead of the one a single `run_worker.py` gets.
+
+ The supervisor only forks, watches and signals its workers; each one is an ordinary
+ rq Worker with its own redis connection. Every `interval` seconds it looks at the
+ queues and resizes the pool between `min_workers` and `max_workers`:
+
+     wanted = min_workers + ceil(jobs waiting / backlog_per_worker)
+     and one more than now if the oldest job has waited longer than `max_wait`
+
+ Growing happens straight away; shrinking only once fewer workers have been enough for
+ `cooldown` seconds, one idle worker at a time. Workers that die without being asked
+ to are replaced (with a growing delay if they keep dying right after starting).
+
+ Signals understood by the supervisor:
+     SIGTERM/SIGINT:  drain. Every worker finishes its current job and exits (rq's warm
+                      shutdown), then the supervisor exits. A second signal is passed
+                      on too, which makes rq abandon the running jobs (cold shutdown).
+"""
+
+from rq import Worker, Queue
+import signal
+import gc
+import socket
+import redis
+import math
+import time
+import sys
+import os
+
+from . import queues
+from . import tools
+# what every job imports besides the grading tools, loaded once here for the work horses
+from . import fair, jobs, results
+import git
+
+RESTART_DELAY_MAX = 30 # seconds between restarts of a worker that keeps crashing
+
+class WeightedWorker(Worker):
+    """
+    Takes jobs from the non-empty queues in proportion to queues.WEIGHTS instead of
+    always from the highest one, so practice tests and regrades keep moving while
+    grading jobs are waiting. Relies on rq's reorder_queues hook (rq >= 1.6); older
+    versions fall back to strict priority.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reorder()
+
+    def _reorder(self):
+        by_name = {q.name: q for q in self.queues}
+        self._ordered_queues = [by_name[name] for name in queues.weightedOrder(list(by_name))]
+
+    def reorder_queues(self, reference_queue):
+        self._reorder()
+
+class WarmMixin:
+    """
+    Loads the grading tools (see tools.py) in the worker itself before forking the work
+    horse of every job, so jobs inherit `grade` and its test suites copy-on-write
+    instead of importing them again. They are loaded again when their files change.
+    Preloaded objects are moved out of the garbage collector's reach (gc.freeze) so
+    that collections in the work horses don't copy their pages.
+    """
+
+    def __init__(self, *args, grading_tools_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.grading_tools_dir = grading_tools_dir
+        self._grade = None
+
+    def warm(self):
+        if not self.grading_tools_dir:
+            return
+        try:
+            grade = tools.getRegistry(self.grading_tools_dir).refresh().grade
+        except Exception as e: # the job will report it when it tries the same import
+            self.log.warning("Could not preload the grading tools from %s: %s", self.grading_tools_dir, e)
+            self._grade = None
+            return
+        if grade is not self._grade:
+            if self._grade is not None:
+                self.log.info("Grading tools changed, reloaded them")
+            self._grade = grade
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+
+    def execute_job(self, job, queue):
+        self.warm()
+        return super().execute_job(job, queue)
+
+class WarmWorker(WarmMixin, Worker):
+    pass
+
+class WarmWeightedWorker(WarmMixin, WeightedWorker):
+    pass
+
+def makeWorker(redis_url, queue_names, scheduling='strict', name=None, grading_tools_dir=None):
+    """
+    Returns:
+        Worker: An rq worker on the given queues (highest priority first) with a new
+                connection; `scheduling` is 'strict' or 'weighted' (see WeightedWorker).
+                With `grading_tools_dir` it preloads them (see WarmMixin).
+    """
+    conn = redis.from_url(redis_url)
+    kwargs = {'connection': conn, 'name': name}
+    if grading_tools_dir:
+        worker_class = WarmWeightedWorker if scheduling == 'weighted' else WarmWorker
+        kwargs['grading_tools_dir'] = grading_tools_dir
+    else:
+        worker_class = WeightedWorker if scheduling == 'weighted' else Worker
+    qs = [Queue(name, connection=conn, default_timeout=queues.DEFAULT_TIMEOUT) for name in queue_names]
+    w = worker_class(qs, **kwargs)
+    if grading_tools_dir:
+        w.warm()
+    return w
+
+class Supervisor:
+    """
+    Forks, restarts and scales the worker processes.
+
+    Args:
+        redis_url (str):          Redis the queues live in.
+        queue_names (list):       Queues to listen on, highest priority first.
+        scheduling (str):         'strict' or 'weighted', see makeWorker.
+        grading_tools_dir (str):  Preload the grading tools from here, see WarmMixin.
+        min_workers (int):        Never fewer worker processes than this.
+        max_workers (int):        Never more worker processes than this.
+        backlog_per_worker (int): Waiting jobs that justify one more worker.
+        max_wait (float):         Add a worker when the oldest job waited longer (seconds).
+        cooldown (float):         Seconds fewer workers must be enough before one is stopped.
+        interval (float):         Seconds between looks at the queues.
+    """
+
+    def __init__(self, redis_url, queue_names, scheduling='strict', grading_tools_dir=None, min_workers=1,
+            max_workers=2, backlog_per_worker=2, max_wait=60, cooldown=60, interval=5):
+        self.redis_url = redis_url
+        self.queue_names = queue_names
+        self.scheduling = scheduling
+        self.grading_tools_dir = grading_tools_dir
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers, min_workers)
+        self.backlog_per_worker = backlog_per_worker
+        self.max_wait = max_wait
+        self.cooldown = cooldown
+        self.interval = interval
+        self.workers = {}      # pid -> time started
+        self.stopping = set()  # pids asked to exit
+        self.target = min_workers
+        self.surplus_since = None
+        self.crashes = 0
+        self.restart_at = 0
+        self.signals = 0
+
+    def _name(self, pid):
+        return '%s.%d' % (socket.gethostname(), pid)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setpgid(0, 0) # a Ctrl-C in the terminal is for the supervisor, which passes it on
+                for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                    signal.signal(sig, signal.SIG_DFL)
+                makeWorker(self.redis_url, self.queue_names, self.scheduling, self._name(os.getpid()),
+                    self.grading_tools_dir).work()
+                os._exit(0)
+            finally:
+                os._exit(1)
+        self.workers[pid] = time.time()
+        return pid
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.workers.pop(pid, None)
+            if pid in self.stopping:
+                self.stopping.discard(pid)
+                continue
+            # exited without being asked to: replaced by the main loop
+            print(f"Worker {pid} exited unexpectedly (status {status})", file=sys.stderr)
+            if started is not None and time.time() - started < 10:
+                self.crashes += 1
+                self.restart_at = time.time() + min(2 ** self.crashes, RESTART_DELAY_MAX)
+            else:
+                self.crashes = 0
+
+    def _signal(self, pid, sig=signal.SIGTERM):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _idle(self, pids):
+        """ Returns the given workers that aren't working on a job, as far as rq knows. """
+        pipe = self.conn.pipeline()
+        for pid in pids:
+            pipe.hget(Worker.redis_worker_namespace_prefix + self._name(pid), 'state')
+        return [pid for pid, state in zip(pids, pipe.execute()) if state != b'busy']
+
+    def wanted(self, depth, oldest_wait, current):
+        """ Returns how many workers the pool should have for the given backlog. """
+        wanted = self.min_workers + math.ceil(depth / self.backlog_per_worker)
+        if depth and oldest_wait > self.max_wait:
+            wanted = max(wanted, current + 1)
+        return max(self.min_workers, min(self.max_workers, wanted))
+
+    def scale(self):
+        """ Looks at the queues and grows or shrinks the pool. """
+        try:
+            depth, oldest_wait = queues.backlog(self.qs)
+        except Exception as e: # keep the pool as it is while redis is unreachable
+            print(f"Can't read the queues: {e}", file=sys.stderr)
+            return
+        running = [pid for pid in self.workers if pid not in self.stopping]
+        wanted = self.wanted(depth, oldest_wait, len(running))
+        if wanted >= len(running):
+            self.surplus_since = None
+            if wanted != self.target:
+                print(f"Scaling to {wanted} workers ({depth} jobs waiting, oldest for {oldest_wait:.0f}s)", file=sys.stderr)
+            self.target = wanted
+            return
+        if self.surplus_since is None:
+            self.surplus_since = time.time()
+        if time.time() - self.surplus_since < self.cooldown:
+            return
+        idle = self._idle(running)
+        if idle:
+            self.target = len(running) - 1
+            print(f"Scaling to {self.target} workers ({depth} jobs waiting)", file=sys.stderr)
+            self.stopping.add(idle[0])
+            self._signal(idle[0])
+            self.surplus_since = time.time()
+
+    def run(self):
+        self.conn = redis.from_url(self.redis_url)
+        self.qs = [Queue(name, connection=self.conn) for name in self.queue_names]
+
+        def on_term(*args):
+            self.signals += 1
+        signal.signal(signal.SIGTERM, on_term)
+        signal.signal(signal.SIGINT, on_term)
+
+        print(f"Supervising {self.min_workers}-{self.max_workers} workers on {', '.join(self.queue_names)} (pid {os.getpid()})", file=sys.stderr)
+        next_scale = 0
+        while not self.signals:
+            self._reap()
+            if time.time() >= next_scale:
+                self.scale()
+                next_scale = time.time() + self.interval
+            # keep the pool at its size (new, crashed workers)
+            running = len(self.workers) - len(self.stopping)
+            while not self.signals and running < self.target and time.time() >= self.restart_at:
+                self._spawn()
+                running += 1
+            time.sleep(0.2)
+
+        print(f"Draining {len(self.workers)} workers", file=sys.stderr)
+        forwarded = 0
+        while self.workers:
+            while forwarded < self.signals: # first: warm shutdown, second: cold shutdown
+                forwarded += 1
+                for pid in self.workers:
+                    self.stopping.add(pid)
+                    self._signal(pid)
+            self._reap()
+            time.sleep(0.2)
@@ -0,0 +1,202 @@
+"""
+ Where grading time goes: per-phase timings of silo requests and grading jobs.
+
+ Phases (PHASES): the git sync of the student's repository (update_repo), the lookup of
+ the assignment's last commit, enqueueing, the time a job waited in the queue, loading
+ the grading tools, the grade run itself and writing the results (cache, backup and
+ gzipped copy). Plus the time spent waiting for a student's repository locks (see
+ utils/repos.py), by syncs and by jobs reading the worktree.
+
+ Every timing goes into a fixed-bucket histogram per (phase, assignment) in one redis
+ hash per semester (PERIOD_KEY), so a semester's worth of jobs costs a few hundred hash
+ fields, and into a capped list of the most recent samples with the student's login.
+ The silo server's /metrics serves the histograms in Prometheus' text format (or as
+ JSON with percentiles, `?format=json`); `?period=` picks an older semester to compare.
+
+ Syncs of a student's repository are also counted by outcome (GIT_SYNCS: `updated` when
+ something new was fetched, `cleaned` when only the worktree needed a reset, `unchanged`
+ when neither), along with the bytes fetched (GIT_FETCHED_BYTES) and the syncs that
+ left the fetch to a concurrent one (GIT_FETCHES_COALESCED), in COUNTERS_KEY.
+
+ Recording never fails the request or job it measures.
+"""
+
+from contextlib import contextmanager
+from datetime import date
+import bisect
+import time
+
+from .worker import getConnection
+
+GIT_SYNC = 'git_sync'
+COMMIT_LOOKUP = 'commit_lookup'
+ENQUEUE = 'enqueue'
+QUEUE_WAIT = 'queue_wait'
+TOOL_LOAD = 'tool_load'
+GRADE = 'grade'
+RESULT_WRITE = 'result_write'
+LOCK_WAIT = 'lock_wait'
+PHASES = [GIT_SYNC, COMMIT_LOOKUP, ENQUEUE, QUEUE_WAIT, TOOL_LOAD, GRADE, RESULT_WRITE, LOCK_WAIT]
+
+# upper bounds in seconds; anything slower lands in the last, unbounded bucket
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300, 600]
+
+PERIOD_KEY = 'grading-tool:timings:%s'        # period: hash "phase|assignment|bucket" -> count, "phase|assignment|sum" -> seconds
+PERIODS_KEY = 'grading-tool:timings:periods'  # set of periods with timings
+SAMPLES_KEY = 'grading-tool:timings:samples'  # recent "phase assignment login seconds timestamp"
+SAMPLES_KEPT = 10000
+
+GIT_SYNCS = 'git_syncs'
+GIT_FETCHED_BYTES = 'git_fetched_bytes'
+GIT_FETCHES_COALESCED = 'git_fetches_coalesced'
+COUNTER_LABELS = {GIT_SYNCS: 'outcome'}
+COUNTERS_KEY = 'grading-tool:counters:%s'     # period: hash "counter|label" -> total
+
+def getPeriod(day=None):
+    """
+    Returns:
+        str: The semester `day` (default today) is in, e.g. "2019-spring".
+    """
+    day = day or date.today()
+    season = 'spring' if day.month <= 5 else 'summer' if day.month <= 7 else 'fall'
+    return '%d-%s' % (day.year, season)
+
+def record(phase, seconds, assignment=None, login=None):
+    """ Adds one timing of `phase`. """
+    try:
+        period = getPeriod()
+        prefix = '%s|%s|' % (phase, assignment or '-')
+        pipe = getConnection().pipeline(transaction=False)
+        pipe.hincrby(PERIOD_KEY % period, prefix + str(bisect.bisect_left(BUCKETS, seconds)), 1)
+        pipe.hincrbyfloat(PERIOD_KEY % period, prefix + 'sum', seconds)
+        pipe.sadd(PERIODS_KEY, period)
+        pipe.lpush(SAMPLES_KEY, '%s %s %s %.6f %d' % (phase, assignment or '-', login or '-', seconds, time.time()))
+        pipe.ltrim(SAMPLES_KEY, 0, SAMPLES_KEPT - 1)
+        pipe.execute()
+    except Exception:
+        pass
+
+def count(counter, amount=1, label=None):
+    """ Adds `amount` to `counter` (of the given label, e.g. a sync's outcome). """
+    try:
+        period = getPeriod()
+        pipe = getConnection().pipeline(transaction=False)
+        pipe.hincrby(COUNTERS_KEY % period, '%s|%s' % (counter, label or '-'), amount)
+        pipe.sadd(PERIODS_KEY, period)
+        pipe.execute()
+    except Exception:
+        pass
+
+def recordSync(sync, login=None):
+    """
+    Counts a sync of a student's repository (a utils.repos.Sync) and the bytes it
+    fetched, and records how long it waited for the repository's locks.
+    """
+    outcome = 'updated' if sync.fetched else 'cleaned' if sync.checked_out else 'unchanged'
+    count(GIT_SYNCS, label=outcome)
+    if sync.bytes:
+        count(GIT_FETCHED_BYTES, sync.bytes)
+    if sync.coalesced:
+        count(GIT_FETCHES_COALESCED)
+    record(LOCK_WAIT, sync.lock_wait, login=login)
+
+@contextmanager
+def timed(phase, assignment=None, login=None):
+    """
+    Records how long the block took as a timing of `phase` (also if it raises). Example:
+
+        with timings.timed(timings.GIT_SYNC, login=login):
+            repo.remotes.origin.pull()
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start, assignment, login)
+
+def _percentile(counts, total, p):
+    """ Upper bound of the bucket the p-th percentile falls in (None for the unbounded one). """
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= total * p / 100:
+            return BUCKETS[i] if i < len(BUCKETS) else None
+    return None
+
+def getHistograms(period=None):
+    """
+    Returns:
+        dict: {phase: {assignment: histogram}} for the given period (default the current
+              one). A histogram has the `count` and `sum` of the timings, the `counts`
+              per bucket (see BUCKETS, plus one for slower ones) and the upper bounds of
+              the buckets of the p50, p90 and p99.
+    """
+    rows = getConnection().hgetall(PERIOD_KEY % (period or getPeriod()))
+    histograms = {}
+    for field, value in rows.items():
+        phase, assignment, bucket = field.decode().split('|')
+        h = histograms.setdefault(phase, {}).setdefault(assignment, {'counts': [0] * (len(BUCKETS) + 1), 'sum': 0.0})
+        if bucket == 'sum':
+            h['sum'] = float(value)
+        else:
+            h['counts'][int(bucket)] = int(value)
+    for by_assignment in histograms.values():
+        for h in by_assignment.values():
+            h['count'] = sum(h['counts'])
+            for p in (50, 90, 99):
+                h['p%d' % p] = _percentile(h['counts'], h['count'], p)
+    return histograms
+
+def getCounters(period=None):
+    """
+    Returns:
+        dict: {counter: {label: total}} for the given period (default the current one);
+              the label is '-' for counters without one.
+    """
+    counters = {}
+    for field, value in getConnection().hgetall(COUNTERS_KEY % (period or getPeriod())).items():
+        counter, label = field.decode().split('|')
+        counters.setdefault(counter, {})[label] = int(value)
+    return counters
+
+def getPeriods():
+    """ Returns the periods timings were recorded in, oldest first. """
+    return sorted(p.decode() for p in getConnection().smembers(PERIODS_KEY))
+
+def getSamples(login=None, limit=100):
+    """
+    Returns:
+        list: The most recent timings (of one student, if `login` is given), newest
+              first, as dicts with `phase`, `assignment`, `login`, `seconds` and `at`.
+    """
+    samples = []
+    for raw in getConnection().lrange(SAMPLES_KEY, 0, -1):
+        phase, assignment, who, seconds, at = raw.decode().split(' ')
+        if login and who != login:
+            continue
+        samples.append({'phase': phase, 'assignment': assignment, 'login': who, 'seconds': float(seconds), 'at': int(at)})
+        if len(samples) >= limit:
+            break
+    return samples
+
+def prometheus(period=None):
+    """ Returns the histograms and counters of the given period in Prometheus' text exposition format. """
+    lines = [
+        '# HELP grading_tool_phase_seconds Time spent in each phase of silo requests and grading jobs.',
+        '# TYPE grading_tool_phase_seconds histogram',
+    ]
+    for phase, by_assignment in sorted(getHistograms(period).items()):
+        for assignment, h in sorted(by_assignment.items()):
+            labels = 'phase="%s",assignment="%s"' % (phase, assignment)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ['+Inf'], h['counts']):
+                cumulative += count
+                lines.append('grading_tool_phase_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+            lines.append('grading_tool_phase_seconds_sum{%s} %f' % (labels, h['sum']))
+            lines.append('grading_tool_phase_seconds_count{%s} %d' % (labels, h['count']))
+    for counter, by_label in sorted(getCounters(period).items()):
+        lines.append('# TYPE grading_tool_%s_total counter' % counter)
+        for label, total in sorted(by_label.items()):
+            labels = '{%s="%s"}' % (COUNTER_LABELS[counter], label) if counter in COUNTER_LABELS else ''
+            lines.append('grading_tool_%s_total%s %d' % (counter, labels, total))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,176 @@
+"""
+ Versioned registry of the grading tools (GRADING_TOOLS_DIR).
+
+ Every assignment's tools have a version: a content hash of the files that grade it,
+ i.e. the files in its own folder (a top-level folder named after the assignment, if
+ there is one) and every file outside the assignment folders (grade.py and whatever it
+ shares between assignments). Changing a3's test suite changes a3's version only;
+ changing grade.py changes them all.
+
+ The registry keeps the imported `grade` module and its suites in memory with the
+ versions they were loaded at. `refresh` compares the files' sizes and modification
+ times with the last look (only files that changed are hashed again) and, if any of
+ them changed, imports `grade` afresh and swaps the new state in as a whole; if the new
+ import fails, the old tools stay in use. Workers refresh before every job (see
+ supervisor.WarmMixin), so updating a test suite mid-semester doesn't need a restart.
+
+ Results and reports record the version that made them (see results.py), so cached
+ results and regrades can target exactly the stale ones.
+"""
+
+from collections import namedtuple
+import importlib
+import threading
+import hashlib
+import sys
+import os
+
+from . import ASSIGNMENTS
+
+SKIPPED_DIRS = ('.git', '__pycache__')
+
+# What one refresh loaded: the `grade` module, {assignment_id: version} and
+# {version: tool} for every assignment in grade.tools.
+State = namedtuple('State', 'grade versions suites')
+
+class Registry:
+    """
+    The grading tools in one directory.
+
+    Args:
+        grading_tools_dir (str): Where grade.py is.
+    """
+
+    def __init__(self, grading_tools_dir):
+        self.grading_tools_dir = grading_tools_dir
+        self.state = None
+        self._lock = threading.Lock()
+        self._seen = None    # ({path: (size, mtime)}, {assignment_id: version}) at the last look
+        self._digests = {}   # path -> ((size, mtime), sha256 of its content)
+
+    def _scan(self):
+        stats = {}
+        for root, dirs, files in os.walk(self.grading_tools_dir):
+            dirs.sort()
+            dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS]
+            for name in sorted(files):
+                if name.endswith('.pyc'):
+                    continue
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                stats[path] = (st.st_size, st.st_mtime_ns)
+        return stats
+
+    def _digest(self, path, stat):
+        cached = self._digests.get(path)
+        if cached and cached[0] == stat:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        self._digests[path] = (stat, h.hexdigest())
+        return self._digests[path][1]
+
+    def _hashVersions(self, stats):
+        folders = {conf.get("folder_name", a): a for a, conf in ASSIGNMENTS.items()}
+        shared, own = hashlib.sha256(), {a: hashlib.sha256() for a in ASSIGNMENTS}
+        for path in sorted(stats):
+            rel = os.path.relpath(path, self.grading_tools_dir)
+            line = ("%s %s\n" % (rel, self._digest(path, stats[path]))).encode()
+            top = rel.split(os.sep, 1)[0]
+            if top in folders and top != rel:
+                own[folders[top]].update(line)
+            else:
+                shared.update(line)
+        shared = shared.hexdigest()
+        return {a: hashlib.sha256(('%s %s %s' % (a, shared, h.hexdigest())).encode()).hexdigest()[:16]
+            for a, h in own.items()}
+
+    def _look(self):
+        """ Returns the current {assignment_id: version}, hashing only what changed. """
+        stats = self._scan()
+        if self._seen is None or self._seen[0] != stats:
+            self._seen = (stats, self._hashVersions(stats))
+            self._digests = {path: self._digests[path] for path in stats if path in self._digests}
+        return self._seen[1]
+
+    def _import(self):
+        """ Imports `grade` from the grading tools without touching what is loaded now. """
+        prefix = os.path.join(os.path.realpath(self.grading_tools_dir), '')
+        def ours(name, module):
+            path = getattr(module, '__file__', None)
+            return name == 'grade' or bool(path and os.path.realpath(path).startswith(prefix))
+        old = {name: module for name, module in list(sys.modules.items()) if ours(name, module)}
+        for name in old:
+            del sys.modules[name]
+        if self.grading_tools_dir not in sys.path:
+            sys.path.append(self.grading_tools_dir)
+        importlib.invalidate_caches()
+        try:
+            return importlib.import_module('grade')
+        except BaseException:
+            for name, module in list(sys.modules.items()):
+                if ours(name, module):
+                    del sys.modules[name]
+            sys.modules.update(old)
+            raise
+
+    def refresh(self):
+        """
+        Reloads the grading tools if their files changed since the last look.
+
+        Returns:
+            State: The tools in use from now on.
+
+        Raises:
+            Whatever importing `grade` raises, if there are no older tools to fall back to.
+        """
+        with self._lock:
+            versions = self._look()
+            if self.state is not None and versions == self.state.versions:
+                return self.state
+            try:
+                grade = self._import()
+            except Exception:
+                if self.state is None:
+                    raise
+                return self.state # keep grading with the tools that worked; retried next time
+            tools = getattr(grade, 'tools', {})
+            self.state = State(grade, versions, {versions[a]: tools[a] for a in tools if a in versions})
+            return self.state
+
+    def get(self, assignment_id):
+        """
+        Returns:
+            tuple: (grade module, tool, version) of the given assignment, as of now.
+        """
+        state = self.refresh()
+        version = state.versions.get(assignment_id)
+        tool = state.suites[version] if version in state.suites else state.grade.tools[assignment_id]
+        return state.grade, tool, version
+
+    def getVersion(self, assignment_id):
+        """
+        Returns:
+            str: The version of the given assignment's tools as they are on disk now,
+                 without importing them.
+        """
+        with self._lock:
+            return self._look().get(assignment_id)
+
+_registries = {}
+
+def getRegistry(grading_tools_dir):
+    """ Returns the registry of the given directory, shared by everything in this process. """
+    if grading_tools_dir not in _registries:
+        _registries[grading_tools_dir] = Registry(grading_tools_dir)
+    return _registries[grading_tools_dir]
+
+def getTool(grading_tools_dir, assignment_id):
+    """ Shortcut for getRegistry(grading_tools_dir).get(assignment_id). """
+    return getRegistry(grading_tools_dir).get(assignment_id)
+
+def getVersion(grading_tools_dir, assignment_id):
+    """ Shortcut for getRegistry(grading_tools_dir).getVersion(assignment_id). """
+    return getRegistry(grading_tools_dir).getVersion(assignment_id)
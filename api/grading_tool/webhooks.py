@@ -0,0 +1,71 @@
+"""
+ GitHub push webhooks of the students' repositories.
+
+ github.iu.edu posts a push event to the silo server's /webhooks/push (a webhook on the
+ organization, content type application/json, signed with `webhook_secret`) whenever a
+ student pushes. The route fetches nothing itself: it puts a sync of the student's
+ repository on the `syncs` queue (worker.syncRepo), which fetches it into the mirror,
+ resets the grading tool's worktree and brings the last-commit index up to date (see
+ utils/repos.py). By the time the student tests or submits, update_repo's own fetch
+ finds nothing new.
+
+ One sync per student waits in the queue at a time: it fetches everything pushed until
+ it starts, so further pushes meanwhile don't add another one.
+"""
+
+import hashlib
+import hmac
+
+from . import WEBHOOK_SECRET, repos
+from .worker import getConnection, syncRepo
+from . import jobs
+from . import queues
+
+PENDING_KEY = 'grading-tool:syncs:pending:%s'  # set while a sync waits for the student
+PENDING_TTL = 600                               # in case the sync never runs
+SYNC_TTL = 3600                                 # seconds a finished sync is kept
+URL_FIELDS = ('ssh_url', 'clone_url', 'git_url')
+
+def verify(body, signature, secret=None):
+    """
+    Returns:
+        bool: Whether `signature` (the X-Hub-Signature-256 header) is the HMAC-SHA256 of
+              the request's raw `body` with the webhook secret. Always False without a
+              secret configured.
+    """
+    secret = WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature or not signature.startswith('sha256='):
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+def getLogin(payload):
+    """ Returns the login of the student whose repository the push event is for, or None. """
+    repository = payload.get('repository') or {}
+    for field in URL_FIELDS:
+        login = repos.getLogin(repository.get(field))
+        if login:
+            return login
+    return None
+
+def schedule(login):
+    """
+    Puts a sync of the student's repository on the syncs queue, unless one is waiting
+    already.
+
+    Returns:
+        rq.job.Job: The sync, or None if one was waiting already (it will pick up the push).
+    """
+    conn = getConnection()
+    if not conn.set(PENDING_KEY % login, 1, nx=True, ex=PENDING_TTL):
+        return None
+    try:
+        return jobs.enqueue(queues.getQueue(queues.SYNCS), syncRepo, (login,), student=login.lower(),
+            result_ttl=SYNC_TTL)
+    except BaseException:
+        conn.delete(PENDING_KEY % login)
+        raise
+
+def markStarted(login):
+    """ Called by the sync when it starts: pushes from now on need a sync of their own. """
+    getConnection().delete(PENDING_KEY % login)
@@ -1,10 +1,21 @@
-import redis
-import sys
+from contextlib import contextmanager
+import tempfile
+import gzip
 import os
 
+from ..utils import lazy_import
+redis = lazy_import('redis')
+
 listen = ['default']
 redis_url = os.getenv('REDISTOGO_URL', 'redis://localhost:12345')
-conn = redis.from_url(redis_url)
+_conn = None
+
+def getConnection():
+    """ Returns the (shared) redis connection, connecting on first use. """
+    global _conn
+    if _conn is None:
+        _conn = redis.from_url(redis_url)
+    return _conn
 
 def backup(html_file):
     i = 0
@@ -13,22 +24,138 @@ def backup(html_file):
         i += 1
     open(f'{html_root}.{i}.html', 'w').write(open(html_file, 'r').read())
 
+def compress(html_file):
+    """
+    Writes a gzipped copy of the given report next to it (`<file>.gz`), which the silo
+    server hands out to clients that accept gzip. Returns the path of the copy.
+    """
+    gz_file = f'{html_file}.gz'
+    # a name of its own: the silo server's threads may compress the same report at once
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(gz_file), prefix='.gz-')
+    try:
+        os.chmod(tmp_file, 0o644)
+        with open(html_file, 'rb') as src, os.fdopen(fd, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9) as dst:
+            dst.write(src.read())
+        os.replace(tmp_file, gz_file)
+    except BaseException:
+        os.unlink(tmp_file)
+        raise
+    return gz_file
+
+@contextmanager
+def _tracked(assignment_id):
+    """
+    Moves the queue's serving ticket up to the current job's, lets the student's next
+    test into the queue (see fair.py) and tells anyone watching the job when it starts
+    and finishes (see jobs.py). Records how long the job waited (see timings.py) and
+    yields the (assignment, login) to tag the job's other timings with.
+    """
+    from rq import get_current_job
+    from . import jobs, fair, timings, queues
+    job = get_current_job()
+    jobs.markStarted(job)
+    fair.markStarted(job)
+    tags = (assignment_id, jobs.getLogin(job))
+    if job is not None:
+        wait = queues._age(job.created_at)
+        if wait is not None:
+            timings.record(timings.QUEUE_WAIT, wait, *tags)
+    try:
+        yield tags
+    except BaseException:
+        jobs.publish(job, jobs.FAILED)
+        raise
+    else:
+        jobs.publish(job, jobs.FINISHED)
+    finally:
+        fair.markDone(job)
+
+@contextmanager
+def _snapshot(path, tags, commit=None):
+    """
+    Yields where to find `path` in a snapshot of the student's repository (at `commit`
+    or its HEAD, see StudentRepos.snapshot), so that syncs neither wait for the job nor
+    change the files under it. Records how long the student's locks took to get.
+    """
+    from . import repos, timings
+    with repos.snapshot(path, commit) as (snapshot, waited):
+        timings.record(timings.LOCK_WAIT, waited, *tags)
+        yield snapshot
+
+def _key(*args):
+    """ The results cache key of what is about to be graded (see results.py). """
+    from . import results
+    try:
+        return results.getKey(*args)
+    except Exception:
+        return None
+
+def _store(key, html_file, github_link, result, assignment_id, tool_version):
+    """ Records the report and stores it in the results cache. Never fails the job. """
+    from . import results
+    try:
+        results.store(key, html_file, github_link, result, assignment_id, tool_version)
+    except Exception:
+        pass
+
 # Run the student test, this is the function that is pushed to the q
-def runTest(assignment_id, submission_dir, html_file, github_link, grading_tools_dir):
-    sys.path.append(grading_tools_dir)
-    import grade
+def runTest(assignment_id, submission_dir, html_file, github_link, grading_tools_dir, commit=None):
+    """ Tests `submission_dir` as of `commit` (the HEAD the test was asked for; if None, whatever HEAD is now). """
+    from . import tools, timings
+    with _tracked(assignment_id) as tags, _snapshot(submission_dir, tags, commit) as submission_dir:
+        with timings.timed(timings.TOOL_LOAD, *tags):
+            grade, tool, tool_version = tools.getTool(grading_tools_dir, assignment_id)
+        results_key = _key(assignment_id, submission_dir, tool_version, True)
 
-    tool = grade.tools[assignment_id]
-    result = grade.safeGrade(submission_dir, html_file, tool.testSuite, tool.title, redact=True, github_link=github_link)
-    backup(html_file)
+        with timings.timed(timings.GRADE, *tags):
+            result = grade.safeGrade(submission_dir, html_file, tool.testSuite, tool.title, redact=True, github_link=github_link)
+        with timings.timed(timings.RESULT_WRITE, *tags):
+            _store(results_key, html_file, github_link, result, assignment_id, tool_version)
+            backup(html_file)
+            compress(html_file)
     return result
 
-def runGrade(assignment_id, submission_dir, html_file, include_subjective, github_link, grading_tools_dir):
-    sys.path.append(grading_tools_dir)
-    import grade
+def _grade(tags, assignment_id, submission_dir, html_file, include_subjective, github_link, grading_tools_dir):
+    from . import tools, timings
+    with timings.timed(timings.TOOL_LOAD, *tags):
+        grade, tool, tool_version = tools.getTool(grading_tools_dir, assignment_id)
+    results_key = _key(assignment_id, submission_dir, tool_version, False, include_subjective)
+
+    with timings.timed(timings.GRADE, *tags):
+        result = grade.safeGrade(submission_dir, html_file, tool.testSuite, tool.title, redact=False,
+            include_subjective=include_subjective, github_link=github_link)
+    with timings.timed(timings.RESULT_WRITE, *tags):
+        _store(results_key, html_file, github_link, result, assignment_id, tool_version)
+        backup(html_file)
+        compress(html_file)
+    return result
+
+def runGrade(assignment_id, submission_dir, html_file, include_subjective, github_link, grading_tools_dir, commit=None):
+    """ Grades `submission_dir` as of `commit` (the HEAD submitted; if None, whatever HEAD is now). """
+    with _tracked(assignment_id) as tags, _snapshot(submission_dir, tags, commit) as submission_dir:
+        return _grade(tags, assignment_id, submission_dir, html_file, include_subjective, github_link, grading_tools_dir)
+
+def syncRepo(login):
+    """
+    Fetches a student's repository after they pushed to it (see webhooks.py), resets the
+    grading tool's worktree and brings the last-commit index up to date.
+    """
+    from . import repos, timings, webhooks
+    webhooks.markStarted(login)
+    with timings.timed(timings.GIT_SYNC, login=login.lower()):
+        sync = repos.update(login, "submission")
+    if sync is None:
+        return None
+    timings.recordSync(sync, login.lower())
+    if sync.commit:
+        with timings.timed(timings.COMMIT_LOOKUP, login=login.lower()):
+            repos.updateIndex(login, sync.commit)
+    return sync.commit
 
-    tool = grade.tools[assignment_id]
-    result = grade.safeGrade(submission_dir, html_file, tool.testSuite, tool.title, redact=False,
-        include_subjective=include_subjective, github_link=github_link)
-    backup(html_file)
-    return result
\ No newline at end of file
+def runRegrade(assignment_id, repo_dir, commit, submission_dir, html_file, include_subjective, github_link, grading_tools_dir):
+    """
+    Grades `commit` of the student's repository (batch_regrade.py), in a snapshot
+    checked out at that commit: `repo_dir` itself is left at HEAD.
+    """
+    with _tracked(assignment_id) as tags, _snapshot(submission_dir, tags, commit) as submission_dir:
+        return _grade(tags, assignment_id, submission_dir, html_file, include_subjective, github_link, grading_tools_dir)
@@ -1,6 +1,42 @@
+import importlib.util
+import types
 import json
+import sys
+
+_configs = {}
 
 def load_config(file_path):
-    with open(file_path) as json_data_file:
-        data = json.load(json_data_file)
-    return data
\ No newline at end of file
+    """
+    Parses the JSON config at the given path. Each file is only parsed once per
+    process; every blueprint asking for it shares the same dict.
+    """
+    if file_path not in _configs:
+        with open(file_path) as json_data_file:
+            _configs[file_path] = json.load(json_data_file)
+    return _configs[file_path]
+
+class _LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is used, then imports it. Unlike
+    importlib.util.LazyLoader, which isn't thread-safe before Python 3.12, the import is
+    a regular one: a thread asking for an attribute while another one imports the module
+    waits for it to be done.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__) # later lookups don't come here
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """
+    Returns the module `name` without executing it yet: the real import happens the first
+    time one of its attributes is used. Keeps heavy dependencies (requests, gitpython, rq,
+    redis) off the start-up path of processes that never end up using them, which matters
+    since api.cgi starts a fresh interpreter for every request.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError("No module named %r" % name, name=name)
+    return _LazyModule(name)
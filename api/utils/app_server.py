@@ -0,0 +1,172 @@
+"""
+ Small pre-forking, threaded WSGI server used to keep the CGI app loaded between
+ requests (see run_app_server.py).
+
+ The master process only owns the listening socket. Each worker process imports the
+ app once, then serves requests on a pool of threads until it is told to stop, so
+ imports, parsed configs and HTTP sessions (GitHub, silo, Canvas) stay warm.
+
+ Signals understood by the master:
+     SIGHUP:          graceful reload. Workers are replaced one at a time; the old ones
+                      finish their in-flight requests before exiting.
+     SIGTERM/SIGINT:  graceful shutdown.
+"""
+
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+import importlib
+import threading
+import signal
+import socket
+import time
+import sys
+import os
+
+class ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = False
+    block_on_close = True
+    allow_reuse_address = True
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def _load_app(app_path):
+    module_name, attr = app_path.split(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+def _serve(sock, app_path, max_requests, quiet):
+    """
+    Worker process body. Serves requests from the shared socket until SIGTERM, or
+    until `max_requests` requests have been handled (0 means no limit).
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app = _load_app(app_path)
+    # every worker polls the same socket; don't let one block in accept() after losing the race
+    sock.setblocking(False)
+    handler = QuietHandler if quiet else WSGIRequestHandler
+    server = ThreadedWSGIServer(sock.getsockname(), handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.server_name, server.server_port = sock.getsockname()[:2]
+    server.setup_environ()
+    server.set_app(app)
+
+    handled = [0]
+    def stop(*args):
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if max_requests:
+        process_request = server.process_request
+        def counted(request, client_address):
+            process_request(request, client_address)
+            handled[0] += 1
+            if handled[0] == max_requests:
+                stop()
+        server.process_request = counted
+
+    server.serve_forever()
+    server.server_close() # waits for in-flight requests
+    os._exit(0)
+
+class AppServer:
+    """
+    Pre-forking master process.
+
+    Args:
+        app_path (str):     `module:attribute` of the WSGI app to serve.
+        host (str):         Interface to bind.
+        port (int):         Port to bind.
+        workers (int):      Number of worker processes.
+        max_requests (int): Recycle a worker after this many requests (0 to disable).
+        quiet (bool):       Don't log every request.
+    """
+
+    def __init__(self, app_path, host='127.0.0.1', port=30007, workers=2, max_requests=0, quiet=False):
+        self.app_path = app_path
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.quiet = quiet
+        self.workers = set()
+        self.running = True
+        self.reloading = False
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve(self.sock, self.app_path, self.max_requests, self.quiet)
+            finally:
+                os._exit(1)
+        self.workers.add(pid)
+        return pid
+
+    def _reap(self, block=False):
+        """ Collects exited workers. Returns the set of pids that exited. """
+        exited = set()
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            exited.add(pid)
+            self.workers.discard(pid)
+            if block:
+                break
+        return exited
+
+    def _stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.workers.discard(pid)
+
+    def reload(self):
+        """ Replaces every worker, one at a time, so there is always someone accepting. """
+        for pid in list(self.workers):
+            self._spawn()
+            self._stop_worker(pid)
+            while pid in self.workers:
+                self._reap(block=True)
+
+    def run(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(128)
+        self.sock.set_inheritable(True)
+
+        def on_term(*args):
+            self.running = False
+        def on_hup(*args):
+            self.reloading = True
+        signal.signal(signal.SIGTERM, on_term)
+        signal.signal(signal.SIGINT, on_term)
+        signal.signal(signal.SIGHUP, on_hup)
+
+        print(f"Serving {self.app_path} on {self.host}:{self.port} with {self.num_workers} workers (pid {os.getpid()})", file=sys.stderr)
+        for _ in range(self.num_workers):
+            self._spawn()
+
+        while self.running:
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            self._reap()
+            # keep the pool full (crashed or recycled workers)
+            while self.running and len(self.workers) < self.num_workers:
+                self._spawn()
+            time.sleep(0.2)
+
+        for pid in list(self.workers):
+            self._stop_worker(pid)
+        while self.workers:
+            self._reap(block=True)
+        self.sock.close()
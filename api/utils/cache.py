@@ -0,0 +1,95 @@
+import sqlite3
+import time
+import json
+import os
+
+class TTLCache:
+    """
+    Small LRU + TTL cache stored in a SQLite file, so that it survives across the
+    short-lived CGI processes. Every entry expires after its own ttl, and once the
+    cache holds more than `max_entries` items the least recently used ones are dropped.
+
+    Args:
+        location (str):    Path to the SQLite file backing the cache.
+        max_entries (int): Maximum number of entries kept before evicting.
+
+    Counters for hits, misses and expired entries are kept in the same file and can
+    be read back with `stats`.
+    """
+
+    def __init__(self, location, max_entries=1000):
+        self.location = location
+        self.max_entries = max_entries
+        self._conn = None
+
+    def _getConnection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.location)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.location, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(''' CREATE TABLE IF NOT EXISTS entries
+                    (key text PRIMARY KEY, value text, status integer,
+                    expires real, last_used real) ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name text PRIMARY KEY, count integer)")
+            self._conn = conn
+        return self._conn
+
+    def _count(self, conn, name):
+        conn.execute("INSERT INTO stats(name, count) VALUES(?, 1) ON CONFLICT(name) DO UPDATE SET count=count+1", (name,))
+
+    def get(self, key):
+        """
+        Looks up the given key.
+
+        Returns:
+            tuple: (value, status) of the stored entry, or None if the key is missing or expired.
+        """
+        conn = self._getConnection()
+        now = time.time()
+        row = conn.execute("SELECT value, status, expires FROM entries WHERE key=?", (key,)).fetchone()
+        if row is None:
+            self._count(conn, "miss")
+            return None
+        value, status, expires = row
+        if expires < now:
+            conn.execute("DELETE FROM entries WHERE key=?", (key,))
+            self._count(conn, "expired")
+            return None
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("UPDATE entries SET last_used=? WHERE key=?", (now, key))
+            self._count(conn, "hit" if value is not None else "negative_hit")
+        return (json.loads(value) if value is not None else None), status
+
+    def set(self, key, value, status, ttl):
+        """
+        Stores a value (or None, for negative entries) with its status code for `ttl` seconds.
+        """
+        conn = self._getConnection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("INSERT OR REPLACE INTO entries(key, value, status, expires, last_used) VALUES(?, ?, ?, ?, ?)",
+                (key, json.dumps(value) if value is not None else None, status, now + ttl, now))
+            conn.execute(''' DELETE FROM entries WHERE key IN
+                    (SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?) ''', (self.max_entries,))
+
+    def delete(self, key):
+        conn = self._getConnection()
+        conn.execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def stats(self):
+        """
+        Returns:
+            dict: The hit/miss counters and the current number of entries.
+        """
+        conn = self._getConnection()
+        stats = dict(conn.execute("SELECT name, count FROM stats").fetchall())
+        for name in ("hit", "negative_hit", "miss", "expired"):
+            stats.setdefault(name, 0)
+        stats["entries"] = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return stats
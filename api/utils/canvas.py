@@ -2,10 +2,15 @@
  Forked from: https://github.iu.edu/csci-b351-sp19/server.git
 """
 
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import json
+import time
 import os
 
+from . import lazy_import
+requests = lazy_import('requests')
+
 class Canvas:
     """
     Canvas object that handles all interactions with the Canvas API. 
@@ -21,6 +26,8 @@ class Canvas:
         uploadFileToSubmission:    Uploads a file to be used in a submission comment during grading.
         deleteFile:                Delete an uploaded File.
         gradeAssignmentAndComment: Grades an assignment and optionally comments on it by uploading a file
+        bulkGrade:                 Grades (and comments on) many students at once, returns a Canvas Progress.
+        gradeAssignmentBatch:      Uploads feedback files and posts grades for a whole class, resumably.
 
     Expanding Functionality: 
        To add features, refer to the Canvas API: https://canvas.instructure.com/doc/api/index.html
@@ -38,27 +45,71 @@ class Canvas:
 
       The above will return a list of courses the user is enrolled in. 
 
+      For anything making many calls, use self._session() instead: it returns a kept-alive session
+      (one per thread) with the headers set, which also slows down as we get close to the rate limit.
+
     """
     
     def __init__(self,  token, course_id, url):
         self.course_id = course_id
         self.token = token
         self.url = url
+        self._student_ids = None
+        self._local = threading.local()
 
         ## TODO:
         ## Add checks to make sure given arguments are valid!
 
-    """
-    ## Unimplemented method for not exceeding the rate limit
+    ## Canvas gives every token a bucket of "rate limit units" that refills over time, and
+    ## reports what is left in X-Rate-Limit-Remaining. Once we're below RATE_LIMIT_LOW we
+    ## slow down, and requests refused with a 403 for being over the limit are retried.
+    ## https://canvas.instructure.com/doc/api/file.throttling.html
+    RATE_LIMIT_LOW = 200
+    RATE_LIMIT_REFILL = 10 # units per second, roughly
+    RATE_LIMIT_RETRIES = 5
 
-    def rate_catch(r, *args, **kwargs):
-        if 'X-Rate-Limit-Remaining' not in r.headers:
+    def _rateCatch(self, r, *args, **kwargs):
+        """
+        Response hook that sleeps long enough for the bucket to refill above RATE_LIMIT_LOW.
+        """
+        try:
+            remaining = float(r.headers['X-Rate-Limit-Remaining'])
+        except (KeyError, ValueError):
             return
-        if(int(r.headers['X-Rate-Limit-Remaining']) <= 1):
-            time.sleep(abs((int(r.headers['X-Rate-Limit-Reset']) - int(time.time()))))
-        else:
-            time.sleep(abs((int(r.headers['X-Rate-Limit-Reset']) - int(time.time())) / int(r.headers['X-Rate-Limit-Remaining'])))
-    """
+        if remaining < self.RATE_LIMIT_LOW:
+            time.sleep((self.RATE_LIMIT_LOW - remaining) / self.RATE_LIMIT_REFILL)
+
+    def _session(self):
+        """
+        Returns this thread's authenticated, rate limited session.
+        """
+        if not hasattr(self._local, 'session'):
+            s = requests.Session()
+            self._setHeaders(s)
+            s.hooks['response'].append(self._rateCatch)
+            self._local.session = s
+        return self._local.session
+
+    def _uploadSession(self):
+        """
+        Returns this thread's session for uploading file contents (which go to the
+        upload URL Canvas gives us, without our authorization headers).
+        """
+        if not hasattr(self._local, 'upload_session'):
+            self._local.upload_session = requests.Session()
+        return self._local.upload_session
+
+    def _request(self, method, url, **kwargs):
+        """
+        Makes a request with this thread's session, retrying with backoff when Canvas
+        refuses it for being over the rate limit.
+        """
+        for attempt in range(self.RATE_LIMIT_RETRIES):
+            r = self._session().request(method, url, **kwargs)
+            if r.status_code != 403 or 'Rate Limit Exceeded' not in r.text:
+                return r
+            time.sleep(2 ** attempt)
+        return r
 
     def _setHeaders(self, s):
          """
@@ -79,16 +130,25 @@ class Canvas:
         References:
             [1] https://canvas.instructure.com/doc/api/courses.html#method.courses.students
         """
+        students = []
         with requests.Session() as s:
             self._setHeaders(s)
-            r = s.get(self.url + "courses/%s/students" % self.course_id)
+            r = s.get(self.url + "courses/%s/students" % self.course_id, params={'per_page': 100})
+            students.extend(r.json())
 
-        return r.json()
+            ## Canvas paginates its responses, the next page is in the `Link` header
+            ## https://canvas.instructure.com/doc/api/file.pagination.html
+            while 'next' in r.links:
+                r = s.get(r.links['next']['url'])
+                students.extend(r.json())
+
+        return students
 
     def getStudentID(self, username):
         """
         This function takes a students username and returns their Canvas ID. If no student is found,
-        the function returns -1. The student must be enrolled in the course. 
+        the function returns -1. The student must be enrolled in the course. The roster is
+        fetched on the first call and kept for the lifetime of this object.
 
         Args:
             username (str): The username of the student
@@ -97,12 +157,10 @@ class Canvas:
             int: The ID of the student, or -1 if the student was not found. 
         """
 
-        students = self.getStudents()
-        for student in students:
-            if student["login_id"] == username:
-                return student["id"]
-        
-        return -1
+        if self._student_ids is None:
+            self._student_ids = {student["login_id"]: student["id"] for student in self.getStudents()}
+
+        return self._student_ids.get(username, -1)
 
     def _prepareFileUpload(self, url, file_path):
         """
@@ -126,24 +184,21 @@ class Canvas:
 
         """
         
-        with requests.Session() as s: 
-            self._setHeaders(s) 
-
-            ## get the file name by splitting the path into a list of items by the `/` char 
-            file_name = file_path.split('/')
-            file_name = file_name[len(file_name)-1]
-
-            ## get the size, prepare parameters and make the request. 
-            size = os.path.getsize(file_path)
-            data = {'name': file_name, 'size': size}
-            r = s.post(url, params=data) 
-            
-            #print(r.text)
+        ## get the file name by splitting the path into a list of items by the `/` char 
+        file_name = file_path.split('/')
+        file_name = file_name[len(file_name)-1]
+
+        ## get the size, prepare parameters and make the request. 
+        size = os.path.getsize(file_path)
+        data = {'name': file_name, 'size': size}
+        r = self._request('POST', url, params=data) 
+        
+        #print(r.text)
 
-            try:
-                result = r.json()
-            except:
-                raise Exception("File Upload Token could not be retrieved.")
+        try:
+            result = r.json()
+        except:
+            raise Exception("File Upload Token could not be retrieved.")
 
         #print(result)
         return result
@@ -170,8 +225,8 @@ class Canvas:
         except:
             raise Exception("Bad API Response on POST.")
 
-        with requests.Session() as s:
-            r = s.post(upload_url, data=data, files={'file': open(file_path, 'rb')})
+        with open(file_path, 'rb') as f:
+            r = self._uploadSession().post(upload_url, data=data, files={'file': f})
 
         #print(r)
         #print(r.text)
@@ -246,12 +301,157 @@ class Canvas:
             json: The result of the call to the submissions URL as returned by the Canvas API. 
  
         """
-        with requests.Session() as s:
+        data = {'comment[file_ids]': files, 'submission[posted_grade]': grade, 'comment[text_comment]': comment}
+        url = self.url + 'courses/%s/assignments/%s/submissions/%s' % (self.course_id, assignment_id, student_id)
+        r = self._request('PUT', url, params=data)
 
-            self._setHeaders(s)
-            
-            data = {'comment[file_ids]': files, 'submission[posted_grade]': grade, 'comment[text_comment]': comment}
-            url = self.url + 'courses/%s/assignments/%s/submissions/%s' % (self.course_id, assignment_id, student_id)
-            r = s.put(url, params=data)
+        return r.json()
+
+    def bulkGrade(self, assignment_id, grades, comments=None, files=None):
+        """
+        This function grades (and optionally comments on) many students' submissions with a single request.
+        Canvas applies the grades in the background; the returned Progress can be followed with waitForProgress.
+
+        Args:
+            assignment_id (str|int): The unique Canvas ID of the assignment
+            grades (dict):           Maps student Canvas IDs to the grade they recieve (str).
+            comments (dict, optional): Maps student Canvas IDs to a text comment.
+            files (dict, optional):  Maps student Canvas IDs to a list of uploaded file IDs for their comment.
+
+        Returns:
+            json: The Progress object returned by Canvas.
 
+        References:
+            [1]: https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.bulk_update
+        """
+        comments = comments or {}
+        files = files or {}
+        grade_data = {}
+        for student_id, grade in grades.items():
+            data = {'posted_grade': grade}
+            if comments.get(student_id):
+                data['text_comment'] = comments[student_id]
+            if files.get(student_id):
+                data['file_ids'] = files[student_id]
+            grade_data[str(student_id)] = data
+
+        url = self.url + 'courses/%s/assignments/%s/submissions/update_grades' % (self.course_id, assignment_id)
+        r = self._request('POST', url, data=json.dumps({'grade_data': grade_data}))
+        r.raise_for_status()
         return r.json()
+
+    def waitForProgress(self, progress, poll_interval=2, timeout=600):
+        """
+        This function waits for a Canvas Progress (e.g. from bulkGrade) to complete or fail.
+
+        Returns:
+            json: The final Progress object. Its `workflow_state` is `completed` or `failed`,
+                  or still `queued`/`running` if `timeout` seconds went by.
+
+        References:
+            [1]: https://canvas.instructure.com/doc/api/progress.html
+        """
+        deadline = time.time() + timeout
+        while progress['workflow_state'] not in ('completed', 'failed') and time.time() < deadline:
+            time.sleep(poll_interval)
+            progress = self._request('GET', self.url + 'progress/%s' % progress['id']).json()
+        return progress
+
+    def gradeAssignmentBatch(self, assignment_id, grades, files=None, comments=None, progress_file=None, workers=4, chunk_size=100):
+        """
+        This function posts grades and feedback files for a whole class. Files are uploaded on a pool of
+        `workers` threads, then grades are posted `chunk_size` students at a time through bulkGrade.
+
+        If a progress_file is given, what has been done so far is saved to it as we go, so a run that
+        died (or had errors) can be started again with the same arguments and only does what is left.
+        That includes the Canvas Progress of each chunk posted: a chunk still running when the run
+        gave up on it is checked on again instead of being posted twice (with duplicate comments).
+
+        Args:
+            assignment_id (str|int): The unique Canvas ID of the assignment
+            grades (dict):           Maps student Canvas IDs to the grade they recieve (str).
+            files (dict, optional):  Maps student Canvas IDs to the path of the file to attach to their comment.
+            comments (dict, optional): Maps student Canvas IDs to a text comment.
+            progress_file (str, optional): Path of the JSON file used to resume the batch.
+            workers (int):           Number of concurrent file uploads.
+            chunk_size (int):        Number of students graded per bulkGrade request.
+
+        Returns:
+            dict: `graded`, the list of student IDs whose grades were posted, and `errors`,
+                  which maps the student IDs that failed (or whose chunk is still running) to
+                  an error message.
+        """
+        files = files or {}
+        state = {'uploaded': {}, 'graded': [], 'pending': {}}
+        if progress_file and os.path.exists(progress_file):
+            with open(progress_file) as f:
+                state = json.load(f)
+        state.setdefault('pending', {}) # Progress ID -> student IDs of a chunk posted but not done yet
+        errors = {}
+        lock = threading.Lock()
+
+        def save():
+            if progress_file:
+                with open(progress_file + '.tmp', 'w') as f:
+                    json.dump(state, f)
+                os.replace(progress_file + '.tmp', progress_file)
+
+        def upload(student_id):
+            try:
+                file_id = self.uploadFileToSubmission(files[student_id], assignment_id, student_id)
+            except Exception as e:
+                with lock:
+                    errors[str(student_id)] = "upload failed: %s" % e
+                return
+            with lock:
+                state['uploaded'][str(student_id)] = file_id
+                save()
+
+        def wait(progress, chunk):
+            """ Waits for a chunk's Progress; one still queued/running stays pending, for the next run. """
+            try:
+                progress = self.waitForProgress(progress)
+            except Exception as e:
+                progress = dict(progress, message=str(e))
+            if progress['workflow_state'] in ('completed', 'failed'):
+                if progress['workflow_state'] == 'completed':
+                    state['graded'].extend(str(sid) for sid in chunk)
+                state['pending'].pop(str(progress['id']), None)
+                save()
+            if progress['workflow_state'] != 'completed':
+                for sid in chunk:
+                    errors[str(sid)] = "grading %s: %s" % (progress['workflow_state'], progress.get('message'))
+            return progress
+
+        ## check on the chunks a previous run gave up waiting for; failed ones are posted again
+        for progress_id, chunk in list(state['pending'].items()):
+            if wait({'id': progress_id, 'workflow_state': 'queued'}, chunk)['workflow_state'] == 'failed':
+                for sid in chunk:
+                    del errors[sid]
+        pending = {sid for chunk in state['pending'].values() for sid in chunk}
+
+        ## upload the feedback files we haven't uploaded yet
+        to_upload = [sid for sid in files if str(sid) not in state['uploaded'] and str(sid) not in state['graded']
+            and str(sid) not in pending]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(upload, to_upload))
+
+        ## then post the grades, skipping students whose file failed to upload
+        to_grade = [sid for sid in grades if str(sid) not in state['graded'] and str(sid) not in errors
+            and str(sid) not in pending]
+        for i in range(0, len(to_grade), chunk_size):
+            chunk = to_grade[i:i+chunk_size]
+            chunk_files = {sid: [state['uploaded'][str(sid)]] for sid in chunk if str(sid) in state['uploaded']}
+            try:
+                progress = self.bulkGrade(assignment_id, {sid: grades[sid] for sid in chunk},
+                    comments=comments, files=chunk_files)
+            except Exception as e:
+                for sid in chunk:
+                    errors[str(sid)] = "grading failed: %s" % e
+                continue
+            # saved before waiting, in case this run dies meanwhile
+            state['pending'][str(progress['id'])] = [str(sid) for sid in chunk]
+            save()
+            wait(progress, chunk)
+
+        return {'graded': state['graded'], 'errors': errors}
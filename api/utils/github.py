@@ -0,0 +1,92 @@
+import hashlib
+
+from . import lazy_import
+from .cache import TTLCache
+requests = lazy_import('requests')
+
+USER_URL = "https://github.iu.edu/api/v3/user"
+
+class GitHub:
+    """
+    Resolves GitHub access tokens to the user they belong to. Results are kept in a
+    TTLCache shared by every CGI process, so polling the same routes with the same
+    token only costs one GitHub round trip per `ttl` seconds.
+
+    Args:
+        cache_config (dict): The `token_cache` section of the server config:
+                             location, ttl, negative_ttl and max_entries.
+
+    Tokens the GitHub API rejects are cached too (for `negative_ttl` seconds), so a
+    bad token cannot be used to hammer GitHub through us. Tokens are only stored hashed.
+    """
+
+    def __init__(self, cache_config):
+        self.ttl = cache_config.get("ttl", 300)
+        self.negative_ttl = cache_config.get("negative_ttl", 30)
+        self.cache = None
+        if cache_config.get("location"):
+            self.cache = TTLCache(cache_config["location"], cache_config.get("max_entries", 1000))
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _key(self, access_token):
+        return hashlib.sha256(access_token.encode()).hexdigest()
+
+    def getUser(self, access_token):
+        """
+        Returns the GitHub user for the given access token.
+
+        Args:
+            access_token (str): GitHub OAuth access token supplied by the front-end.
+
+        Returns:
+            tuple: (user, status). `user` is the JSON returned by the GitHub API, or None
+                   if the token could not be resolved, in which case `status` holds the
+                   HTTP status code to return.
+        """
+        key = self._key(access_token)
+        if self.cache:
+            try:
+                cached = self.cache.get(key)
+            except Exception:
+                cached = None
+            if cached is not None:
+                return cached
+
+        try:
+            r = self.session.get(USER_URL, params={'access_token': access_token}, timeout=10)
+        except requests.RequestException:
+            return None, 502
+
+        if r.status_code == requests.codes.ok:
+            user = r.json()
+            result = (user, r.status_code)
+            ttl = self.ttl
+        elif r.status_code in (401, 403, 404):
+            result = (None, r.status_code)
+            ttl = self.negative_ttl
+        else:
+            # don't remember GitHub having a bad day
+            return None, r.status_code
+
+        if self.cache:
+            try:
+                self.cache.set(key, result[0], result[1], ttl)
+            except Exception:
+                pass
+        return result
+
+    def forget(self, access_token):
+        """
+        Drops the cached user for the given access token.
+        """
+        if self.cache:
+            self.cache.delete(self._key(access_token))
+
+    def cacheStats(self):
+        return self.cache.stats() if self.cache else {}
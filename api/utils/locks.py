@@ -0,0 +1,113 @@
+"""
+ Named locks shared by every process on the machine: the silo server's threads, the
+ RQ workers and the jobs they fork, scripts. A lock is a file in one directory, held
+ with flock, so it is released when its holder exits, however it exits.
+
+ Shared holders exclude exclusive ones only. Within one process a lock is also taken
+ through a reader/writer lock, with the same rules, because file locks on a network
+ file system only tell processes apart, not threads.
+"""
+
+from contextlib import contextmanager
+import threading
+import fcntl
+import time
+import os
+
+class _ThreadLock:
+    """ Held by any number of shared holders or one exclusive one; waiting exclusive ones go first. """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0    # exclusive holders waiting
+
+    def _free(self, shared):
+        if shared:
+            return not self._exclusive and not self._waiting
+        return not self._exclusive and not self._shared
+
+    def acquire(self, shared=False, blocking=True):
+        with self._cond:
+            if not self._free(shared):
+                if not blocking:
+                    return False
+                waiting = 0 if shared else 1
+                self._waiting += waiting
+                try:
+                    self._cond.wait_for(lambda: self._free(shared))
+                finally:
+                    self._waiting -= waiting
+            if shared:
+                self._shared += 1
+            else:
+                self._exclusive = True
+            return True
+
+    def release(self, shared=False):
+        with self._cond:
+            if shared:
+                self._shared -= 1
+            else:
+                self._exclusive = False
+            self._cond.notify_all()
+
+_threads = {}             # path -> _ThreadLock
+_threads_guard = threading.Lock()
+
+def _threadLock(path):
+    with _threads_guard:
+        if path not in _threads:
+            _threads[path] = _ThreadLock()
+        return _threads[path]
+
+def _flock(f, mode):
+    try:
+        fcntl.flock(f.fileno(), mode)
+    except BlockingIOError:
+        return False # only with LOCK_NB
+    return True
+
+class FileLocks:
+    """
+    Args:
+        locks_dir (str): Where the lock files are (created on first use).
+    """
+
+    def __init__(self, locks_dir):
+        self.locks_dir = locks_dir
+
+    def getPath(self, name):
+        return os.path.join(self.locks_dir, name.replace(os.sep, '_') + '.lock')
+
+    @contextmanager
+    def locked(self, name, shared=False, blocking=True):
+        """
+        Holds the lock `name` for the duration of the block. Example:
+
+            with locks.locked('alice.submission') as waited:
+                ...
+
+        Yields:
+            float: The seconds it took to get the lock, or None if `blocking` is False
+                   and someone else holds it (the block then runs without it).
+        """
+        path = self.getPath(name)
+        start = time.perf_counter()
+        thread_lock = _threadLock(path)
+        if not thread_lock.acquire(shared, blocking):
+            yield None
+            return
+        try:
+            os.makedirs(self.locks_dir, exist_ok=True)
+            with open(path, 'a') as f:
+                if not _flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)):
+                    yield None
+                    return
+                try:
+                    yield time.perf_counter() - start
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            thread_lock.release(shared)
@@ -0,0 +1,499 @@
+"""
+ Student repositories on the silo server: one bare mirror per student, checked out as
+ worktrees.
+
+     <repos_dir>/.objects/starter.git  bare clone of the starter code (the object pool)
+     <repos_dir>/<login>/mirror.git    bare mirror of <login>-submission
+     <repos_dir>/<login>/submission    worktree of the mirror (grading tool)
+     <repos_dir>/<login>/battles       worktree of the mirror (battles)
+
+ Every student repository starts from the same starter code, so the mirrors borrow its
+ objects from the pool (objects/info/alternates) instead of fetching and storing a copy
+ each; they only hold what the student added. The grading tool and the battles check
+ out their own worktree of the same mirror, so a student's history is on disk once.
+
+ A sync fetches the student's branches (not tags or GitHub's pull request refs) into
+ the mirror; when nothing was pushed since the last one, that is the ref advertisement
+ and nothing else. The worktree is only touched if it isn't at the mirror's HEAD
+ anymore or has files in it that aren't committed (e.g. left there by the grading
+ tools): then it is hard reset (and cleaned) to HEAD, detached, so worktrees never
+ hold a branch and a student's force push is taken as is. Every sync reports what it
+ did, how long it took and how many bytes it fetched (see Sync). Checkouts from before
+ the mirrors (full clones) are replaced by a worktree the first time they are synced.
+
+ If a sync fails, the mirror and worktree are cloned again, unless the student's
+ repository can't be reached at all: then what is on disk is left alone.
+
+ The last commit touching each top-level folder (by author date, as an assignment's
+ last commit has always been picked) is kept in an index in the mirror
+ (last-commits.json), along with the HEAD it is up to date with. It follows git's
+ history simplification, like iter_commits(paths=...): a side branch whose changes a
+ merge threw away doesn't count. When HEAD moved on by commits that aren't merges,
+ only those are read into it; if it was rewritten (a force push that dropped the
+ indexed HEAD) or merged something (which may simplify away older commits) it is
+ built again from the whole history.
+
+ Everything touching a student's repositories holds their locks (utils/locks.py, files
+ in <repos_dir>/.locks, so the silo server, the workers and scripts all respect them):
+ `<login>.mirror` while fetching into or indexing the mirror, `<login>.<worktree>`
+ while checking a worktree out (exclusive) or reading it (shared, see lockedPath).
+ Syncs of the same student run one fetch at a time, and a sync that had to wait for
+ another one's fetch skips its own if that fetch started after it asked for one
+ (mirror.git/last-fetch): it would get the same refs, so N concurrent syncs cost one
+ fetch. Whatever reads a worktree at length (grading) reads a snapshot of it instead:
+ a worktree of its own at the same commit, in <repos_dir>/.snapshots, made under the
+ locks and removed afterwards (see snapshot), so syncs never wait for it.
+
+ The pool must never be pruned or gc'd with --prune: the mirrors need its objects.
+"""
+
+from collections import namedtuple
+import contextlib
+import tempfile
+import json
+import re
+import shutil
+import time
+import os
+
+from . import lazy_import
+from .locks import FileLocks
+git = lazy_import('git')
+
+POOL_DIR = '.objects/starter.git'
+MIRROR_DIR = 'mirror.git'
+FETCH_REFSPEC = '+refs/heads/*:refs/heads/*'
+INDEX_FILE = 'last-commits.json'
+FETCH_STAMP = 'last-fetch'   # in the mirror: time.time() when its last fetch started
+LOCKS_DIR = '.locks'
+MIRROR_LOCK = 'mirror'
+SNAPSHOTS_DIR = '.snapshots'
+SNAPSHOT_MAX_AGE = 24 * 60 * 60  # seconds until a snapshot left behind (by a killed job) is removed
+
+# What one sync did: the worktree (the mirror, if the repository has no commits), the
+# commit it is at, whether the fetch brought in anything, whether the worktree was
+# reset, how long it took in seconds, the size of what was fetched in bytes, whether the
+# fetch was left to a concurrent sync and the seconds spent waiting for locks.
+Sync = namedtuple('Sync', 'repo commit fetched checked_out seconds bytes coalesced lock_wait')
+
+class StudentRepos:
+    """
+    The mirrors and worktrees of every student under one directory.
+
+    Args:
+        repos_dir (str): Where the students' folders are.
+        url (str): URL of a student's repository, with %s for their login.
+        starter_url (str): URL of the starter code repository the students' repositories
+                           were created from. Without one, mirrors keep all their objects.
+    """
+
+    def __init__(self, repos_dir, url, starter_url=None):
+        self.repos_dir = repos_dir
+        self.url = url
+        self.starter_url = starter_url
+        self.locks = FileLocks(os.path.join(repos_dir, LOCKS_DIR))
+
+    def getLogin(self, url):
+        """ Returns the login of the student whose repository is at `url`, or None. """
+        match = re.fullmatch(re.escape(self.url).replace('%s', '([^/]+)', 1), url or '')
+        return match.group(1) if match else None
+
+    def getMirrorDir(self, login):
+        return os.path.join(self.repos_dir, login, MIRROR_DIR)
+
+    def getWorktreeDir(self, login, name):
+        return os.path.join(self.repos_dir, login, name)
+
+    def locked(self, login, name, shared=False, blocking=True):
+        """ Holds the student's lock `name` (MIRROR_LOCK or a worktree), see FileLocks.locked. """
+        return self.locks.locked('%s.%s' % (login, name), shared, blocking)
+
+    def lockedPath(self, path, shared=True):
+        """
+        Holds the lock of the worktree `path` is in (e.g. an assignment's folder in it)
+        for the duration of the block, shared by default: for reading it while no sync
+        resets it. Yields the seconds waited, like FileLocks.locked. Paths that aren't
+        in a worktree aren't locked (the block gets 0.0).
+        """
+        worktree = self._getWorktree(path)
+        if not worktree:
+            return contextlib.nullcontext(0.0)
+        return self.locked(*worktree, shared=shared)
+
+    def _getWorktree(self, path):
+        """ Returns the (login, worktree name) `path` is in, or None. """
+        relative = os.path.relpath(os.path.realpath(path), os.path.realpath(self.repos_dir))
+        parts = relative.split(os.sep)
+        if len(parts) < 2 or parts[0].startswith('.') or parts[1] == MIRROR_DIR:
+            return None
+        return parts[0], parts[1]
+
+    def _pruneSnapshots(self, snapshots_dir):
+        for name in os.listdir(snapshots_dir):
+            path = os.path.join(snapshots_dir, name)
+            try:
+                if os.path.getmtime(path) < time.time() - SNAPSHOT_MAX_AGE:
+                    shutil.rmtree(path)
+            except OSError:
+                pass # removed by another one meanwhile
+
+    @contextlib.contextmanager
+    def snapshot(self, path, commit=None):
+        """
+        Checks out the repository `path` is in (e.g. an assignment's folder in a
+        worktree) at `commit`, or at its HEAD, as a detached worktree of its own for the
+        duration of the block, to read it at length without holding up syncs. Example:
+
+            with repos.snapshot(submission_dir) as (snapshot_dir, waited):
+                grade(snapshot_dir)
+
+        Yields:
+            tuple: The path in the snapshot matching `path` and the seconds waited for
+                   the student's locks, which are only held while checking it out.
+                   Paths that aren't in a git repository are yielded as they are (and 0.0).
+        """
+        snapshots_dir = os.path.join(self.repos_dir, SNAPSHOTS_DIR)
+        worktree = self._getWorktree(path)
+        tmp = None
+        with self.lockedPath(path) as waited:
+            try:
+                repo = git.Repo(path, search_parent_directories=True)
+            except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+                repo = None
+            if repo is not None and repo.working_tree_dir:
+                relative = os.path.relpath(os.path.realpath(path), os.path.realpath(repo.working_tree_dir))
+                commit = commit or repo.head.commit.hexsha
+                os.makedirs(snapshots_dir, exist_ok=True)
+                self._pruneSnapshots(snapshots_dir)
+                tmp = tempfile.mkdtemp(dir=snapshots_dir, prefix='%s-' % '-'.join(worktree or ('repo',)))
+                start = time.perf_counter()
+                # the mirror's worktrees/; not while it is fetched into or removed
+                mirror_lock = self.locked(worktree[0], MIRROR_LOCK, shared=True) if worktree else contextlib.nullcontext()
+                with mirror_lock:
+                    waited += time.perf_counter() - start
+                    try:
+                        repo.git.worktree('prune')
+                        repo.git.worktree('add', '--detach', '--force', tmp, commit)
+                    except BaseException:
+                        shutil.rmtree(tmp, ignore_errors=True)
+                        raise
+        if tmp is None:
+            yield path, waited
+            return
+        try:
+            snapshot = os.path.normpath(os.path.join(tmp, relative))
+            yield snapshot + (os.sep if path.endswith(os.sep) else ''), waited
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True) # its entry in the mirror goes with the next prune
+
+    def _clone(self, url, target, **kwargs):
+        """ Clones into a temporary folder next to `target` and moves it into place. """
+        parent = os.path.dirname(target)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.clone-')
+        try:
+            git.Repo.clone_from(url, tmp, **kwargs)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                if not os.path.isdir(target):
+                    raise
+                # someone else cloned it meanwhile; theirs is as good as ours
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        return target
+
+    def _pool(self):
+        """ Returns the object pool's folder (cloned if needed), or None without one. """
+        if not self.starter_url:
+            return None
+        pool_dir = os.path.join(self.repos_dir, POOL_DIR)
+        if not os.path.isdir(pool_dir):
+            try:
+                self._clone(self.starter_url, pool_dir, bare=True)
+            except Exception:
+                return None # a mirror without the pool still works, only bigger
+        return pool_dir
+
+    def _cloneMirror(self, login):
+        mirror_dir = self.getMirrorDir(login)
+        pool_dir = self._pool()
+        kwargs = {'reference': pool_dir} if pool_dir else {}
+        self._clone(self.url % login, mirror_dir, bare=True, **kwargs)
+        return git.Repo(mirror_dir)
+
+    def _packs(self, mirror_dir):
+        """ Returns {name: size} of the mirror's pack files. """
+        pack_dir = os.path.join(mirror_dir, 'objects', 'pack')
+        sizes = {}
+        for name in os.listdir(pack_dir) if os.path.isdir(pack_dir) else ():
+            if name.endswith('.pack'):
+                try:
+                    sizes[name] = os.path.getsize(os.path.join(pack_dir, name))
+                except OSError:
+                    pass # repacked by gc --auto meanwhile
+        return sizes
+
+    def _isWorktree(self, login, worktree_dir):
+        """ Whether `worktree_dir` is a worktree of the student's mirror (and not, e.g., an old full clone). """
+        try:
+            with open(os.path.join(worktree_dir, '.git')) as f:
+                gitdir = f.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return False
+        if not gitdir.startswith('gitdir:'):
+            return False
+        gitdir = os.path.realpath(os.path.join(worktree_dir, gitdir[len('gitdir:'):].strip()))
+        return (gitdir.startswith(os.path.join(os.path.realpath(self.getMirrorDir(login)), 'worktrees', ''))
+            and os.path.isdir(gitdir)) # gone if the mirror was cloned again since
+
+    def _isClean(self, repo, commit):
+        if repo.head.commit.hexsha != commit:
+            return False
+        return not repo.git.status('--porcelain', '--ignored', '--untracked-files=all')
+
+    def _checkout(self, mirror, login, name, commit):
+        """ Returns the worktree at `commit`, and whether it had to be touched for that. """
+        worktree_dir = self.getWorktreeDir(login, name)
+        if self._isWorktree(login, worktree_dir):
+            repo = git.Repo(worktree_dir)
+            if self._isClean(repo, commit):
+                return repo, False
+            repo.git.reset('--hard', commit)
+            repo.git.clean('-fxd')
+            return repo, True
+        if os.path.lexists(worktree_dir):
+            shutil.rmtree(worktree_dir)
+        with self.locked(login, MIRROR_LOCK): # the mirror's worktrees/
+            mirror.git.worktree('prune')
+            mirror.git.worktree('add', '--detach', '--force', worktree_dir, commit)
+        return git.Repo(worktree_dir), True
+
+    def _syncWorktree(self, mirror, login, name, commit):
+        """
+        Like _checkout, under the worktree's lock if it has to be touched; also returns
+        the seconds waited for it.
+        """
+        worktree_dir = self.getWorktreeDir(login, name)
+        if self._isWorktree(login, worktree_dir):
+            repo = git.Repo(worktree_dir)
+            if self._isClean(repo, commit):
+                return repo, False, 0.0
+        with self.locked(login, name) as waited:
+            return self._checkout(mirror, login, name, commit) + (waited,)
+
+    def _head(self, repo):
+        try:
+            return repo.head.commit.hexsha
+        except ValueError:
+            return None
+
+    def _readStamp(self, mirror_dir):
+        try:
+            with open(os.path.join(mirror_dir, FETCH_STAMP)) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _writeStamp(self, mirror_dir, started):
+        with open(os.path.join(mirror_dir, FETCH_STAMP), 'w') as f:
+            f.write(repr(started))
+
+    def _fetch(self, login):
+        """
+        Fetches into the student's mirror (cloning it if there is none), under the mirror's
+        lock, unless a fetch started since this was called: then that one's refs are as
+        new as this one's would be.
+
+        Returns:
+            tuple: The mirror, its HEAD before, the bytes received, whether the fetch
+                   was skipped and the seconds waited for the lock.
+        """
+        requested = time.time()
+        mirror_dir = self.getMirrorDir(login)
+        with self.locked(login, MIRROR_LOCK) as waited:
+            started = time.time()
+            if not os.path.isdir(mirror_dir):
+                mirror = self._cloneMirror(login)
+                self._writeStamp(mirror_dir, started)
+                return mirror, None, sum(self._packs(mirror_dir).values()), False, waited
+            mirror = git.Repo(mirror_dir)
+            last_seen = self._head(mirror)
+            stamp = self._readStamp(mirror_dir)
+            if stamp is not None and stamp > requested:
+                return mirror, last_seen, 0, True, waited
+            packs = self._packs(mirror_dir)
+            # keep whatever is received as a pack (instead of loose objects) to know its size
+            mirror.git(c='fetch.unpackLimit=1').fetch('origin', FETCH_REFSPEC, prune=True, no_tags=True)
+            self._writeStamp(mirror_dir, started)
+            received = sum(size for name, size in self._packs(mirror_dir).items() if name not in packs)
+            return mirror, last_seen, received, False, waited
+
+    def sync(self, login, name):
+        """
+        Fetches the student's repository and brings their worktree `name` to its HEAD.
+        Concurrent syncs of the same student share a fetch (see _fetch).
+
+        Returns:
+            Sync: What was done. If the repository has no commits yet, there is no
+                  worktree, and `repo` is the mirror (its `head.commit` raises
+                  ValueError, like an empty clone's).
+
+        Raises:
+            Whatever git raises, e.g. if the repository doesn't exist (anymore).
+        """
+        return self._sync(login, name)
+
+    def _sync(self, login, name, worktree_locked=False):
+        start = time.perf_counter()
+        mirror, last_seen, received, coalesced, lock_wait = self._fetch(login)
+        commit = self._head(mirror)
+        fetched = not coalesced and (received > 0 or commit != last_seen)
+        if commit is None:
+            return Sync(mirror, None, fetched, False, time.perf_counter() - start, received, coalesced, lock_wait)
+        if worktree_locked:
+            repo, checked_out, waited = self._checkout(mirror, login, name, commit) + (0.0,)
+        else:
+            repo, checked_out, waited = self._syncWorktree(mirror, login, name, commit)
+        return Sync(repo, commit, fetched, checked_out, time.perf_counter() - start, received, coalesced,
+            lock_wait + waited)
+
+    def _readIndex(self, mirror_dir):
+        try:
+            with open(os.path.join(mirror_dir, INDEX_FILE)) as f:
+                index = json.load(f)
+            return index['head'], index['paths']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, {}
+
+    def _writeIndex(self, mirror_dir, head, paths):
+        fd, tmp = tempfile.mkstemp(dir=mirror_dir, prefix='.%s-' % INDEX_FILE)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'head': head, 'paths': paths}, f)
+            os.replace(tmp, os.path.join(mirror_dir, INDEX_FILE))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _readCommits(self, mirror, revisions):
+        """
+        Returns:
+            dict: {top-level path: [hexsha, author timestamp]} of the commits in
+                  `revisions` touching it with the latest author date, among those git's
+                  history simplification keeps for it (as iter_commits(paths=...) does):
+                  the commits of a side branch whose changes a merge threw away (e.g.
+                  `-s ours`) don't count.
+        """
+        # -m: every path changed from any parent of a merge, a superset of what counts
+        names = mirror.git(c='core.quotePath=false').log('-m', '--name-only', '--no-renames', '--format=', *revisions)
+        tops = {name.lstrip('"').split('/', 1)[0] for name in names.split('\n') if name}
+        newest = {}
+        for top in tops:
+            log = mirror.git.log('--format=%H %at', *revisions, '--', ':(literal)%s' % top)
+            for line in log.split('\n'):
+                if not line:
+                    continue
+                hexsha, authored = line.split(' ')
+                # on a tie the first one wins, as with max()
+                if top not in newest or int(authored) > newest[top][1]:
+                    newest[top] = [hexsha, int(authored)]
+        return newest
+
+    def _isAncestor(self, mirror, ancestor, commit):
+        try:
+            return mirror.is_ancestor(ancestor, commit)
+        except git.GitCommandError:
+            return False # e.g. gone after a force push
+
+    def _isLinear(self, mirror, ancestor, commit):
+        """ Whether there are no merges between the two: the history of `ancestor` is then simplified as before. """
+        return mirror.git.rev_list('--merges', '--count', '%s..%s' % (ancestor, commit)).strip() == '0'
+
+    def updateIndex(self, login, head):
+        """
+        Brings the student's last-commit index up to date with `head` (a hexsha).
+
+        Returns:
+            dict: {top-level path: [hexsha, author timestamp]} of the commit touching it
+                  with the latest author date, in the history of `head`.
+        """
+        mirror_dir = self.getMirrorDir(login)
+        indexed, paths = self._readIndex(mirror_dir)
+        if indexed == head:
+            return paths
+        with self.locked(login, MIRROR_LOCK, shared=True): # not removed by reset meanwhile
+            indexed, paths = self._readIndex(mirror_dir)
+            if indexed != head:
+                mirror = git.Repo(mirror_dir)
+                if indexed and self._isAncestor(mirror, indexed, head) and self._isLinear(mirror, indexed, head):
+                    revisions = ['%s..%s' % (indexed, head)]
+                else:
+                    revisions, paths = [head], {}
+                for top, newest in self._readCommits(mirror, revisions).items():
+                    if top not in paths or newest[1] >= paths[top][1]:
+                        paths[top] = newest
+                self._writeIndex(mirror_dir, head, paths)
+        return paths
+
+    def getLastCommit(self, login, path, head):
+        """
+        Returns:
+            str: The hexsha of the commit touching the top-level folder `path` with the
+                 latest author date, in the history of `head` (a hexsha). Costs a file
+                 read when `head` was looked up before, and reading the commits since
+                 the last HEAD looked up otherwise.
+
+        Raises:
+            KeyError: If no commit touched `path`.
+        """
+        return self.updateIndex(login, head)[path][0]
+
+    def isReachable(self, login):
+        """ Whether the student's repository can be reached (and exists). """
+        try:
+            git.cmd.Git().ls_remote(self.url % login, 'HEAD')
+        except Exception:
+            return False
+        return True
+
+    def reset(self, login, name):
+        """
+        Starts over: removes the student's worktree `name` and mirror and syncs them
+        again. Not as dangerous as it looks, but still pretty dangerous: the other
+        worktrees of the mirror are left broken until they are synced.
+
+        Returns:
+            Sync: Like sync, or None if it failed.
+        """
+        # held until the worktree is back, so that nobody reading it finds it gone
+        with self.locked(login, name):
+            try:
+                # in the order sync takes them: the worktree's lock is held while adding it to the mirror
+                with self.locked(login, MIRROR_LOCK):
+                    for path in (self.getWorktreeDir(login, name), self.getMirrorDir(login)):
+                        if os.path.lexists(path):
+                            shutil.rmtree(path)
+            except Exception:
+                # we no longer have control over this user's repository
+                return None
+            try:
+                return self._sync(login, name, worktree_locked=True)
+            except Exception:
+                return None
+
+    def update(self, login, name):
+        """
+        Syncs the student's worktree `name`, starting over if that fails for any
+        other reason than their repository being out of reach.
+
+        Returns:
+            Sync: Like sync, or None if the repository couldn't be synced at all.
+        """
+        try:
+            return self.sync(login, name)
+        except Exception:
+            if not self.isReachable(login):
+                return None
+            return self.reset(login, name)
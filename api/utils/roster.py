@@ -0,0 +1,122 @@
+import subprocess
+import sqlite3
+import time
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Roster:
+    """
+    Local mirror of the course roster on Canvas, kept in a SQLite file indexed by both
+    login and Canvas ID so membership and ID lookups are a single indexed query.
+
+    Args:
+        canvas (Canvas):   Canvas object the roster is fetched with.
+        location (str):    Path to the SQLite file backing the mirror.
+        ttl (int):         Seconds after which the mirror is considered stale.
+
+    Lookups never wait on Canvas, except for the very first one when the mirror is still
+    empty. Once the mirror is older than `ttl`, the next lookup starts a refresh in a
+    detached background process (so it also works from short-lived CGI processes) and
+    keeps answering from the current copy meanwhile. `refresh` can also be run from cron:
+
+        python -c "from api import roster; roster.refresh()"
+    """
+
+    REFRESH_TIMEOUT = 300 # a refresh that started this long ago is assumed dead
+
+    def __init__(self, canvas, location, ttl=3600):
+        self.canvas = canvas
+        self.location = location
+        self.ttl = ttl
+        self._conn = None
+
+    def _getConnection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.location, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(''' CREATE TABLE IF NOT EXISTS students
+                    (id integer PRIMARY KEY, login_id text, name text, data text) ''')
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS students_login_id ON students (login_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key text PRIMARY KEY, value real)")
+            self._conn = conn
+        return self._conn
+
+    def _meta(self, key):
+        row = self._getConnection().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def refresh(self):
+        """
+        Fetches the full roster from Canvas (following pagination) and replaces the mirror.
+
+        Returns:
+            int: The number of students in the roster.
+        """
+        students = self.canvas.getStudents()
+        conn = self._getConnection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM students")
+            conn.executemany("INSERT OR REPLACE INTO students(id, login_id, name, data) VALUES(?, ?, ?, ?)",
+                [(s['id'], s.get('login_id'), s.get('name'), json.dumps(s)) for s in students])
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('refreshed_at', ?)", (time.time(),))
+            conn.execute("DELETE FROM meta WHERE key='refresh_started'")
+        return len(students)
+
+    def _claimRefresh(self):
+        """ Makes sure only one process at a time starts a background refresh. """
+        conn = self._getConnection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            started = self._meta('refresh_started')
+            if started and started > now - self.REFRESH_TIMEOUT:
+                return False
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('refresh_started', ?)", (now,))
+        return True
+
+    def _ensureFresh(self):
+        refreshed_at = self._meta('refreshed_at')
+        if refreshed_at is None:
+            self.refresh()
+        elif refreshed_at < time.time() - self.ttl and self._claimRefresh():
+            subprocess.Popen([sys.executable, '-c', 'from api import roster; roster.refresh()'], cwd=ROOT,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def isMember(self, login):
+        """
+        Returns:
+            bool: Whether a student with the given login is enrolled in the course.
+        """
+        self._ensureFresh()
+        return self._getConnection().execute("SELECT 1 FROM students WHERE login_id=?", (login,)).fetchone() is not None
+
+    def getStudentID(self, login):
+        """
+        Returns:
+            int: The Canvas ID of the student with the given login, or -1 if they aren't enrolled.
+        """
+        self._ensureFresh()
+        row = self._getConnection().execute("SELECT id FROM students WHERE login_id=?", (login,)).fetchone()
+        return row[0] if row else -1
+
+    def getStudent(self, id):
+        """
+        Returns:
+            json: The Canvas student with the given Canvas ID, or None.
+        """
+        self._ensureFresh()
+        row = self._getConnection().execute("SELECT data FROM students WHERE id=?", (id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def getStudents(self):
+        """
+        Returns:
+            json: The students enrolled in the course, like Canvas.getStudents.
+        """
+        self._ensureFresh()
+        rows = self._getConnection().execute("SELECT data FROM students ORDER BY login_id").fetchall()
+        return [json.loads(row[0]) for row in rows]
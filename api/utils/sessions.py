@@ -0,0 +1,173 @@
+import base64
+import hashlib
+import sqlite3
+import hmac
+import json
+import time
+import uuid
+import os
+
+class Sessions:
+    """
+    Issues and checks the signed session tokens handed out by the auth blueprint.
+
+    A session token is `<payload>.<signature>`, where the payload is the base64 encoded
+    JSON of the user's login, name, avatar, admin flag, the app it was issued for and
+    its expiry, and the signature is an HMAC-SHA256 of the payload with `secret_key`.
+    Checking one is purely local, so routes given a session token never talk to GitHub.
+
+    Args:
+        session_config (dict): The `sessions` section of the server config: secret_key,
+                               ttl, refresh_ttl and revocations (path to a SQLite file).
+        github (GitHub):       Used to resolve plain access tokens when no session token is given.
+
+    A token can be refreshed (see `refresh`) until `refresh_ttl` seconds after the original
+    login. Every token issued through refreshes shares the session id of the first one,
+    so revoking a session kills all of them.
+    """
+
+    def __init__(self, session_config, github):
+        self.secret_key = session_config.get("secret_key", "").encode()
+        self.ttl = session_config.get("ttl", 900)
+        self.refresh_ttl = session_config.get("refresh_ttl", 43200)
+        self.revocations = session_config.get("revocations")
+        self.github = github
+        self._conn = None
+
+    def _getConnection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.revocations, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS revoked (sid text PRIMARY KEY, expires real)")
+            self._conn = conn
+        return self._conn
+
+    def _sign(self, payload):
+        return hmac.new(self.secret_key, payload, hashlib.sha256).digest()
+
+    def _encode(self, claims):
+        payload = base64.urlsafe_b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        signature = base64.urlsafe_b64encode(self._sign(payload))
+        return (payload + b'.' + signature).decode()
+
+    def _decode(self, token):
+        """
+        Returns the claims of a correctly signed token (expired or not), or None.
+        """
+        if not self.secret_key or not token:
+            return None
+        try:
+            payload, signature = token.encode().split(b'.')
+            if not hmac.compare_digest(base64.urlsafe_b64decode(signature), self._sign(payload)):
+                return None
+            return json.loads(base64.urlsafe_b64decode(payload))
+        except Exception:
+            return None
+
+    def isRevoked(self, sid):
+        if not self.revocations or not os.path.exists(self.revocations):
+            return False
+        row = self._getConnection().execute("SELECT expires FROM revoked WHERE sid=?", (sid,)).fetchone()
+        return row is not None
+
+    def issue(self, user, app_name, is_admin, sid=None, login_time=None):
+        """
+        Issues a new session token for the given GitHub user.
+
+        Args:
+            user (dict):    The GitHub user, as returned by GitHub.getUser.
+            app_name (str): The app (grading_tool or battles) the token is good for.
+            is_admin (bool): Whether the user is an instructor of that app.
+
+        Returns:
+            str: The signed session token, or None if no secret key is configured.
+        """
+        if not self.secret_key:
+            return None
+        now = int(time.time())
+        return self._encode({
+            'login': user['login'],
+            'name': user.get('name'),
+            'avatar_url': user.get('avatar_url'),
+            'is_admin': bool(is_admin),
+            'app': app_name,
+            'sid': sid or uuid.uuid4().hex,
+            'auth_time': login_time or now,
+            'exp': now + self.ttl
+        })
+
+    def verify(self, token, app_name):
+        """
+        Checks a session token.
+
+        Returns:
+            dict: The token's claims if it is correctly signed, issued for `app_name`,
+                  not expired and not revoked. None otherwise.
+        """
+        claims = self._decode(token)
+        if not claims or claims.get('app') != app_name:
+            return None
+        if claims['exp'] < time.time():
+            return None
+        if self.isRevoked(claims['sid']):
+            return None
+        return claims
+
+    def refresh(self, token):
+        """
+        Issues a fresh token for the same session. Expired tokens can still be refreshed
+        as long as the session is younger than `refresh_ttl` and hasn't been revoked.
+
+        Returns:
+            str: The new session token, or None if the session can't be refreshed.
+        """
+        claims = self._decode(token)
+        if not claims:
+            return None
+        if claims['auth_time'] + self.refresh_ttl < time.time():
+            return None
+        if self.isRevoked(claims['sid']):
+            return None
+        return self.issue(claims, claims['app'], claims['is_admin'], sid=claims['sid'], login_time=claims['auth_time'])
+
+    def revoke(self, token):
+        """
+        Revokes the session the given token belongs to (including every refreshed token).
+
+        Returns:
+            bool: Whether the token was valid and its session is now revoked.
+        """
+        claims = self._decode(token)
+        if not claims or not self.revocations:
+            return False
+        conn = self._getConnection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("INSERT OR REPLACE INTO revoked(sid, expires) VALUES(?, ?)",
+                (claims['sid'], claims['auth_time'] + self.refresh_ttl))
+            conn.execute("DELETE FROM revoked WHERE expires < ?", (time.time(),))
+        return True
+
+    def authenticate(self, args, app_name):
+        """
+        Resolves the user making a request, from either a `session_token` (checked locally)
+        or an `access_token` (resolved through GitHub) in the given request args.
+
+        Returns:
+            tuple: (user, error). If the user could not be resolved, `user` is None and
+                   `error` is the (message, status code) response to return.
+        """
+        token = args.get('session_token')
+        if token:
+            user = self.verify(token, app_name)
+            if not user:
+                return None, ("Session token invalid or expired", 401)
+            return user, None
+
+        code = args.get('access_token')
+        if not code:
+            return None, ("No access code given", 400)
+        user, status = self.github.getUser(code)
+        if not user:
+            return None, ("Issue retrieving user based on given access code", status)
+        return user, None
@@ -0,0 +1,75 @@
+from . import lazy_import
+requests = lazy_import('requests')
+
+class SiloUnavailable(Exception):
+    """ Raised when the silo server can't be reached, even after retrying. """
+    pass
+
+class SiloClient:
+    """
+    HTTP client the CGI blueprints use to forward requests to the silo server. One
+    pooled keep-alive session is shared by every call in the process, so the persistent
+    app server (and consecutive calls within a single CGI request) reuse connections.
+
+    Args:
+        base_url (str):     The blueprint's silo URL, e.g. SILO_SERVER_URL + "/grading-tool".
+        headers (dict):     Headers sent with every call (the silo secret key).
+        timeout (float):    Default read timeout in seconds; override per call with `timeout`.
+        retries (int):      How many times to retry a call that failed.
+        backoff (float):    Backoff factor between retries (0.3 -> 0.3s, 0.6s, 1.2s, ...).
+        pool_size (int):    Connections kept alive to the silo server.
+
+    Only idempotent calls are retried after the request reached the silo server (read
+    errors, 502/503/504). Calls that start tests or submissions are only retried when
+    the connection itself could not be made, so they are never run twice.
+    """
+
+    CONNECT_TIMEOUT = 3.05
+
+    def __init__(self, base_url, headers, timeout=30, retries=3, backoff=0.3, pool_size=10):
+        self.base_url = base_url
+        self.headers = headers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+
+    def _session(self, idempotent):
+        if idempotent not in self._sessions:
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            if idempotent:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                    status_forcelist=(502, 503, 504), raise_on_status=False)
+            else:
+                retry = Retry(total=self.retries, connect=self.retries, read=0, status=0,
+                    backoff_factor=self.backoff, raise_on_status=False)
+            s = requests.Session()
+            s.headers.update(self.headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            self._sessions[idempotent] = s
+        return self._sessions[idempotent]
+
+    def get(self, path, idempotent=True, timeout=None, **kwargs):
+        """
+        GETs `path` (relative to base_url) from the silo server.
+
+        Args:
+            path (str):        Path of the silo route, starting with a `/`.
+            idempotent (bool): Whether the call may safely be retried after reaching the server.
+            timeout (float):   Read timeout for this call.
+
+        Returns:
+            requests.Response: The silo server's response.
+
+        Raises:
+            SiloUnavailable: The silo server couldn't be reached.
+        """
+        try:
+            return self._session(idempotent).get(self.base_url + path,
+                timeout=(self.CONNECT_TIMEOUT, timeout or self.timeout), **kwargs)
+        except requests.RequestException as e:
+            raise SiloUnavailable(str(e))
@@ -0,0 +1,37 @@
+## Posts grades (and feedback files) for a whole class to Canvas. Script is ran manually.
+##
+##   python batch_post_grades.py <canvas_assignment_id> grades.csv
+##
+## grades.csv has a `login,grade,feedback_file` line per student (feedback_file may be empty).
+## Progress is saved next to the CSV, so running it again after a failure only does what's left.
+
+import argparse
+import csv
+import json
+
+from api import canvas, roster
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('assignment_id')
+    parser.add_argument('grades_csv')
+    parser.add_argument('--workers', type=int, default=4, help="concurrent file uploads")
+    args = parser.parse_args()
+
+    grades, files = {}, {}
+    with open(args.grades_csv) as f:
+        for login, grade, feedback_file in csv.reader(f):
+            student_id = roster.getStudentID(login)
+            if student_id == -1:
+                print(f'{login} is not on the roster, skipping')
+                continue
+            grades[student_id] = grade
+            if feedback_file:
+                files[student_id] = feedback_file
+
+    report = canvas.gradeAssignmentBatch(args.assignment_id, grades, files=files,
+        progress_file=f'{args.grades_csv}.progress', workers=args.workers)
+
+    print(f"{len(report['graded'])} students graded, {len(report['errors'])} errors")
+    if report['errors']:
+        print(json.dumps(report['errors'], indent=2))
@@ -2,12 +2,16 @@
 
 import api.grading_tool.worker as w
 import api.grading_tool.database as db
-import git
+from api.grading_tool import jobs, queues, tools
 
 ASSIGNMENT_ID=9046909
 REPOS_DIR = "/u/b351/student-repos"
 GRADING_TOOLS_DIR = "/u/b351/class-docs/sp19/admin/sp19/Grading Tools"
 
+# only regrade reports made by older versions of the assignment's tools (see tools.py)
+ONLY_STALE = True
+tool_version = tools.getVersion(GRADING_TOOLS_DIR, "a4")
+
 students = db.getStudents()
 
 for student in students:
@@ -24,14 +28,17 @@ for student in students:
     user_dir = "%s/%s" % (REPOS_DIR, student[1])
     repo_dir = "%s/submission" % user_dir
     results_dir = "%s/tool-results" % user_dir
-    try:
-        repo = git.Repo(repo_dir, search_parent_directories=True)
-        repo.git.checkout(initial_commit)
-        repo.git.clean('-fxd')
-    except:
+    html_file = f'{results_dir}/a4-initial.html'
+
+    report = db.getReport(html_file)
+    if ONLY_STALE and report and report[1] == tool_version:
+        print(f'student {student[1]} already graded with the current tools')
         continue
-    
+
+    # queued behind official grading and practice tests, see queues.py
     github_link = f'https://github.iu.edu/csci-b351-sp19/{student[1]}-submission/tree/{initial_commit}/a4'
-    w.runGrade("a4", f'{repo_dir}/a4', f'{results_dir}/a4-initial.html', include_subjective, github_link, GRADING_TOOLS_DIR)
+    jobs.enqueue(queues.getQueue(queues.REGRADES), w.runRegrade,
+        ("a4", repo_dir, initial_commit, f'{repo_dir}/a4', html_file, include_subjective, github_link, GRADING_TOOLS_DIR),
+        student=student[1], result_ttl=86400)
 
-    print(f'student {student[1]} done!')
+    print(f'student {student[1]} queued!')
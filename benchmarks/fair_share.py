@@ -0,0 +1,112 @@
+"""
+ Simulates a busy hour of practice tests to compare how long students wait with a plain
+ FIFO queue and with the fair share in api/grading_tool/fair.py (students take turns,
+ at most --max-jobs tests each).
+
+     python benchmarks/fair_share.py --students 200 --spammers 5 --workers 4
+
+ Regular students request a test every so often; spammers re-request one as soon as
+ they are allowed to. Without fair share that is once per assignment at a time (the
+ "Test already running" check), with it --max-jobs at a time. Waits are measured from
+ the request to the start of the test. The model follows fair.py's rules but doesn't need redis or rq.
+"""
+
+from collections import deque
+import argparse
+import random
+import heapq
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)] if samples else 0
+
+def simulate(args, fair):
+    rng = random.Random(args.seed)
+    events = [] # (time, seq, kind, login)
+    seq = 0
+    def push(t, kind, login):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (t, seq, kind, login))
+
+    students = ['student%d' % i for i in range(args.students)]
+    spammers = ['spammer%d' % i for i in range(args.spammers)]
+    for login in students:
+        t = rng.expovariate(1 / args.think)
+        while t < args.duration:
+            push(t, 'request', login)
+            t += rng.expovariate(1 / args.think)
+    for login in spammers:
+        push(0, 'request', login)
+
+    queue = deque()    # (login, requested) in the order they will run
+    held = {}          # login -> deque of requested times (fair only)
+    queued = set()     # logins with a job in the queue (fair only)
+    active = {}        # login -> jobs queued, held or running
+    idle = args.workers
+    waits = {}
+
+    def admit(login, requested):
+        if fair and login in queued:
+            held.setdefault(login, deque()).append(requested)
+        else:
+            queue.append((login, requested))
+            queued.add(login)
+
+    def start(now):
+        nonlocal idle
+        while idle and queue:
+            login, requested = queue.popleft()
+            queued.discard(login)
+            if fair and held.get(login):
+                queue.append((login, held[login].popleft()))
+                queued.add(login)
+            waits.setdefault(login, []).append(now - requested)
+            idle -= 1
+            push(now + rng.uniform(0.5, 1.5) * args.service, 'done', login)
+
+    while events:
+        now, _, kind, login = heapq.heappop(events)
+        if kind == 'request':
+            if active.get(login, 0) >= (args.max_jobs if fair else args.assignments):
+                if login in spammers:
+                    push(now + 5, 'request', login) # try again shortly
+                continue
+            active[login] = active.get(login, 0) + 1
+            admit(login, now)
+            if login in spammers and now < args.duration:
+                push(now + 1, 'request', login)
+        else:
+            idle += 1
+            active[login] -= 1
+        start(now)
+
+    regular = [w for login in students for w in waits.get(login, [])]
+    spam = sum(len(waits.get(login, [])) for login in spammers)
+    return {
+        'regular_tests': len(regular),
+        'spam_tests': spam,
+        'spam_share': spam / (spam + len(regular)),
+        'p50': percentile(regular, 50),
+        'p90': percentile(regular, 90),
+        'p99': percentile(regular, 99),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--spammers', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--service', type=float, default=30, help="mean seconds per test")
+    parser.add_argument('--think', type=float, default=1800, help="mean seconds between a student's tests")
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--max-jobs', type=int, default=3)
+    parser.add_argument('--assignments', type=int, default=4, help="open assignments, each can have one test in flight")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print("tests run, spammers' share of them, and the wait of regular students' tests")
+    print(f"{'':6}{'regular':>9}{'spam':>7}{'share':>8}{'p50 (s)':>10}{'p90 (s)':>10}{'p99 (s)':>10}")
+    for name, fair in (('fifo', False), ('fair', True)):
+        r = simulate(args, fair)
+        print(f"{name:6}{r['regular_tests']:>9}{r['spam_tests']:>7}{r['spam_share']:>8.0%}{r['p50']:>10.0f}{r['p90']:>10.0f}{r['p99']:>10.0f}")
@@ -0,0 +1,100 @@
+"""
+ Benchmarks the grading database's hot queries on a synthetic 2,000 student x 10
+ assignment database, with the original schema and after migrations.migrate().
+
+     python benchmarks/grading_db.py [--students 2000] [--assignments 10] [--lookups 2000]
+
+ "before" runs the queries the way database.py used to: string-built SQL against
+ unindexed tables, and SELECT-then-INSERT for addSubmission. "after" runs the current
+ parameterised queries and the UPSERT against the migrated schema.
+"""
+
+import tempfile
+import argparse
+import sqlite3
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.grading_tool import migrations
+
+def build(path, students, assignments):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE TABLE students (id integer PRIMARY KEY, username text, student_group integer)")
+    conn.execute("CREATE TABLE assignments (id integer PRIMARY KEY, unlock_date DATE, initial_date DATE, revision_date DATE)")
+    conn.execute(''' CREATE TABLE submissions
+            (student_id integer, assignment_id integer,
+            test_commit text, job_id text,
+            initial_date date, revision_date date,
+            initial_commit text, revision_commit text,
+            FOREIGN KEY (student_id) REFERENCES students (id),
+            FOREIGN KEY (assignment_id) REFERENCES assignments (id) ) ''')
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO students VALUES(?, ?, 0)", [(i, f'student{i}') for i in range(students)])
+    conn.executemany("INSERT INTO assignments VALUES(?, '2019-01-01', '2019-01-08', '2019-01-15')", [(a,) for a in range(assignments)])
+    conn.executemany("INSERT INTO submissions(student_id, assignment_id, test_commit, job_id) VALUES(?, ?, ?, ?)",
+        [(s, a, '%040x' % random.getrandbits(160), f'job{s}-{a}') for s in range(students) for a in range(assignments)])
+    conn.execute("COMMIT")
+    return conn
+
+def timed(n, fn):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1e6
+
+def before(conn, keys, logins):
+    def get_student_id(i):
+        conn.execute(''' SELECT id FROM students WHERE username=? ''', (logins[i],)).fetchone()
+    def get_job(i):
+        s, a = keys[i]
+        conn.execute("SELECT job_id FROM submissions WHERE student_id=%s AND assignment_id=%s" % (s, a)).fetchone()
+    def add_submission(i):
+        s, a = keys[i]
+        conn.execute("BEGIN")
+        row = conn.execute("SELECT * FROM submissions WHERE student_id=%s AND assignment_id=%s" % (s, a)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO submissions(student_id, assignment_id) VALUES(?, ?)", (s, a))
+            conn.execute("SELECT * FROM submissions WHERE student_id=%s AND assignment_id=%s" % (s, a)).fetchone()
+        conn.execute("COMMIT")
+    return get_student_id, get_job, add_submission
+
+def after(conn, keys, logins):
+    def get_student_id(i):
+        conn.execute(''' SELECT id FROM students WHERE username=? ''', (logins[i],)).fetchone()
+    def get_job(i):
+        conn.execute("SELECT job_id FROM submissions WHERE student_id=? AND assignment_id=?", keys[i]).fetchone()
+    def add_submission(i):
+        conn.execute("BEGIN")
+        conn.execute(''' INSERT INTO submissions(student_id, assignment_id) VALUES(?, ?)
+                ON CONFLICT(student_id, assignment_id) DO NOTHING ''', keys[i])
+        conn.execute("SELECT * FROM submissions WHERE student_id=? AND assignment_id=?", keys[i]).fetchone()
+        conn.execute("COMMIT")
+    return get_student_id, get_job, add_submission
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--assignments', type=int, default=10)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build(os.path.join(tmp, 'gradingtool.db'), args.students, args.assignments)
+        keys = [(random.randrange(args.students), random.randrange(args.assignments)) for _ in range(args.lookups)]
+        logins = [f'student{s}' for s, _ in keys]
+
+        results = {}
+        results['before'] = [timed(args.lookups, fn) for fn in before(conn, keys, logins)]
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        migrate_ms = (time.perf_counter() - start) * 1000
+        results['after'] = [timed(args.lookups, fn) for fn in after(conn, keys, logins)]
+
+    print(f"{args.students} students x {args.assignments} assignments, {args.lookups} lookups each (us per call)")
+    print(f"{'':8}{'getStudentID':>14}{'getJob':>10}{'addSubmission':>15}")
+    for name, (sid, job, add) in results.items():
+        print(f"{name:8}{sid:14.1f}{job:10.1f}{add:15.1f}")
+    print(f"migration took {migrate_ms:.0f} ms")
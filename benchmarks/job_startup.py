@@ -0,0 +1,66 @@
+"""
+ Measures the per-job overhead of a worker, with every job importing the grading tools
+ itself (cold, what run_worker.py used to do) and with the worker preloading them
+ before forking (warm, supervisor.WarmWorker).
+
+     python benchmarks/job_startup.py --jobs 50 --import-seconds 0.5
+     python benchmarks/job_startup.py --grading-tools "/path/to/Grading Tools" --assignment a1
+
+ Jobs are real runTest jobs run by a burst worker in this process. By default they use
+ the stand-in grading tools (benchmarks/stand_in_tools) with no grading work, so the
+ time per job is all overhead: fork, imports, redis bookkeeping. --import-seconds is
+ how long the stand-in takes to import, standing in for the real test suites.
+
+ Needs a redis server (REDISTOGO_URL, or --redis-url); only the `benchmark` queue is used.
+"""
+
+import tempfile
+import argparse
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.grading_tool import worker, jobs, queues
+from api.grading_tool.supervisor import makeWorker
+
+QUEUE_NAME = 'benchmark'
+TOOLS_DIR = os.path.join(ROOT, 'benchmarks', 'stand_in_tools')
+
+def run(warm, args, tmp):
+    q = queues.getQueue(QUEUE_NAME)
+    q.empty()
+    for i in range(args.jobs):
+        jobs.enqueue(q, worker.runTest, (args.assignment, tmp, os.path.join(tmp, 'job%d.html' % i), None, args.grading_tools),
+            result_ttl=60)
+    start = time.perf_counter()
+    w = makeWorker(args.redis_url, [QUEUE_NAME], grading_tools_dir=args.grading_tools if warm else None)
+    preload = time.perf_counter() - start
+    w.work(burst=True, logging_level='WARNING')
+    elapsed = time.perf_counter() - start
+    failed = q.failed_job_registry.get_job_ids()
+    for job_id in failed:
+        q.failed_job_registry.remove(job_id, delete_job=True)
+    return preload, elapsed, len(failed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--import-seconds', type=float, default=0.5, help="import time of the stand-in grading tools")
+    parser.add_argument('--grading-tools', default=TOOLS_DIR)
+    parser.add_argument('--assignment', default='a1')
+    parser.add_argument('--redis-url', default=os.getenv('REDISTOGO_URL', 'redis://localhost:30006'))
+    args = parser.parse_args()
+    worker.redis_url = args.redis_url
+    os.environ['STAND_IN_SECONDS'] = '0'
+    os.environ['STAND_IN_IMPORT_SECONDS'] = str(args.import_seconds)
+
+    print(f"{args.jobs} jobs, grading tools: {args.grading_tools}")
+    print(f"{'':6}{'preload (s)':>13}{'total (s)':>11}{'per job (ms)':>14}{'failed':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # cold first: once the warm worker ran, this process has `grade` loaded
+        for name, warm in (('cold', False), ('warm', True)):
+            preload, elapsed, failed = run(warm, args, tmp)
+            print(f"{name:6}{preload:>13.2f}{elapsed:>11.2f}{(elapsed - preload) / args.jobs * 1000:>14.1f}{failed:>8}")
@@ -0,0 +1,122 @@
+"""
+ Compares finding an assignment's last commit by walking the history with
+ iter_commits (what _get_last_commit used to do) with the per-path index kept in the
+ student's mirror (StudentRepos.getLastCommit).
+
+     python benchmarks/last_commit.py --commits 2000 --lookups 20
+
+ Builds a stand-in student repository of --commits commits spread over four
+ assignment folders and reports, for each, the time of one lookup of every assignment
+ and of a lookup after one more commit was pushed (for the index: reading just that
+ commit).
+
+ Then checks that both find the same commits, on that history and on one with a merge
+ throwing away a side branch's newer changes (`-s ours`), which the walk (git's history
+ simplification) leaves out.
+"""
+
+import subprocess
+import tempfile
+import argparse
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.utils.repos import StudentRepos
+
+ENV = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+    GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+ASSIGNMENTS = ['a1', 'a2', 'a3', 'a4']
+
+def makeHistory(work, commits):
+    """ Commits through fast-import: a few thousand `git commit`s would take minutes. """
+    subprocess.check_call(['git', 'init', '-q', work], env=ENV)
+    subprocess.check_call(['git', 'symbolic-ref', 'HEAD', 'refs/heads/master'], cwd=work, env=ENV)
+    stream = []
+    for i in range(commits):
+        data = ('%d\n' % i).encode()
+        stream.append(b'commit refs/heads/master\n')
+        stream.append(b'committer bench <bench@localhost> %d +0000\n' % (1546300800 + i * 60))
+        stream.append(b'data 4\nwork')
+        stream.append(b'\nM 644 inline %s/f%d.py\ndata %d\n%s\n' % (ASSIGNMENTS[i % 4].encode(), i % 10, len(data), data))
+    subprocess.run(['git', 'fast-import', '--quiet'], input=b''.join(stream), cwd=work, env=ENV, check=True)
+    subprocess.check_call(['git', 'reset', '-q', '--hard'], cwd=work, env=ENV)
+
+def walk(repo, head):
+    return [max(repo.iter_commits(head, paths=assignment_id), key=lambda c: c.authored_datetime).hexsha
+        for assignment_id in ASSIGNMENTS]
+
+def index(repos, head):
+    return [repos.getLastCommit('student', assignment_id, head) for assignment_id in ASSIGNMENTS]
+
+def gitAt(work, at, *args):
+    env = dict(ENV, GIT_AUTHOR_DATE='@%d +0000' % at, GIT_COMMITTER_DATE='@%d +0000' % at)
+    subprocess.check_call(['git'] + list(args), cwd=work, env=env, stdout=subprocess.DEVNULL)
+
+def commitAt(work, at, path, message):
+    os.makedirs(os.path.dirname(os.path.join(work, path)), exist_ok=True)
+    with open(os.path.join(work, path), 'a') as f:
+        f.write(message + '\n')
+    gitAt(work, at, 'add', '-A')
+    gitAt(work, at, 'commit', '-qm', message)
+
+def check(repos, remote, work):
+    """ Checks the index against the walk after merges that throw away a side branch's changes. """
+    head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=work, env=ENV).decode().strip()
+    now = int(time.time())
+    gitAt(work, now, 'checkout', '-qb', 'side')
+    commitAt(work, now + 200, 'a1/side.py', 'side-newest')
+    gitAt(work, now, 'checkout', '-q', 'master')
+    commitAt(work, now + 100, 'a1/main.py', 'main-change')
+    gitAt(work, now + 300, 'merge', '-q', '-s', 'ours', '-m', 'ours', 'side')
+    for message in ('merged', 'pushed after'):
+        if message == 'pushed after':
+            commitAt(work, now + 400, 'a2/more.py', message)
+        gitAt(work, now, 'push', '-q', remote, 'master')
+        repo = repos.update('student', 'submission').repo
+        head = repo.head.commit.hexsha
+        walked, indexed = walk(repo, head), index(repos, head)
+        assert walked == indexed, (message, walked, indexed)
+        assert repo.commit(indexed[0]).message.strip() == 'main-change', repo.commit(indexed[0]).message
+    print("index agrees with the walk, also after an `-s ours` merge")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commits', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, 'work')
+        makeHistory(work, args.commits)
+        subprocess.check_call(['git', 'clone', '-q', '--bare', work, os.path.join(tmp, 'remotes', 'student-submission.git')], env=ENV)
+        repos = StudentRepos(os.path.join(tmp, 'repos'), 'file://' + os.path.join(tmp, 'remotes', '%s-submission.git'))
+        repo = repos.update('student', 'submission').repo
+        head = repo.head.commit.hexsha
+
+        print(f"{args.commits} commits, {len(ASSIGNMENTS)} assignments")
+        print(f"{'':7}{'first (ms)':>12}{'lookup (ms)':>13}{'after a push (ms)':>19}")
+        for name, lookup, arg in (('walk', walk, repo), ('index', index, repos)):
+            start = time.perf_counter()
+            lookup(arg, head)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(args.lookups):
+                lookup(arg, head)
+            each = (time.perf_counter() - start) / args.lookups
+            with open(os.path.join(work, 'a1', 'new.py'), 'a') as f:
+                f.write('x\n')
+            subprocess.check_call(['git', 'add', '-A'], cwd=work, env=ENV)
+            subprocess.check_call(['git', 'commit', '-qm', 'push'], cwd=work, env=ENV)
+            subprocess.check_call(['git', 'push', '-q', os.path.join(tmp, 'remotes', 'student-submission.git'), 'master'], cwd=work, env=ENV)
+            repo = repos.update('student', 'submission').repo
+            head = repo.head.commit.hexsha
+            start = time.perf_counter()
+            lookup(repo if name == 'walk' else repos, head)
+            pushed = time.perf_counter() - start
+            print(f"{name:7}{first * 1000:>12.1f}{each * 1000:>13.2f}{pushed * 1000:>19.1f}")
+        assert walk(repo, head) == index(repos, head)
+        check(repos, os.path.join(tmp, 'remotes', 'student-submission.git'), work)
@@ -0,0 +1,65 @@
+"""
+ Measures what one queue-position poll costs as the grading queue grows, for the old
+ lookup (deserialise the whole queue with q.get_jobs() and find the job in it) and the
+ ticket counters in api/grading_tool/jobs.py.
+
+     python benchmarks/queue_position.py --redis-url redis://localhost:12345/15
+
+ Best pointed at a scratch redis database, although it only touches its own queue and
+ that queue's ticket counters. Nothing is run; both are deleted at the end.
+"""
+
+import argparse
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.grading_tool import worker, jobs
+
+QUEUE_NAME = 'benchmark-queue-position'
+
+def per_poll(n, fn):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+def old_position(q, conn, job_id):
+    job = rq.job.Job.fetch(job_id, connection=conn)
+    queued = q.get_jobs()
+    return queued.index(job) + 1
+
+def new_position(q, conn, job_id):
+    job = rq.job.Job.fetch(job_id, connection=conn)
+    return jobs.getPosition(job)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default=worker.redis_url)
+    parser.add_argument('--sizes', default='10,100,300,1000,3000', help="queue lengths to measure")
+    parser.add_argument('--polls', type=int, default=50, help="polls timed per queue length")
+    args = parser.parse_args()
+
+    import rq
+    worker.redis_url = args.redis_url
+    conn = worker.getConnection()
+    q = rq.Queue(QUEUE_NAME, connection=conn)
+    conn.delete(*jobs.ticketKeys(QUEUE_NAME))
+
+    print(f"{'queued':>8}{'old us/poll':>14}{'new us/poll':>14}{'old poll cycle (s)':>20}{'new poll cycle (s)':>20}")
+    try:
+        enqueued = []
+        for size in [int(s) for s in args.sizes.split(',')]:
+            while len(enqueued) < size:
+                enqueued.append(jobs.enqueue(q, 'os.getpid', ()).id)
+            last = enqueued[-1]
+            assert old_position(q, conn, last) == new_position(q, conn, last) == size
+            old = per_poll(args.polls, lambda: old_position(q, conn, last))
+            new = per_poll(args.polls, lambda: new_position(q, conn, last))
+            # every queued student polling once
+            print(f"{size:>8}{old:>14.0f}{new:>14.0f}{old * size / 1e6:>20.2f}{new * size / 1e6:>20.3f}")
+    finally:
+        q.empty()
+        q.delete()
+        conn.delete(*jobs.ticketKeys(QUEUE_NAME))
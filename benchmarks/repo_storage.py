@@ -0,0 +1,118 @@
+"""
+ Compares checking out student repositories as two full clones per student (grading
+ tool and battles, what the silo server used to do) with one mirror per student
+ borrowing the starter code's objects plus two worktrees (utils/repos.py).
+
+     python benchmarks/repo_storage.py --students 20 --starter-mb 20
+
+ Builds a stand-in starter repository (--starter-commits commits of random files,
+ about --starter-mb MB of objects) and one repository per student made from it plus a
+ few commits of their own, all local and reached over file:// so git transfers
+ objects like it would over the network. Reports the time of the first checkout of
+ every student, of a sync once every student pushed another commit, of a sync with
+ nothing new, and the disk used by the repositories (git objects; the checked out files
+ are the same either way).
+"""
+
+import subprocess
+import tempfile
+import argparse
+import shutil
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.utils.repos import StudentRepos
+
+ENV = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+    GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+WORKTREES = ('submission', 'battles')
+
+def sh(*args, cwd=None):
+    subprocess.check_call(args, cwd=cwd, env=ENV, stdout=subprocess.DEVNULL)
+
+def commit(work_dir, path, size, message):
+    os.makedirs(os.path.dirname(os.path.join(work_dir, path)), exist_ok=True)
+    with open(os.path.join(work_dir, path), 'wb') as f:
+        f.write(os.urandom(size))
+    sh('git', 'add', '-A', cwd=work_dir)
+    sh('git', 'commit', '-qm', message, cwd=work_dir)
+
+def makeRemotes(tmp, args):
+    work = os.path.join(tmp, 'work')
+    remotes = os.path.join(tmp, 'remotes')
+    sh('git', 'init', '-q', work)
+    sh('git', 'symbolic-ref', 'HEAD', 'refs/heads/master', cwd=work)
+    size = args.starter_mb * (1 << 20) // args.starter_commits
+    for i in range(args.starter_commits):
+        commit(work, 'a%d/starter%d.bin' % (i % 4 + 1, i), size, 'starter %d' % i)
+    sh('git', 'clone', '-q', '--bare', work, os.path.join(remotes, 'starter.git'))
+    for s in range(args.students):
+        commit(work, 'a1/student.py', 4096, 'student %d' % s)
+        sh('git', 'clone', '-q', '--bare', work, os.path.join(remotes, 'student%d-submission.git' % s))
+        sh('git', 'reset', '-q', '--hard', 'HEAD~1', cwd=work)
+    return work, 'file://' + remotes
+
+def push(work, url, students):
+    for s in range(students):
+        sh('git', 'fetch', '-q', url + '/student%d-submission.git' % s, 'HEAD', cwd=work)
+        sh('git', 'checkout', '-q', 'FETCH_HEAD', cwd=work)
+        commit(work, 'a1/student.py', 4096, 'more')
+        sh('git', 'push', '-q', url + '/student%d-submission.git' % s, 'HEAD:refs/heads/master', cwd=work)
+
+def du(path, skip=()):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in skip]
+        total += sum(os.lstat(os.path.join(root, name)).st_size for name in files)
+    return total
+
+def clones(repos_dir, url, students, first):
+    for s in range(students):
+        for name in WORKTREES:
+            repo_dir = os.path.join(repos_dir, 'student%d' % s, name)
+            if first:
+                sh('git', 'clone', '-q', url + '/student%d-submission.git' % s, repo_dir)
+            else:
+                sh('git', 'pull', '-q', cwd=repo_dir)
+
+def mirrors(repos_dir, url, students, first):
+    repos = StudentRepos(repos_dir, url + '/%s-submission.git', url + '/starter.git')
+    for s in range(students):
+        for name in WORKTREES:
+            assert repos.update('student%d' % s, name) is not None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=20)
+    parser.add_argument('--starter-mb', type=int, default=20, help="size of the starter code's history")
+    parser.add_argument('--starter-commits', type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work, url = makeRemotes(tmp, args)
+        print(f"{args.students} students, starter code {args.starter_mb} MB in {args.starter_commits} commits")
+        print(f"{'':9}{'first (s)':>11}{'sync (s)':>10}{'no-op (s)':>11}{'git data (MB)':>15}")
+        timed = []
+        for name, checkout in (('clones', clones), ('mirrors', mirrors)):
+            repos_dir = os.path.join(tmp, name)
+            start = time.perf_counter()
+            checkout(repos_dir, url, args.students, True)
+            first = time.perf_counter() - start
+            timed.append((name, checkout, repos_dir, first))
+        push(work, url, args.students)
+        for name, checkout, repos_dir, first in timed:
+            start = time.perf_counter()
+            checkout(repos_dir, url, args.students, False)
+            sync = time.perf_counter() - start
+            start = time.perf_counter()
+            checkout(repos_dir, url, args.students, False)
+            noop = time.perf_counter() - start
+            # everything but the checked out files
+            files = sum(du(os.path.join(repos_dir, 'student%d' % s, n), skip=('.git',))
+                for s in range(args.students) for n in WORKTREES)
+            print(f"{name:9}{first:>11.2f}{sync:>10.2f}{noop:>11.2f}{(du(repos_dir) - files) / (1 << 20):>15.1f}")
+            shutil.rmtree(repos_dir)
@@ -0,0 +1,88 @@
+"""
+ Compares request latency of the app served through CGI (api.cgi, one interpreter per
+ request) against the persistent pre-forked server (run_app_server.py).
+
+ Run from the repository root with the production configs in place:
+
+     python benchmarks/serving_modes.py --requests 200 --path /grading-tool/assignments
+
+ The CGI numbers include interpreter start-up and imports, exactly like a request
+ through Apache does; they do not include Apache's own fork/exec overhead.
+"""
+
+import http.client
+import subprocess
+import argparse
+import socket
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    k = (len(samples) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(samples) - 1)
+    return samples[f] + (samples[c] - samples[f]) * (k - f)
+
+def bench_cgi(path, n):
+    path, _, query = path.partition('?')
+    env = dict(os.environ, REQUEST_METHOD='GET', PATH_INFO=path, QUERY_STRING=query, SCRIPT_NAME='/api.cgi',
+        SERVER_NAME='localhost', SERVER_PORT='80', SERVER_PROTOCOL='HTTP/1.1', GATEWAY_INTERFACE='CGI/1.1')
+    samples, statuses = [], {}
+    for _ in range(n):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, 'api.cgi'], cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        samples.append(time.perf_counter() - start)
+        status = out.split(b'\r\n', 1)[0].decode(errors='replace')
+        statuses[status] = statuses.get(status, 0) + 1
+    return samples, statuses
+
+def _wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("app server did not start")
+
+def bench_persistent(path, n, port, workers):
+    server = subprocess.Popen([sys.executable, 'run_app_server.py', '--port', str(port), '--workers', str(workers), '--quiet'],
+        cwd=ROOT, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for(port)
+        # first request warms the worker up (imports, configs); it's not what we're measuring
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', path)
+        conn.getresponse().read()
+        samples, statuses = [], {}
+        for _ in range(n):
+            start = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', path)
+            r = conn.getresponse()
+            r.read()
+            samples.append(time.perf_counter() - start)
+            statuses[r.status] = statuses.get(r.status, 0) + 1
+        return samples, statuses
+    finally:
+        server.terminate()
+        server.wait()
+
+def report(name, samples, statuses):
+    print(f"{name:<12} p50 {percentile(samples, 50)*1000:8.1f} ms   p99 {percentile(samples, 99)*1000:8.1f} ms   statuses {statuses}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--path', default='/grading-tool/assignments')
+    parser.add_argument('--port', type=int, default=30099)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    report("cgi", *bench_cgi(args.path, args.requests))
+    report("persistent", *bench_persistent(args.path, args.requests, args.port, args.workers))
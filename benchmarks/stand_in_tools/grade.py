@@ -0,0 +1,32 @@
+"""
+ Stand-in for the grading tools' grade.py, for benchmarks/worker_throughput.py. Has the
+ same `tools` and `safeGrade` the worker uses, but instead of running a test suite it
+ keeps a core busy for STAND_IN_SECONDS (default 0.2) and writes a small report.
+ STAND_IN_IMPORT_SECONDS (default 0) stands for the time the real one takes to import
+ its test suites and their dependencies.
+"""
+
+from collections import namedtuple
+import time
+import os
+
+SECONDS = float(os.getenv('STAND_IN_SECONDS', '0.2'))
+IMPORT_SECONDS = float(os.getenv('STAND_IN_IMPORT_SECONDS', '0'))
+
+def _busy(seconds):
+    start = time.process_time()
+    n = 0
+    while time.process_time() - start < seconds:
+        n += 1
+    return n
+
+_busy(IMPORT_SECONDS)
+
+Tool = namedtuple('Tool', 'testSuite title')
+tools = {'a%d' % i: Tool(None, 'Stand-in assignment %d' % i) for i in range(1, 9)}
+
+def safeGrade(submission_dir, html_file, testSuite, title, redact=False, include_subjective=True, github_link=None):
+    n = _busy(SECONDS)
+    with open(html_file, 'w') as f:
+        f.write(f'<html><body><h1>{title}</h1><p>{n} iterations</p></body></html>')
+    return {'score': 0, 'title': title}
@@ -0,0 +1,85 @@
+"""
+ Measures interpreter start-up plus import time of the entry points, which is most of
+ the latency of every request while we're served through CGI.
+
+     python benchmarks/startup.py                  # human readable
+     python benchmarks/startup.py --json           # for CI to track
+     python benchmarks/startup.py --max-ms 250     # exit 1 if api.cgi_server takes longer
+
+ Import times come from `python -X importtime` (the cumulative time of each module
+ imported directly by the entry point); wall-clock times include interpreter start-up.
+"""
+
+import subprocess
+import argparse
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = [
+    'api.cgi_server',               # what api.cgi imports on every request
+    'api.grading_tool.silo_server',
+    'api.grading_tool.worker',      # imported by RQ work horses to run jobs
+]
+
+def import_times(module):
+    """
+    Returns (total_us, {module: cumulative_us}) for the modules imported at the
+    top level of `module`'s import tree.
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+    total = 0
+    modules = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            total += int(cumulative)
+        if depth <= 1:
+            modules[name] = max(modules.get(name, 0), int(cumulative))
+    return total, modules
+
+def wall_time(module, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], cwd=ROOT, check=True)
+        samples.append(time.perf_counter() - start)
+    return sorted(samples)[len(samples) // 2]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help="runs per entry point (median is reported)")
+    parser.add_argument('--top', type=int, default=8, help="slowest imports to list per entry point")
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--max-ms', type=float, default=None, help="fail if api.cgi_server's median wall time exceeds this")
+    args = parser.parse_args()
+
+    results = {}
+    for module in ENTRY_POINTS:
+        runs = [import_times(module) for _ in range(args.runs)]
+        total = sorted(r[0] for r in runs)[len(runs) // 2]
+        results[module] = {
+            'wall_ms': round(wall_time(module, args.runs) * 1000, 1),
+            'import_ms': round(total / 1000, 1),
+            'slowest': {name: round(us / 1000, 1) for name, us in
+                sorted(runs[-1][1].items(), key=lambda i: i[1], reverse=True)[:args.top]},
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for module, result in results.items():
+            print(f"{module}: {result['wall_ms']} ms wall, {result['import_ms']} ms importing")
+            for name, ms in result['slowest'].items():
+                print(f"    {ms:8.1f} ms  {name}")
+
+    if args.max_ms is not None and results['api.cgi_server']['wall_ms'] > args.max_ms:
+        sys.exit(1)
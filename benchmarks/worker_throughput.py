@@ -0,0 +1,87 @@
+"""
+ Measures grading throughput (jobs/s) with 1, 2, 4, ... worker processes under
+ run_supervisor.py. Jobs are real runTest jobs, but the grading tools are the stand-in
+ in benchmarks/stand_in_tools, which keeps a core busy for --seconds per job instead of
+ running a test suite.
+
+     python benchmarks/worker_throughput.py --workers 1,2,4,8 --jobs 64 --seconds 0.2
+
+ Needs a redis server (REDISTOGO_URL, or --redis-url); only the `benchmark` queue is
+ used. Each run starts a fresh supervisor with a fixed pool, waits for its workers to
+ register, then times from enqueueing the first job to the last one finishing.
+"""
+
+import subprocess
+import tempfile
+import argparse
+import signal
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rq import Worker
+from rq.registry import FinishedJobRegistry, FailedJobRegistry
+
+from api.grading_tool import worker, jobs, queues
+
+QUEUE_NAME = 'benchmark'
+TOOLS_DIR = os.path.join(ROOT, 'benchmarks', 'stand_in_tools')
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError()
+        time.sleep(0.05)
+
+def run(n, args, tmp):
+    conn = worker.getConnection()
+    q = queues.getQueue(QUEUE_NAME)
+    q.empty()
+    for registry in (FinishedJobRegistry(queue=q), FailedJobRegistry(queue=q)):
+        for job_id in registry.get_job_ids():
+            registry.remove(job_id, delete_job=True)
+
+    env = dict(os.environ, REDISTOGO_URL=args.redis_url, STAND_IN_SECONDS=str(args.seconds))
+    supervisor = subprocess.Popen([sys.executable, 'run_supervisor.py', '--workers', str(n), '--queues', QUEUE_NAME,
+        '--grading-tools', TOOLS_DIR],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(lambda: len(Worker.all(queue=q)) >= n, 30)
+        start = time.perf_counter()
+        for i in range(args.jobs):
+            jobs.enqueue(q, worker.runTest, ('a1', tmp, os.path.join(tmp, 'job%d.html' % i), None, TOOLS_DIR),
+                result_ttl=600)
+        done = lambda: FinishedJobRegistry(queue=q).count + FailedJobRegistry(queue=q).count >= args.jobs
+        wait_for(done, args.jobs * args.seconds * 2 + 60)
+        elapsed = time.perf_counter() - start
+        failed = FailedJobRegistry(queue=q).count
+    finally:
+        supervisor.send_signal(signal.SIGTERM)
+        supervisor.wait()
+    # workers that were killed rather than drained leave their keys behind
+    for w in Worker.all(queue=q):
+        w.register_death()
+    return elapsed, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4', help="comma separated pool sizes")
+    parser.add_argument('--jobs', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=0.2, help="CPU seconds per stand-in job")
+    parser.add_argument('--redis-url', default=os.getenv('REDISTOGO_URL', 'redis://localhost:30006'))
+    args = parser.parse_args()
+    worker.redis_url = args.redis_url
+
+    print(f"{args.jobs} jobs of {args.seconds}s CPU each, {os.cpu_count()} cores")
+    print(f"{'workers':>8}{'seconds':>10}{'jobs/s':>10}{'speedup':>10}{'failed':>8}")
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in map(int, args.workers.split(',')):
+            elapsed, failed = run(n, args, tmp)
+            rate = args.jobs / elapsed
+            base = base or rate
+            print(f"{n:>8}{elapsed:>10.2f}{rate:>10.2f}{rate / base:>9.2f}x{failed:>8}")
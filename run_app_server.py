@@ -0,0 +1,23 @@
+## Long-lived alternative to api.cgi: serves the same combined app from pre-forked,
+## threaded workers that keep imports, configs and HTTP sessions warm between requests.
+##
+##   python run_app_server.py --port 30007 --workers 4
+##
+## Send SIGHUP for a graceful reload (e.g. after a deploy) and SIGTERM to stop.
+
+import argparse
+import os
+
+from api.utils.app_server import AppServer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the CGI app from persistent workers.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=30007)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--max-requests', type=int, default=0, help="recycle workers after this many requests")
+    parser.add_argument('--quiet', action='store_true', help="don't log every request")
+    args = parser.parse_args()
+
+    AppServer('api.cgi_server:app', host=args.host, port=args.port, workers=args.workers,
+        max_requests=args.max_requests, quiet=args.quiet).run()
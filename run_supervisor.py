@@ -0,0 +1,41 @@
+## Runs and autoscales a pool of RQ workers on the grading queues (see
+## api/grading_tool/supervisor.py):
+##
+##   python run_supervisor.py                                    # one worker per core
+##   python run_supervisor.py --min-workers 2 --max-workers 8    # scale with the backlog
+##
+## Send SIGTERM (or Ctrl-C) to drain: running jobs finish, then everything exits.
+
+import argparse
+import os
+
+from api.grading_tool.supervisor import Supervisor
+from api.grading_tool import queues, GRADING_TOOLS_DIR
+
+redis_url = os.getenv('REDISTOGO_URL', 'redis://localhost:30006')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a pool of RQ workers on the grading queues.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+        help="workers to run when not scaling (default: one per core)")
+    parser.add_argument('--min-workers', type=int, help="scale down to this many (default: --workers)")
+    parser.add_argument('--max-workers', type=int, help="scale up to this many (default: --workers)")
+    parser.add_argument('--backlog-per-worker', type=int, default=2, help="waiting jobs per extra worker")
+    parser.add_argument('--max-wait', type=float, default=60,
+        help="add a worker when the oldest job has waited this many seconds")
+    parser.add_argument('--cooldown', type=float, default=60, help="seconds of surplus before a worker is stopped")
+    parser.add_argument('--interval', type=float, default=5, help="seconds between looks at the queues")
+    parser.add_argument('--scheduling', choices=['strict', 'weighted'], default='strict',
+        help="strict: always the highest-priority non-empty queue; weighted: see WeightedWorker")
+    parser.add_argument('--queues', nargs='+', default=queues.PRIORITY,
+        help="queues to listen on, highest priority first (default: %(default)s)")
+    parser.add_argument('--grading-tools', default=GRADING_TOOLS_DIR,
+        help="preload the grading tools from here before forking each job (default: %(default)s)")
+    parser.add_argument('--no-preload', action='store_true', help="let every job import the grading tools itself")
+    args = parser.parse_args()
+
+    Supervisor(redis_url, args.queues, scheduling=args.scheduling,
+        grading_tools_dir=None if args.no_preload else args.grading_tools,
+        min_workers=args.min_workers or args.workers, max_workers=args.max_workers or args.workers,
+        backlog_per_worker=args.backlog_per_worker, max_wait=args.max_wait, cooldown=args.cooldown,
+        interval=args.interval).run()
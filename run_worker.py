@@ -1,13 +1,21 @@
-from rq import Worker, Queue, Connection
-import redis
-import sys
+import argparse
 import os
 
-listen = ['default']
+from api.grading_tool.supervisor import makeWorker
+from api.grading_tool import queues, GRADING_TOOLS_DIR
+
 redis_url = os.getenv('REDISTOGO_URL', 'redis://localhost:30006')
-conn = redis.from_url(redis_url)
 
 if __name__ == "__main__":
-    with Connection(conn):
-        worker = Worker([Queue(name, default_timeout=600) for name in listen])
-        worker.work()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Runs an RQ worker on the grading queues.")
+    parser.add_argument('--scheduling', choices=['strict', 'weighted'], default='strict',
+        help="strict: always the highest-priority non-empty queue; weighted: see WeightedWorker")
+    parser.add_argument('--queues', nargs='+', default=queues.PRIORITY,
+        help="queues to listen on, highest priority first (default: %(default)s)")
+    parser.add_argument('--grading-tools', default=GRADING_TOOLS_DIR,
+        help="preload the grading tools from here before forking each job (default: %(default)s)")
+    parser.add_argument('--no-preload', action='store_true', help="let every job import the grading tools itself")
+    args = parser.parse_args()
+
+    makeWorker(redis_url, args.queues, args.scheduling,
+        grading_tools_dir=None if args.no_preload else args.grading_tools).work()
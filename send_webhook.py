@@ -0,0 +1,59 @@
+## Stands in for github.iu.edu: sends a signed push event for a student's repository to
+## the silo server's webhook (see api/grading_tool/webhooks.py), to try it out locally:
+##
+##   python send_webhook.py alice                      # to the configured silo server
+##   python send_webhook.py alice --url http://localhost:30005/grading-tool/webhooks/push
+##   python send_webhook.py alice --event ping
+##   python send_webhook.py alice --secret wrong       # should be refused with a 401
+
+import argparse
+import hashlib
+import hmac
+import json
+import uuid
+
+import requests
+
+from api import REPO_URL
+from api.grading_tool import SILO_SERVER_URL, WEBHOOK_SECRET
+
+def makePayload(login, ref, before, after, repo_url=REPO_URL):
+    """ The parts of GitHub's push event payload the webhook looks at, and a few more. """
+    url = repo_url % login
+    name = url.rsplit('/', 1)[-1].rsplit(':', 1)[-1]
+    name = name[:-len('.git')] if name.endswith('.git') else name
+    return {
+        'ref': ref,
+        'before': before,
+        'after': after,
+        'created': before == '0' * 40,
+        'deleted': after == '0' * 40,
+        'forced': False,
+        'commits': [],
+        'repository': {'name': name, 'ssh_url': url},
+        'pusher': {'name': login},
+        'sender': {'login': login},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends a signed GitHub push event to the silo server's webhook.")
+    parser.add_argument('login', help="student whose repository was pushed to")
+    parser.add_argument('--url', default=SILO_SERVER_URL + '/webhooks/push')
+    parser.add_argument('--repo-url', default=REPO_URL, help="URL of the repositories, %%s for the login (default: %(default)s)")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET, help="sign with this instead of webhook_secret")
+    parser.add_argument('--event', default='push', help="X-GitHub-Event (default: %(default)s)")
+    parser.add_argument('--ref', default='refs/heads/master')
+    parser.add_argument('--before', default='0' * 40)
+    parser.add_argument('--after', default='0' * 40)
+    args = parser.parse_args()
+
+    body = json.dumps(makePayload(args.login, args.ref, args.before, args.after, args.repo_url)).encode()
+    signature = 'sha256=' + hmac.new(args.secret.encode(), body, hashlib.sha256).hexdigest()
+    r = requests.post(args.url, data=body, timeout=30, headers={
+        'Content-Type': 'application/json',
+        'User-Agent': 'GitHub-Hookshot/stand-in',
+        'X-GitHub-Event': args.event,
+        'X-GitHub-Delivery': str(uuid.uuid4()),
+        'X-Hub-Signature-256': signature,
+    })
+    print(r.status_code, r.text.strip())